@@ -1,52 +1,66 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import json
-from pathlib import Path
+import asyncio
+from typing import Optional
 import time
 import httpx  # 🔥 for making internal HTTP requests
 
+from app.core.settings import (AGENT_BASE_URL, AGENT_HTTP2, AGENT_MAX_CONNECTIONS, AGENT_MODE, CHAT_LOG_PATH,
+                               LEGACY_CHAT_LOG_PATH)
+from app.services.agent_service import create_agent_client
+from app.services.chat_store import DEFAULT_SESSION, MAX_PAGE_SIZE, ChatStore
+from app.utils.lazy import Lazy
+from app.utils.sse import sse_event
+
 router = APIRouter()
-chat_log_path = Path("docs/chat_log.json")
-chat_log_path.parent.mkdir(parents=True, exist_ok=True)
+
+
+def open_chat_store() -> ChatStore:
+    store = ChatStore(CHAT_LOG_PATH)
+    store.import_json(LEGACY_CHAT_LOG_PATH)
+    return store
+
+
+# Opened (and the old JSON log imported) by the app lifespan, or on first use; importing the router touches no files
+chat_store = Lazy(open_chat_store)
+# Shared by every message; opened and closed by the app lifespan (app/main.py)
+agent_client = create_agent_client(AGENT_MODE, AGENT_BASE_URL, http2=AGENT_HTTP2,
+                                   max_connections=AGENT_MAX_CONNECTIONS)
 
 class ChatMessage(BaseModel):
     query: str
+    session_id: str = DEFAULT_SESSION
 
-def load_chat_log():
-    if chat_log_path.exists():
-        return json.loads(chat_log_path.read_text(encoding="utf-8"))
-    return []
+async def record_turn(new_user_msg: dict, agent_reply: str, session_id: str = DEFAULT_SESSION):
+    """Append a user message and the agent's reply to the session's chat log"""
+    new_user_msg["processed"] = True
+    assistant_msg = {
+        "role": "assistant",
+        "content": agent_reply,
+        "timestamp": time.time(),
+        "processed": True
+    }
 
-def save_chat_log(chat_data):
-    chat_log_path.write_text(json.dumps(chat_data, indent=2), encoding="utf-8")
+    # One INSERT transaction for both messages, off the event loop; the store
+    # serializes concurrent writers, so nothing has to be read back first
+    await asyncio.to_thread(chat_store.append, [new_user_msg, assistant_msg], session_id)
 
-@router.post("/chat-with-agent")
-async def chat_with_agent(msg: ChatMessage):
-    chat_data = load_chat_log()
-
-    new_user_msg = {
+def new_user_message(query: str) -> dict:
+    return {
         "role": "user",
-        "content": msg.query,
+        "content": query,
         "timestamp": time.time(),
         "processed": False
     }
-    chat_data.append(new_user_msg)
-
-    unprocessed = [m for m in chat_data if m["role"] == "user" and not m.get("processed")]
-    if not unprocessed:
-        save_chat_log(chat_data)
-        return {"response": "No new message found."}
 
-    last_msg = unprocessed[-1]
-    last_msg["processed"] = True
+@router.post("/chat-with-agent")
+async def chat_with_agent(msg: ChatMessage):
+    new_user_msg = new_user_message(msg.query)
 
     try:
-        async with httpx.AsyncClient() as client:
-            print("Sending query:", msg.query)
-            response = await client.post("http://127.0.0.1:8000/process", json={"query": msg.query}, timeout=60)
-            print("Raw response:", response.text)
-            response.raise_for_status()
-            agent_reply = response.json().get("result", "Agent returned no result.")
+        print("Sending query:", msg.query)
+        agent_reply = await agent_client.process(msg.query)
     except httpx.HTTPStatusError as http_err:
         print("HTTP Error:", http_err.response.status_code, http_err.response.text)
         agent_reply = f"[Agent HTTP error: {http_err.response.status_code} - {http_err.response.text}]"
@@ -54,29 +68,53 @@ async def chat_with_agent(msg: ChatMessage):
         print("General Error:", repr(e))
         agent_reply = f"[Agent error: {repr(e)}]"
 
-
-    chat_data.append({
-        "role": "assistant",
-        "content": agent_reply,
-        "timestamp": time.time(),
-        "processed": True
-    })
-
-    save_chat_log(chat_data)
+    await record_turn(new_user_msg, agent_reply, msg.session_id)
     print(agent_reply)
 
     return {"response": agent_reply}
 
 
-
+@router.post("/chat-with-agent/stream")
+async def chat_with_agent_stream(msg: ChatMessage):
+    """
+    Server-sent events version of /chat-with-agent: relays the agent's
+    /process/stream output as it is generated ("delta" events, then "done")
+    and writes the full reply to the chat log once the stream finishes.
+    """
+    new_user_msg = new_user_message(msg.query)
+
+    async def events():
+        parts = []
+        try:
+            async for delta in agent_client.stream(msg.query):
+                parts.append(delta)
+                yield sse_event({"delta": delta})
+        except httpx.HTTPStatusError as http_err:
+            error = f"[Agent HTTP error: {http_err.response.status_code} - {http_err.response.text}]"
+            parts.append(error)
+            yield sse_event({"delta": error})
+        except Exception as e:
+            print("General Error:", repr(e))
+            error = f"[Agent error: {repr(e)}]"
+            parts.append(error)
+            yield sse_event({"delta": error})
+        finally:
+            # Also runs when the client disconnects mid-stream, so the partial reply is kept
+            await record_turn(new_user_msg, "".join(parts) or "Agent returned no result.", msg.session_id)
+        yield sse_event({}, event="done")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 
 @router.get("/get-agent-response")
-def get_agent_response():
-    if chat_log_path.exists():
-        chat_data = json.loads(chat_log_path.read_text(encoding="utf-8"))
-        return {"chat_history": chat_data}
-    return {"chat_history": []}
+def get_agent_response(session_id: str = DEFAULT_SESSION, cursor: Optional[int] = None,
+                       limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE)):
+    """
+    One page of a session's history, oldest first. Pass `next_cursor` back as
+    `cursor` for the following page; it is null on the last page.
+    """
+    chat_data, next_cursor = chat_store.page(session_id, cursor, limit)
+    return {"chat_history": chat_data, "next_cursor": next_cursor}
 
 
 @router.get("/check-status")
@@ -85,7 +123,7 @@ def check_status():
 
 
 @router.delete("/clear-chat")
-def clear_chat():
-    if chat_log_path.exists():
-        chat_log_path.unlink()
+def clear_chat(session_id: Optional[str] = None):
+    """Clear one session, or the whole log when no session_id is given"""
+    chat_store.clear(session_id)
     return {"status": "Chat log cleared"}
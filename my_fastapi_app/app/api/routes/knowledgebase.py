@@ -1,9 +1,26 @@
-from fastapi import APIRouter, UploadFile, File, Form
-import os
-from typing import List
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request
+
+from app.core.settings import DEFAULT_KB, KB_UPLOAD_DIR, KB_UPLOAD_MAX_MB
+from app.services.kb_service import process_uploads
+from app.utils.uploads import UploadError, UploadTooLarge, receive_files
 
 router = APIRouter()
 
+# The body is parsed by receive_files, so the form is described here for the docs UI
+ADD_FILES_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "required": ["files"],
+            "properties": {
+                "files": {"type": "array", "items": {"type": "string", "format": "binary"}},
+                "kb_name": {"type": "string", "default": DEFAULT_KB},
+            },
+        }}},
+    }
+}
+
 
 @router.get("/create-knowledgebase")
 def createKnowledgebase():
@@ -25,24 +42,31 @@ def deleteKnowledgebase():
     return {"message": "Knowledgebase deleted"}
 
 
-@router.post("/add-files")
-async def upload_files(
-    files: List[UploadFile] = File(...),
-    kb_name: str = Form(default="default_kb")
-):
-    upload_dir = f"docs"
-    os.makedirs(upload_dir, exist_ok=True)
-
-    saved_files = []
-    for file in files:
-        file_path = os.path.join(upload_dir, file.filename)
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-        saved_files.append(file.filename)
-
-    return {"message": "Files uploaded successfully", "files": saved_files}
-
+@router.post("/add-files", openapi_extra=ADD_FILES_BODY)
+async def upload_files(request: Request, background_tasks: BackgroundTasks):
+    # Streamed to disk as it arrives (constant memory), hashed on the way, renamed into place when complete
+    try:
+        fields, files = await receive_files(request, KB_UPLOAD_DIR, KB_UPLOAD_MAX_MB * 1024 * 1024)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not files:
+        raise HTTPException(status_code=400, detail="No files in the upload")
+
+    kb_name = fields.get("kb_name") or DEFAULT_KB
+    # Duplicates are written under their own name too; only unchanged files need nothing done
+    saved = [f for f in files if f.status != "unchanged"]
+    if saved:
+        # Ingestion and the feature refresh run after the response is sent
+        background_tasks.add_task(process_uploads, saved, kb_name)
+
+    return {
+        "message": "Files uploaded successfully",
+        "files": [f.filename for f in files],
+        "uploads": [{"filename": f.filename, "status": f.status, "size": f.size, "sha256": f.sha256,
+                     "duplicate_of": f.duplicate_of} for f in files],
+    }
 
 
 @router.get("/list-files")
@@ -0,0 +1,223 @@
+"""
+Prometheus-style metrics, without the prometheus_client dependency.
+
+Counters and histograms register themselves in one process-wide registry
+that `render()` writes out in the Prometheus text exposition format for the
+/metrics endpoints. `stage(name, target)` times a block of work into the
+`credit_stage_seconds` histogram:
+
+    csv_load            one source CSV (target: file name)
+    agent               one master_agent agent (target: agent name)
+    master_agent_merge  joining the agents' frames
+    name_lookup         finding the user a query or name refers to
+    health_check        Ollama probe ("probe") or the per-request check ("request")
+    llm_generation      one model call (target: model)
+    chat_log            chat history I/O (target: append, page, clear)
+    warmup              startup feature build ("features") and model load ("model")
+    embedding           one batch of knowledge-base texts sent to the embedding model (target: model)
+    ml_scoring          trained-model predictions (target: model version)
+
+The fallback rate is credit_assessments_total{source="rules"} (or "ml", with a
+trained model loaded) over all credit_assessments_total. Requests that
+joined an identical computation already in flight
+(app/services/single_flight.py) are counted in
+credit_coalesced_requests_total, the computations in
+credit_single_flights_total.
+
+When a request asks for it (`X-Debug-Stages: 1`, or METRICS_DEBUG_HEADERS=1
+for every request), the stages it ran are also collected for that request
+and returned in a `Server-Timing` response header. Work handed to a thread
+only counts towards the breakdown if it runs in a copy of the request's
+context (server.run_blocking and asyncio.to_thread do); streamed bodies
+finish after the headers are sent, so their stages are only in the
+histograms. Forked worker processes record into their own registry, which
+is never scraped.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.core.settings import METRICS_DEBUG_HEADERS
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEBUG_HEADER = "X-Debug-Stages"
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry: List["_Metric"] = []
+
+# (stage, target, seconds) of the current request, or None when it did not ask for a breakdown
+_request_stages: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("request_stages", default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        if labels.keys() != set(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in values]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (not cumulative) counts, the last slot is +Inf; then the sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return sum(state[0]) if state else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("credit_stage_seconds", "Wall time of one pipeline stage", ["stage", "target"])
+REQUEST_SECONDS = Histogram("credit_http_request_seconds", "Wall time of an HTTP request until its headers",
+                            ["method", "path", "status"])
+ASSESSMENTS = Counter("credit_assessments_total", "Credit assessments by where the answer came from "
+                      "(llm, cache or the rule-based fallback)", ["source"])
+LLM_CALLS = Counter("credit_llm_calls_total", "Model calls by outcome", ["model", "outcome"])
+LLM_TOKENS = Counter("credit_llm_generated_tokens_total", "Tokens generated by the model", ["model"])
+LLM_TOKENS_PER_SECOND = Histogram("credit_llm_tokens_per_second", "Generation speed of one model call", ["model"],
+                                  buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+COALESCED = Counter("credit_coalesced_requests_total", "Requests answered by an identical computation "
+                    "already in flight instead of their own", ["flight"])
+SINGLE_FLIGHTS = Counter("credit_single_flights_total", "Computations started by a request-coalescing group",
+                         ["flight"])
+
+
+def observe_stage(name: str, target: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=name, target=target)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((name, target, seconds))
+
+
+class stage:
+    """Context manager timing a block of work as one stage"""
+    __slots__ = ("name", "target", "_start")
+
+    def __init__(self, name: str, target: str = ""):
+        self.name = name
+        self.target = target
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe_stage(self.name, self.target, time.perf_counter() - self._start)
+        return False
+
+
+def server_timing(stages: List[tuple], total: float) -> str:
+    """Server-Timing header value: milliseconds per (stage, target), summed over repeats, then the total"""
+    summed: Dict[Tuple[str, str], float] = {}
+    for name, target, seconds in stages:
+        summed[(name, target)] = summed.get((name, target), 0.0) + seconds
+    entries = [f'{name};desc="{target}";dur={seconds * 1e3:.2f}' if target else f"{name};dur={seconds * 1e3:.2f}"
+               for (name, target), seconds in summed.items()]
+    entries.append(f"total;dur={total * 1e3:.2f}")
+    return ", ".join(entries)
+
+
+async def stage_timing_middleware(request, call_next):
+    """HTTP middleware: request latency histogram, plus the stage breakdown header when asked for"""
+    debug = METRICS_DEBUG_HEADERS or request.headers.get(DEBUG_HEADER) == "1"
+    token = _request_stages.set([] if debug else None)
+    stages = _request_stages.get()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _request_stages.reset(token)
+    elapsed = time.perf_counter() - start
+    # The route template, not the raw URL, so ids in paths don't each get their own series
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(elapsed, method=request.method, path=getattr(route, "path", "unmatched"),
+                            status=response.status_code)
+    if stages is not None:
+        response.headers["Server-Timing"] = server_timing(stages, elapsed)
+    return response
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text format"""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
@@ -1 +1,88 @@
 # App settings
+import os
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Typed columnar copies of the docs/ CSVs (see app/utils/columnar_cache.py)
+COLUMNAR_CACHE_DIR = os.getenv("COLUMNAR_CACHE_DIR", os.path.join(BASE_DIR, ".cache", "columnar"))
+
+# Chat history (see app/services/chat_store.py); the old JSON log is imported into it once
+CHAT_LOG_PATH = os.getenv("CHAT_LOG_PATH", os.path.join(BASE_DIR, "docs", "chat_log.sqlite3"))
+LEGACY_CHAT_LOG_PATH = os.path.join(BASE_DIR, "docs", "chat_log.json")
+
+# How the chat router reaches the scoring agent (see app/services/agent_service.py):
+# "http" -> pooled keep-alive client to AGENT_BASE_URL, "inprocess" -> call the pipeline directly
+AGENT_MODE = os.getenv("AGENT_MODE", "http")
+AGENT_BASE_URL = os.getenv("AGENT_BASE_URL", "http://127.0.0.1:8000")
+AGENT_HTTP2 = os.getenv("AGENT_HTTP2", "0") == "1"  # needs the h2 package and an https agent URL
+AGENT_MAX_CONNECTIONS = int(os.getenv("AGENT_MAX_CONNECTIONS", "32"))
+
+# Knowledge bases (see app/services/vector_index.py): versioned FAISS stores under KB_VECTOR_STORE_DIR,
+# memory-mapped instead of read into RAM with KB_INDEX_MMAP=1; how often (seconds) a search checks
+# for a version published by another process
+KB_VECTOR_STORE_DIR = os.getenv("KB_VECTOR_STORE_DIR", os.path.join(BASE_DIR, "app", "vectorstore"))
+KB_INDEX_MMAP = os.getenv("KB_INDEX_MMAP", "0") == "1"
+KB_INDEX_CHECK_INTERVAL = float(os.getenv("KB_INDEX_CHECK_INTERVAL", "1"))
+DEFAULT_KB = "default_kb"
+# Chunk embeddings (see app/services/embeddings.py): a sentence-transformers model name or local
+# directory, texts per model batch, and the embedding cache (KB_EMBEDDING_CACHE_PATH="" keeps it in
+# memory). The model is only read from local files; run once with KB_EMBEDDING_LOCAL_ONLY=0 to download it
+KB_EMBEDDING_MODEL = os.getenv("KB_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+KB_EMBEDDING_BATCH_SIZE = int(os.getenv("KB_EMBEDDING_BATCH_SIZE", "64"))
+KB_EMBEDDING_CACHE_PATH = os.getenv("KB_EMBEDDING_CACHE_PATH", os.path.join(BASE_DIR, ".cache", "kb_embeddings.sqlite3"))
+KB_EMBEDDING_LOCAL_ONLY = os.getenv("KB_EMBEDDING_LOCAL_ONLY", "1") == "1"
+# /kb/add-files (see app/utils/uploads.py): where uploads are placed (the feature store's docs/ directory)
+# and the largest request body accepted, in MiB
+KB_UPLOAD_DIR = os.getenv("KB_UPLOAD_DIR", os.path.join(BASE_DIR, "docs"))
+KB_UPLOAD_MAX_MB = int(os.getenv("KB_UPLOAD_MAX_MB", str(10 * 1024)))
+
+# Ollama
+OLLAMA_HOST = os.getenv("OLLAMA_HOST")  # None -> ollama's default (http://127.0.0.1:11434)
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "gemma3:4b")
+# Background health probe: how often to poll, how long a result stays valid, probe timeout (seconds)
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "15"))
+OLLAMA_HEALTH_TTL = float(os.getenv("OLLAMA_HEALTH_TTL", "30"))
+OLLAMA_PROBE_TIMEOUT = float(os.getenv("OLLAMA_PROBE_TIMEOUT", "2"))
+# Circuit breaker: consecutive LLM failures before opening, seconds before a half-open trial
+OLLAMA_BREAKER_FAILURES = int(os.getenv("OLLAMA_BREAKER_FAILURES", "3"))
+OLLAMA_BREAKER_RESET = float(os.getenv("OLLAMA_BREAKER_RESET", "30"))
+
+# Request path concurrency: threads for blocking pandas work, simultaneous in-flight LLM calls
+FEATURE_WORKERS = int(os.getenv("FEATURE_WORKERS", "4"))
+# Workers for the feature build (master_agent's agents, feature store sources); with
+# AGENT_PROCESSES=1 master_agent runs its agents in forked processes instead of threads
+AGENT_WORKERS = int(os.getenv("AGENT_WORKERS", "4"))
+AGENT_PROCESSES = os.getenv("AGENT_PROCESSES", "0") == "1"
+# Memory budget (MiB) for reading one feature source; 0 loads each CSV whole, otherwise
+# sources are parsed in chunks sized to the budget and their partial aggregates merged
+FEATURE_MEMORY_BUDGET_MB = int(os.getenv("FEATURE_MEMORY_BUDGET_MB", "0"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# Batch LLM scoring (see app/services/llm_batch.py): "concurrent" or "packed" mode, users per
+# packed prompt, attempts per model call and the first retry delay (seconds, doubled per retry)
+LLM_BATCH_MODE = os.getenv("LLM_BATCH_MODE", "concurrent")
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "8"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "3"))
+LLM_RETRY_DELAY = float(os.getenv("LLM_RETRY_DELAY", "0.5"))
+# Credit assessment output: "text" (free text), "json" (JSON mode) or "schema" (constrained to a JSON
+# schema, needs Ollama >= 0.5). Structured answers are validated, falling back to the rule-based score
+LLM_OUTPUT_FORMAT = os.getenv("LLM_OUTPUT_FORMAT", "text")
+# Generation cap (tokens) per user for structured assessments
+LLM_STRUCTURED_MAX_TOKENS = int(os.getenv("LLM_STRUCTURED_MAX_TOKENS", "256"))
+# Concurrent requests for the same assessment (user features, model, prompt) or the same model call
+# share one computation (see app/services/single_flight.py); "0" runs each request on its own
+REQUEST_COALESCING = os.getenv("REQUEST_COALESCING", "1") == "1"
+
+# Trained credit model (see app/services/ml_scoring.py): versioned artifacts written by train_model.py;
+# the server loads the newest at startup and uses it instead of the rules when the LLM can't answer
+ML_MODEL_DIR = os.getenv("ML_MODEL_DIR", os.path.join(BASE_DIR, "models"))
+# A model is only served if its recorded hold-out AUC reaches this; otherwise the rules stay the fallback
+ML_MIN_HOLDOUT_AUC = float(os.getenv("ML_MIN_HOLDOUT_AUC", "0.7"))
+
+# Metrics (see app/core/metrics.py): return every request's stage timings in a Server-Timing
+# header, not only for requests sent with "X-Debug-Stages: 1"
+METRICS_DEBUG_HEADERS = os.getenv("METRICS_DEBUG_HEADERS", "0") == "1"
+
+# LLM assessment cache (see app/services/llm_cache.py); set LLM_CACHE_PATH="" to keep it in memory only
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(BASE_DIR, ".cache", "llm_assessments.sqlite3"))
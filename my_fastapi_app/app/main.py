@@ -1,11 +1,28 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
+from app.api.routes import chat
+from app.core.metrics import CONTENT_TYPE, render as render_metrics, stage_timing_middleware
 from app.api.routes.agent import router as agentRouter
 from app.api.routes.knowledgebase import router as kbRouter
 from app.api.routes.chat import router as chatRouter
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled agent client (or the in-process pipeline) for the app's lifetime
+    await chat.agent_client.start()
+    await asyncio.to_thread(chat.chat_store.get)
+    yield
+    await chat.agent_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.middleware("http")(stage_timing_middleware)
 
 # ✅ Add this block to allow requests from your frontend
 app.add_middleware(
@@ -14,9 +31,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],  # stage breakdown of requests sent with X-Debug-Stages: 1
 )
 
 # 📦 Route registrations
 app.include_router(agentRouter, prefix="/agent", tags=["Agent"])
 app.include_router(kbRouter, prefix="/kb", tags=["Knowledgebase"])
 app.include_router(chatRouter, prefix="/chat", tags=["Chat"])
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE)
@@ -1 +1,105 @@
-# Business logic for agent
+"""
+Business logic for agent: how the chat router reaches the scoring agent (server.py).
+
+`HttpAgentClient` talks to a separately running agent over one long-lived,
+pooled httpx client, so consecutive messages reuse keep-alive connections
+instead of paying for a new pool and TCP handshake each time.
+`InProcessAgentClient` calls the scoring pipeline directly when the agent
+runs in the same process, skipping HTTP and the JSON round trip entirely.
+"""
+import asyncio
+from typing import AsyncIterator, Optional
+
+import httpx
+
+from app.utils.sse import iter_sse
+
+try:
+    import h2  # noqa: F401  (httpx only negotiates HTTP/2 when the h2 package is installed)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class HttpAgentClient:
+    def __init__(self, base_url: str, http2: bool = False, max_connections: int = 32, timeout: float = 60.0):
+        self.base_url = base_url.rstrip("/")
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The shared pooled client, (re)created if it is not open"""
+        if self._client is None or self._client.is_closed:
+            limits = httpx.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_connections, keepalive_expiry=30)
+            self._client = httpx.AsyncClient(base_url=self.base_url, http2=self.http2, limits=limits,
+                                             timeout=self.timeout)
+        return self._client
+
+    async def start(self):
+        """Open the connection pool up front instead of on the first message"""
+        _ = self.client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def process(self, query: str) -> str:
+        """Agent's answer to one query; raises httpx.HTTPStatusError on a non-2xx reply"""
+        response = await self.client.post("/process", json={"query": query})
+        response.raise_for_status()
+        return response.json().get("result", "Agent returned no result.")
+
+    async def stream(self, query: str) -> AsyncIterator[str]:
+        """Answer chunks from /process/stream as they are generated"""
+        async with self.client.stream("POST", "/process/stream", json={"query": query}) as response:
+            if response.status_code != 200:
+                await response.aread()
+                response.raise_for_status()
+            async for event, payload in iter_sse(response.aiter_lines()):
+                if event == "message" and "delta" in payload:
+                    yield payload["delta"]
+
+
+class InProcessAgentClient:
+    """Runs the scoring pipeline in this process; server.py is imported on first use"""
+
+    def __init__(self):
+        self._server = None
+
+    @property
+    def server(self):
+        if self._server is None:
+            import server
+            self._server = server
+        return self._server
+
+    async def start(self):
+        # The same startup as server.py's own: the trained model, feature table and LLM warm up
+        # on a background thread while the app already serves
+        server = await asyncio.to_thread(lambda: self.server)
+        server.start_background_warm_up()
+
+    async def aclose(self):
+        if self._server is not None:
+            self._server.ollama_health.stop()
+
+    async def process(self, query: str) -> str:
+        return await self.server.process_user_query_async(query)
+
+    async def stream(self, query: str) -> AsyncIterator[str]:
+        async for chunk in self.server.stream_user_query(query):
+            yield chunk
+
+
+def create_agent_client(mode: str, base_url: str, http2: bool = False, max_connections: int = 32):
+    """mode: "http" (separate agent process) or "inprocess" (agent pipeline in this process)"""
+    if mode == "inprocess":
+        return InProcessAgentClient()
+    if mode != "http":
+        raise ValueError(f"Unknown agent mode: {mode!r} (expected 'http' or 'inprocess')")
+    return HttpAgentClient(base_url, http2=http2, max_connections=max_connections)
@@ -0,0 +1,176 @@
+"""
+Per-user statistics over monthly totals.
+
+Event rows are reduced to one total per (user, month) and those totals
+straight to one row per user with the statistics named in a `MonthlySpec`:
+
+    mean        average monthly total over the months with activity
+    std         sample standard deviation of the monthly totals
+    trend       least-squares slope of the monthly total per month
+    regularity  active months / months spanned between first and last activity
+    months      number of active months
+    total       sum over all months
+
+Nothing is ever joined back onto a per-month frame. `user_monthly_stats`
+streams user-grouped event rows block by block and emits each user's row
+as soon as the user is complete, so memory holds one block plus one row per
+user. `monthly_totals` keeps the per-(user, month) totals instead (one
+float per active month, keyed on a packed int64); the feature store holds
+that series as its append-foldable state, since totals of appended rows
+can simply be added to it.
+"""
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+STATS = ('mean', 'std', 'trend', 'regularity', 'months', 'total')
+
+
+class MonthlySpec:
+    """Output column -> statistic of `value`'s monthly totals"""
+
+    def __init__(self, value: str, features: Dict[str, str]):
+        unknown = set(features.values()) - set(STATS)
+        if unknown:
+            raise ValueError(f"Unknown monthly statistics: {sorted(unknown)}")
+        self.value = value
+        self.features = features
+
+    @property
+    def columns(self):
+        return list(self.features)
+
+
+# Monthly totals are keyed on one int64: user_id << MONTH_BITS | month index
+MONTH_BITS = 20
+MONTH_MASK = (1 << MONTH_BITS) - 1
+# Event rows reduced per step in monthly_totals
+BLOCK_ROWS = 1 << 20
+
+
+def month_index(timestamps: pd.Series) -> np.ndarray:
+    """Months since year 0, so consecutive months differ by exactly 1 (NaT -> -1)"""
+    values = timestamps.to_numpy(dtype='datetime64[ns]')
+    months = values.astype('datetime64[M]').astype(np.int64) + 1970 * 12
+    months[np.isnat(values)] = -1
+    return months
+
+
+def _run_starts(sorted_values: np.ndarray) -> np.ndarray:
+    """Positions where a new run of equal values begins"""
+    boundary = np.empty(len(sorted_values), dtype=bool)
+    boundary[:1] = True
+    np.not_equal(sorted_values[1:], sorted_values[:-1], out=boundary[1:])
+    return np.flatnonzero(boundary)
+
+
+def _reduce_sorted(keys: np.ndarray, values: np.ndarray):
+    """Sum values per distinct key; returns (sorted unique keys, sums)"""
+    # The docs/ event files are grouped by user already, which makes this sort nearly free
+    if len(keys) and not (keys[1:] >= keys[:-1]).all():
+        order = np.argsort(keys, kind='stable')
+        keys, values = keys[order], values[order]
+    starts = _run_starts(keys)
+    return keys[starts], (np.add.reduceat(values, starts) if len(keys) else np.zeros(0))
+
+
+def _block_totals(df: pd.DataFrame, value: str, block_rows: int):
+    """(keys, totals) of each block of `block_rows` event rows"""
+    for start in range(0, len(df), block_rows):
+        block = df.iloc[start:start + block_rows]
+        months = month_index(block['timestamp'])
+        valid = months >= 0
+        keys = (block['user_id'].to_numpy(dtype=np.int64) << MONTH_BITS) | months
+        values = np.nan_to_num(block[value].to_numpy(dtype=np.float64))
+        if not valid.all():
+            keys, values = keys[valid], values[valid]
+        yield _reduce_sorted(keys, values)
+
+
+def _totals_series(keys: np.ndarray, totals: np.ndarray) -> pd.Series:
+    return pd.Series(totals, index=pd.Index(keys, name='user_month'))
+
+
+def monthly_totals(df: pd.DataFrame, value: str, block_rows: int = BLOCK_ROWS) -> pd.Series:
+    """Sum of `value` per (user, month), indexed by the packed user/month key in sorted order"""
+    parts = list(_block_totals(df, value, block_rows))
+    if len(parts) == 1:
+        return _totals_series(*parts[0])
+    # A (user, month) can straddle two blocks
+    keys = np.concatenate([k for k, _ in parts] or [np.zeros(0, dtype=np.int64)])
+    totals = np.concatenate([t for _, t in parts] or [np.zeros(0)])
+    return _totals_series(*_reduce_sorted(keys, totals))
+
+
+def split_keys(keys: np.ndarray):
+    """(user_ids, month indexes) of packed monthly keys"""
+    return keys >> MONTH_BITS, keys & MONTH_MASK
+
+
+def monthly_stats(totals: pd.Series, spec: MonthlySpec) -> pd.DataFrame:
+    """One row per user_id with the spec's statistics of its monthly totals"""
+    if not totals.index.is_monotonic_increasing:
+        totals = totals.sort_index()
+    users, month = split_keys(totals.index.to_numpy(dtype=np.int64))
+    month = month.astype(np.float64)
+    x = totals.to_numpy(dtype=np.float64)
+
+    # Keys are sorted, so each user's months are one contiguous run
+    starts = _run_starts(users)
+    user_ids = users[starts]
+    n = np.diff(np.append(starts, len(users))).astype(np.float64)
+    inverse = np.repeat(np.arange(len(user_ids)), n.astype(np.int64))
+    total = np.bincount(inverse, x, minlength=len(user_ids))
+    mean = total / np.maximum(n, 1)
+    first = np.minimum.reduceat(month, starts) if len(x) else np.zeros(0)
+    last = np.maximum.reduceat(month, starts) if len(x) else np.zeros(0)
+
+    result = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for column, stat in spec.features.items():
+            if stat == 'mean':
+                result[column] = mean
+            elif stat == 'total':
+                result[column] = total
+            elif stat == 'months':
+                result[column] = n
+            elif stat == 'regularity':
+                result[column] = n / (last - first + 1)
+            elif stat == 'std':
+                squares = np.bincount(inverse, (x - mean[inverse]) ** 2, minlength=len(user_ids))
+                result[column] = np.where(n > 1, np.sqrt(squares / (n - 1)), np.nan)
+            elif stat == 'trend':
+                # Centered per user, so the slope is numerically stable
+                t = month - first[inverse]
+                t_mean = np.bincount(inverse, t, minlength=len(user_ids)) / np.maximum(n, 1)
+                dt = t - t_mean[inverse]
+                sxy = np.bincount(inverse, dt * (x - mean[inverse]), minlength=len(user_ids))
+                sxx = np.bincount(inverse, dt * dt, minlength=len(user_ids))
+                result[column] = np.where(sxx > 0, sxy / sxx, 0.0)
+    return pd.DataFrame(result, index=pd.Index(user_ids, name='user_id'))
+
+
+def user_monthly_stats(df: pd.DataFrame, spec: MonthlySpec, block_rows: int = BLOCK_ROWS) -> pd.DataFrame:
+    """
+    monthly_stats(monthly_totals(df)) in one streaming pass. When the rows are
+    grouped by user_id (as the docs/ event files are), each block's finished
+    users are turned into their stats row straight away and only the last,
+    possibly incomplete user is carried into the next block, so memory holds
+    one block plus one output row per user.
+    """
+    if not df['user_id'].is_monotonic_increasing:
+        return monthly_stats(monthly_totals(df, spec.value, block_rows), spec)
+    frames = []
+    carry_keys, carry_totals = np.zeros(0, dtype=np.int64), np.zeros(0)
+    for keys, totals in _block_totals(df, spec.value, block_rows):
+        if len(carry_keys):
+            keys, totals = _reduce_sorted(np.concatenate([carry_keys, keys]), np.concatenate([carry_totals, totals]))
+        # The block's last user may continue in the next block
+        cut = np.searchsorted(keys, (keys[-1] >> MONTH_BITS) << MONTH_BITS) if len(keys) else 0
+        carry_keys, carry_totals = keys[cut:], totals[cut:]
+        if cut:
+            frames.append(monthly_stats(_totals_series(keys[:cut], totals[:cut]), spec))
+    if len(carry_keys) or not frames:
+        frames.append(monthly_stats(_totals_series(carry_keys, carry_totals), spec))
+    return pd.concat(frames) if len(frames) > 1 else frames[0]
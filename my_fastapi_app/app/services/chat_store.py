@@ -0,0 +1,120 @@
+"""
+Append-only chat log.
+
+Messages live in a SQLite database in WAL mode, one row per message,
+partitioned by session_id. Recording a turn is a single INSERT
+transaction, so its cost does not depend on how long the history is, and
+concurrent writers (threads or processes) are serialized by SQLite instead
+of overwriting each other's read-modify-write of a JSON file. Reads page
+through a session by message id, which doubles as the cursor.
+"""
+import json
+import os
+import sqlite3
+import threading
+from typing import List, Optional, Tuple
+
+from app.core.metrics import stage
+
+DEFAULT_SESSION = "default"
+MAX_PAGE_SIZE = 1000
+
+
+class ChatStore:
+    def __init__(self, path: str, busy_timeout: float = 30.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        db = self._connection()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, role TEXT NOT NULL, "
+            "content TEXT NOT NULL, timestamp REAL NOT NULL, processed INTEGER NOT NULL DEFAULT 1)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)")
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        db.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread; SQLite connections must not be shared across threads"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            # WAL + NORMAL: commits are durable at checkpoints rather than fsynced one by one
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _insert(self, db: sqlite3.Connection, messages: List[dict], session_id: str) -> List[int]:
+        ids = []
+        for msg in messages:
+            cursor = db.execute(
+                "INSERT INTO messages (session_id, role, content, timestamp, processed) VALUES (?, ?, ?, ?, ?)",
+                (session_id, msg["role"], msg["content"], msg["timestamp"], int(msg.get("processed", True))),
+            )
+            ids.append(cursor.lastrowid)
+        return ids
+
+    def append(self, messages: List[dict], session_id: str = DEFAULT_SESSION) -> List[int]:
+        """Append messages atomically (all or none); returns their ids"""
+        db = self._connection()
+        with stage('chat_log', 'append'), db:
+            return self._insert(db, messages, session_id)
+
+    def page(self, session_id: str = DEFAULT_SESSION, cursor: Optional[int] = None,
+             limit: int = 100) -> Tuple[List[dict], Optional[int]]:
+        """
+        Up to `limit` messages of a session with id > cursor, oldest first,
+        and the cursor for the next page (None once the end is reached)
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        with stage('chat_log', 'page'):
+            rows = self._connection().execute(
+                "SELECT id, role, content, timestamp, processed FROM messages "
+                "WHERE session_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (session_id, cursor or 0, limit + 1),
+            ).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        messages = [
+            {"id": row[0], "role": row[1], "content": row[2], "timestamp": row[3], "processed": bool(row[4])}
+            for row in rows
+        ]
+        return messages, (rows[-1][0] if more else None)
+
+    def sessions(self) -> List[str]:
+        return [row[0] for row in self._connection().execute("SELECT DISTINCT session_id FROM messages")]
+
+    def count(self, session_id: Optional[str] = None) -> int:
+        if session_id is None:
+            return self._connection().execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)
+        ).fetchone()[0]
+
+    def clear(self, session_id: Optional[str] = None):
+        """Delete one session, or every session when session_id is None"""
+        db = self._connection()
+        with stage('chat_log', 'clear'), db:
+            if session_id is None:
+                db.execute("DELETE FROM messages")
+            else:
+                db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+
+    def import_json(self, path: str, session_id: str = DEFAULT_SESSION) -> int:
+        """Load a legacy docs/chat_log.json once; returns the number of messages imported"""
+        if not os.path.exists(path):
+            return 0
+        with open(path, encoding="utf-8") as f:
+            messages = json.load(f)
+        db = self._connection()
+        with db:
+            # Take the write lock before checking, so concurrent workers import only once
+            db.execute("BEGIN IMMEDIATE")
+            if db.execute("SELECT 1 FROM meta WHERE key = 'legacy_import'").fetchone() is not None:
+                return 0
+            self._insert(db, messages, session_id)
+            db.execute("INSERT INTO meta (key, value) VALUES ('legacy_import', ?)", (path,))
+        return len(messages)
@@ -0,0 +1,122 @@
+"""
+Local, batched text embeddings with a persistent cache.
+
+`LocalEmbedder` embeds knowledge-base chunks with a sentence-transformers
+model loaded from local files, so ingestion and search work offline. The
+model is only loaded when something is first embedded. Vectors are
+L2-normalised, so inner product is cosine similarity.
+
+Every chunk vector is cached under the model name and a SHA-256 of the
+text. The cache is SQLite (in memory when no path is given), so a chunk
+that was embedded once is not embedded again. That holds after a restart,
+for a chunk that was deleted and later comes back, and for a chunk that
+appears in more than one knowledge base. Only the cache misses of a call
+go to the model, as batches of `batch_size`.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from functools import partial
+from typing import Dict, Iterable, Optional, Sequence
+
+import numpy as np
+
+from app.core.metrics import stage
+from app.utils.lazy import Lazy
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    # SQLite's default limit on "?" parameters is 999
+    QUERY_BATCH = 500
+
+    def __init__(self, path: Optional[str] = None):
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT, key TEXT, vector BLOB, PRIMARY KEY (model, key))"
+        )
+        self._db.commit()
+
+    def get_many(self, model: str, keys: Iterable[str]) -> Dict[str, np.ndarray]:
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), self.QUERY_BATCH):
+                batch = keys[i:i + self.QUERY_BATCH]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE model = ? AND key IN ({','.join('?' * len(batch))})",
+                    (model, *batch),
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, np.ndarray]):
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, key, vector) VALUES (?, ?, ?)",
+                [(model, key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in vectors.items()],
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+def load_sentence_transformer(name: str, local_only: bool = True, device: Optional[str] = None):
+    # Imported here: torch and sentence-transformers take seconds to import and only ingestion and
+    # search need them
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(name, device=device, local_files_only=local_only)
+
+
+class LocalEmbedder:
+    def __init__(self, model_name: str, batch_size: int = 64, cache: Optional[EmbeddingCache] = None,
+                 model=None, local_only: bool = True, device: Optional[str] = None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache = cache if cache is not None else EmbeddingCache()
+        # Anything with SentenceTransformer's encode() and get_sentence_embedding_dimension()
+        self.model = model if model is not None else Lazy(
+            partial(load_sentence_transformer, model_name, local_only, device))
+        # Texts sent to the model, i.e. cache misses
+        self.embedded = 0
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def _encode(self, texts: Sequence[str]) -> np.ndarray:
+        with stage('embedding', self.model_name):
+            vectors = self.model.encode(list(texts), batch_size=self.batch_size, normalize_embeddings=True,
+                                        convert_to_numpy=True, show_progress_bar=False)
+        return np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """One row per text, taken from the cache where possible"""
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        keys = [text_key(text) for text in texts]
+        found = self.cache.get_many(self.model_name, set(keys))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            new = dict(zip(missing, self._encode(list(missing.values()))))
+            self.cache.put_many(self.model_name, new)
+            found.update(new)
+            self.embedded += len(new)
+        return np.stack([found[key] for key in keys])
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """A (1, dim) query vector; queries are not cached"""
+        return self._encode([text])
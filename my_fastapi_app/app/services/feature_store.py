@@ -0,0 +1,304 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import pandas as pd
+
+from app.services.task_graph import TaskResult
+
+# Bytes sampled from the start and from just before the old end of a file
+# to decide whether a change was a pure append.
+FINGERPRINT_BYTES = 64 * 1024
+
+# Rows parsed to estimate the in-memory size of one row when sizing chunks
+SAMPLE_ROWS = 10_000
+# Parsing, type conversion and the node reductions hold a few copies of a chunk at once
+CHUNK_OVERHEAD = 4
+MIN_CHUNK_ROWS = 1_000
+
+
+def rows_per_chunk(path: str, memory_budget: int) -> int:
+    """Rows per chunk so that processing one chunk stays within `memory_budget` bytes"""
+    sample = pd.read_csv(path, nrows=SAMPLE_ROWS)
+    if sample.empty:
+        return SAMPLE_ROWS
+    row_bytes = sample.memory_usage(deep=True, index=False).sum() / len(sample)
+    return max(MIN_CHUNK_ROWS, int(memory_budget / (row_bytes * CHUNK_OVERHEAD)))
+
+
+class FeatureNode:
+    """
+    One aggregate in the feature dependency graph.
+
+    `partial(df)` reduces rows of `source` to a per-key state (sums, counts,
+    last values, ...) and `finalize(state)` turns that state into a frame
+    indexed by user_id holding `columns`. Nodes with a `combine(old, new)`
+    function are append-foldable: when their source only grew, the state of
+    the new rows is folded into the existing one instead of re-reading the
+    whole file.
+    """
+
+    def __init__(self, name: str, source: str, columns: List[str],
+                 partial: Callable[[pd.DataFrame], object],
+                 finalize: Callable[[object], pd.DataFrame] = None,
+                 combine: Callable[[object, object], object] = None):
+        self.name = name
+        self.source = source
+        self.columns = columns
+        self.partial = partial
+        self.finalize = finalize or (lambda state: state)
+        self.combine = combine
+        self.state = None
+
+
+class SourceFile:
+    """Tracks what has already been read from one CSV in docs/."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = None
+        self.size = 0
+        self.fingerprint = None
+        self.columns = None
+
+    def stat(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime, st.st_size
+        except OSError:
+            return None, 0
+
+    def changed(self) -> bool:
+        return self.stat() != (self.mtime, self.size)
+
+    def _fingerprint(self, size: int) -> Optional[str]:
+        if size == 0:
+            return None
+        digest = hashlib.sha1()
+        with open(self.path, "rb") as f:
+            digest.update(f.read(min(size, FINGERPRINT_BYTES)))
+            f.seek(max(0, size - FINGERPRINT_BYTES))
+            tail = f.read(size - f.tell())
+        digest.update(tail)
+        # A last line without a newline may still be growing, so never treat it as complete
+        return digest.hexdigest() if tail.endswith(b"\n") else None
+
+    def appended(self) -> bool:
+        """True if the file only grew since the last read (same prefix, larger size)."""
+        mtime, size = self.stat()
+        if self.fingerprint is None or size <= self.size:
+            return False
+        return self._fingerprint(self.size) == self.fingerprint
+
+    def read(self, loader: Callable[[str], pd.DataFrame], prepare: Callable[[pd.DataFrame], pd.DataFrame],
+             tail_only: bool) -> pd.DataFrame:
+        mtime, size = self.stat()
+        if tail_only:
+            with open(self.path, "rb") as f:
+                f.seek(self.size)
+                df = pd.read_csv(f, header=None, names=self.columns)
+        else:
+            df = loader(self.path)
+            self.columns = list(df.columns)
+        self.mtime, self.size = mtime, size
+        self.fingerprint = self._fingerprint(size)
+        return prepare(df)
+
+    def read_chunks(self, prepare: Callable[[pd.DataFrame], pd.DataFrame], tail_only: bool,
+                    chunk_rows: int) -> Iterator[pd.DataFrame]:
+        """Like `read`, but parses `chunk_rows` rows at a time (at least one, possibly empty, chunk)"""
+        mtime, size = self.stat()
+        if not tail_only or self.columns is None:
+            self.columns = list(pd.read_csv(self.path, nrows=0).columns)
+        with open(self.path, "rb") as f:
+            if tail_only:
+                f.seek(self.size)
+                reader = pd.read_csv(f, header=None, names=self.columns, chunksize=chunk_rows)
+            else:
+                reader = pd.read_csv(f, chunksize=chunk_rows)
+            empty = True
+            for df in reader:
+                empty = False
+                yield prepare(df)
+            if empty:
+                yield prepare(pd.DataFrame(columns=self.columns))
+        self.mtime, self.size = mtime, size
+        self.fingerprint = self._fingerprint(size)
+
+
+def changed_users(old: pd.Series, new: pd.Series) -> List:
+    """user_ids whose row hash differs between two snapshots, plus added and removed users"""
+    common = old.index.intersection(new.index)
+    differ = common[old.loc[common].to_numpy() != new.loc[common].to_numpy()]
+    return list(differ) + list(old.index.symmetric_difference(new.index))
+
+
+class FeatureStore:
+    """
+    In-process cache of the master feature table.
+
+    The table is assembled from a graph of `FeatureNode`s, each fed by one
+    CSV in `data_dir`, and kept in memory indexed by user_id. Every read
+    stats the source files; only the nodes whose source changed are
+    recomputed (or, for append-only event files, updated with just the new
+    rows) before the table is reassembled, so steady-state lookups never
+    touch disk. Subscribers are told which user_ids' rows changed. Changed
+    sources are read and reduced on up to `workers` threads at once.
+
+    A source that fails to load only degrades its own nodes, as a failed
+    agent does in master_agent(). They keep their last good output, or are
+    left out of the table (and `assemble` has to cope) on the first build.
+    The source is read again in full once the file changes. Each refreshed
+    source's TaskResult (error and seconds) is kept in `last_results`. When
+    `assemble` itself fails, e.g. without the users table, the previous
+    table is kept.
+
+    With a `memory_budget` (bytes), sources whose nodes all have a `combine`
+    are never loaded whole: they are parsed in chunks sized to the budget
+    and each chunk's partial state is merged into the running one, which
+    gives the same table as the in-memory path for event files of any size.
+    """
+
+    def __init__(self, nodes: Iterable[FeatureNode], assemble: Callable[[Dict[str, pd.DataFrame]], pd.DataFrame],
+                 data_dir: str, loader: Callable[[str], pd.DataFrame] = pd.read_csv,
+                 prepare: Callable[[pd.DataFrame], pd.DataFrame] = None, workers: int = 1,
+                 memory_budget: Optional[int] = None):
+        self.nodes = list(nodes)
+        self.assemble = assemble
+        self.data_dir = data_dir
+        self.loader = loader
+        self.prepare = prepare or (lambda df: df)
+        self.workers = workers
+        self.memory_budget = memory_budget
+        self.sources = {node.source: SourceFile(os.path.join(data_dir, node.source)) for node in self.nodes}
+        self._lock = threading.Lock()
+        self._outputs: Dict[str, pd.DataFrame] = {}
+        self._frame = pd.DataFrame()
+        self._records: Dict[int, dict] = {}
+        self.version = 0
+        # node name -> "full" or "append" for the most recent refresh
+        self.last_refresh: Dict[str, str] = {}
+        # source file -> TaskResult (error, seconds) of the most recent refresh that read it
+        self.last_results: Dict[str, TaskResult] = {}
+        self._row_hashes: Optional[pd.Series] = None
+        self._listeners: List[Callable[[List], None]] = []
+        self.last_changed_users: List = []
+
+    def subscribe(self, listener: Callable[[List], None]):
+        """Call `listener(user_ids)` after a rebuild changed those users' feature rows"""
+        self._listeners.append(listener)
+
+    def dependents(self, source: str) -> List[str]:
+        """Feature columns that have to be recomputed when `source` changes."""
+        return [col for node in self.nodes if node.source == source for col in node.columns]
+
+    def is_stale(self) -> bool:
+        return self._frame.empty or any(src.changed() for src in self.sources.values())
+
+    def _update_source(self, name: str, force: bool):
+        src = self.sources[name]
+        nodes = [node for node in self.nodes if node.source == name]
+        foldable = not force and all(node.combine is not None and node.state is not None for node in nodes)
+        tail_only = foldable and src.appended()
+        if self.memory_budget and all(node.combine is not None for node in nodes):
+            self._stream_source(src, nodes, tail_only)
+            return
+        df = src.read(self.loader, self.prepare, tail_only)
+        for node in nodes:
+            if tail_only:
+                node.state = node.combine(node.state, node.partial(df))
+            else:
+                node.state = node.partial(df)
+            self._outputs[node.name] = node.finalize(node.state)
+            self.last_refresh[node.name] = "append" if tail_only else "full"
+
+    def _refresh_source(self, name: str, force: bool) -> TaskResult:
+        start = time.perf_counter()
+        try:
+            self._update_source(name, force)
+        except Exception as e:
+            src = self.sources[name]
+            # Not retried until the file changes again, and then read in full
+            src.mtime, src.size = src.stat()
+            src.fingerprint = None
+            for node in self.nodes:
+                if node.source == name:
+                    node.state = None
+            return TaskResult(error=f"{type(e).__name__}: {e}", seconds=time.perf_counter() - start)
+        return TaskResult(seconds=time.perf_counter() - start)
+
+    def _stream_source(self, src: SourceFile, nodes: List[FeatureNode], tail_only: bool):
+        chunk_rows = rows_per_chunk(src.path, self.memory_budget)
+        fresh = {}
+        for df in src.read_chunks(self.prepare, tail_only, chunk_rows):
+            for node in nodes:
+                state = node.partial(df)
+                fresh[node.name] = state if node.name not in fresh else node.combine(fresh[node.name], state)
+        for node in nodes:
+            node.state = node.combine(node.state, fresh[node.name]) if tail_only else fresh[node.name]
+            self._outputs[node.name] = node.finalize(node.state)
+            self.last_refresh[node.name] = "append" if tail_only else "full"
+
+    def refresh(self, force: bool = False) -> pd.DataFrame:
+        """Recompute the nodes whose source changed (or all of them, with force)."""
+        if not force and not self._frame.empty and not any(src.changed() for src in self.sources.values()):
+            return self._frame
+        with self._lock:
+            changed = [name for name, src in self.sources.items() if force or src.changed()]
+            if not changed and not self._frame.empty:
+                return self._frame
+            self.last_refresh = {}
+            try:
+                if self.workers > 1 and len(changed) > 1:
+                    # Sources are independent; each one only writes its own nodes' outputs
+                    with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="feature-store") as pool:
+                        results = list(pool.map(lambda name: self._refresh_source(name, force), changed))
+                else:
+                    results = [self._refresh_source(name, force) for name in changed]
+                self.last_results = dict(zip(changed, results))
+                failed = {name: result.error for name, result in self.last_results.items() if not result.ok}
+                if failed:
+                    print(f"Warning: Some feature sources failed to load, keeping their last data: {failed}")
+                frame = self.assemble(self._outputs)
+            except Exception as e:
+                print(f"Error refreshing feature store: {e}")
+                # Drop the partial state so the next read rebuilds everything from scratch
+                for src in self.sources.values():
+                    src.mtime, src.fingerprint = None, None
+                for node in self.nodes:
+                    node.state = None
+                return self._frame
+            self._frame = frame.reset_index(drop=True)
+            self._records = self._frame.set_index('user_id', drop=False).to_dict('index')
+            self.version += 1
+            self._notify(pd.util.hash_pandas_object(self._frame.set_index('user_id'), index=False))
+        return self._frame
+
+    def _notify(self, hashes: pd.Series):
+        previous, self._row_hashes = self._row_hashes, hashes
+        if previous is None:
+            return
+        self.last_changed_users = changed_users(previous, hashes)
+        if not self.last_changed_users:
+            return
+        for listener in self._listeners:
+            try:
+                listener(self.last_changed_users)
+            except Exception as e:
+                print(f"Feature store listener failed: {e}")
+
+    def warm(self) -> pd.DataFrame:
+        return self.refresh(force=True)
+
+    def get(self) -> pd.DataFrame:
+        """Return the current feature table, rebuilding it only if stale."""
+        return self.refresh()
+
+    def get_user(self, user_id) -> Optional[dict]:
+        """Return the feature row for a single user_id as a dict."""
+        self.refresh()
+        row = self._records.get(user_id)
+        return dict(row) if row is not None else None
@@ -0,0 +1,99 @@
+"""
+Content-addressed chunk bookkeeping for incremental knowledge-base ingestion.
+
+A knowledge base is a set of sources (uploaded files), each split into
+chunks. A chunk is identified by the SHA-256 of its text. It is stored once,
+under one vector id, however many sources contain it.
+
+`ChunkTable.update` takes the chunks of the sources being (re)uploaded and
+returns what the vector index has to change:
+
+- the ids and texts of chunks it has not seen before, which need vectors;
+- the ids of chunks that no source refers to any more, which are deleted.
+
+Unchanged chunks keep their ids and vectors, so re-uploading an unchanged
+file changes nothing. Chunk entries are replaced, never mutated, so `copy()`
+is a shallow copy that a new version can change while searches keep reading
+the old one.
+"""
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple
+
+from app.services.embeddings import text_key
+
+
+class Chunk(NamedTuple):
+    id: int
+    text: str
+    sources: FrozenSet[str]
+
+
+class Delta(NamedTuple):
+    added: Dict[int, str]  # vector id -> text of a chunk that needs a vector
+    removed: List[int]  # vector ids to delete
+
+    @property
+    def empty(self) -> bool:
+        return not self.added and not self.removed
+
+
+class ChunkTable:
+    def __init__(self):
+        self.chunks: Dict[str, Chunk] = {}  # text key -> chunk
+        self.by_id: Dict[int, str] = {}  # vector id -> text key
+        self.sources: Dict[str, List[str]] = {}  # source name -> its chunk keys, in order
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def copy(self) -> "ChunkTable":
+        table = ChunkTable()
+        table.chunks = dict(self.chunks)
+        table.by_id = dict(self.by_id)
+        table.sources = dict(self.sources)
+        table.next_id = self.next_id
+        return table
+
+    def update(self, chunks_by_source: Dict[str, List[str]]) -> Delta:
+        """Replace the chunks of each given source; sources not given are left as they are"""
+        delta = Delta({}, [])
+        for source, texts in chunks_by_source.items():
+            keyed = dict((text_key(text), text) for text in texts)
+            for key, text in keyed.items():
+                chunk = self.chunks.get(key)
+                if chunk is None:
+                    chunk = Chunk(self.next_id, text, frozenset())
+                    self.by_id[chunk.id] = key
+                    delta.added[chunk.id] = text
+                    self.next_id += 1
+                if source not in chunk.sources:
+                    self.chunks[key] = chunk._replace(sources=chunk.sources | {source})
+            for key in set(self.sources.get(source, ())) - keyed.keys():
+                self._release(key, source, delta)
+            self.sources[source] = list(keyed)
+        return delta
+
+    def remove_sources(self, names: Iterable[str]) -> Delta:
+        delta = Delta({}, [])
+        for source in names:
+            for key in self.sources.pop(source, ()):
+                self._release(key, source, delta)
+        return delta
+
+    def _release(self, key: str, source: str, delta: Delta):
+        chunk = self.chunks[key]
+        sources = chunk.sources - {source}
+        if sources:
+            self.chunks[key] = chunk._replace(sources=sources)
+            return
+        del self.chunks[key]
+        del self.by_id[chunk.id]
+        if delta.added.pop(chunk.id, None) is None:
+            delta.removed.append(chunk.id)
+
+    def source_texts(self) -> Dict[str, List[str]]:
+        """Every source with its chunk texts, e.g. to embed the whole knowledge base again"""
+        return {source: [self.chunks[key].text for key in keys] for source, keys in self.sources.items()}
+
+    def texts(self, ids: Iterable[int]) -> List[str]:
+        return [self.chunks[self.by_id[i]].text for i in ids if i in self.by_id]
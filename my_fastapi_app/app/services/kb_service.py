@@ -1 +1,56 @@
 # Business logic for knowledgebase
+"""
+What happens to files after /kb/add-files has placed them.
+
+This runs as a background task once the upload has been answered.
+
+- Text documents go to the knowledge base's vector store
+  (rag_service.processAndStoreFiles), which embeds only their new chunks.
+- CSVs are feature-store sources. When the scoring pipeline runs in this
+  process (AGENT_MODE=inprocess), its feature table is refreshed now, so the
+  next request doesn't pay for the rebuild. A separate agent process notices
+  the changed files by itself on its next read.
+"""
+import os
+import sys
+from typing import List
+
+from app.utils.uploads import SavedFile
+
+TEXT_EXTENSIONS = {".txt", ".md"}
+
+
+def ingest_documents(files: List[SavedFile], kb_name: str):
+    if not files:
+        return
+    try:
+        # faiss, langchain and the embedding model are only loaded once documents arrive
+        from app.services.rag_service import processAndStoreFiles
+        contents = []
+        for saved in files:
+            with open(saved.path, encoding="utf-8", errors="replace") as f:
+                contents.append(f.read())
+        result = processAndStoreFiles(contents, [saved.filename for saved in files], kb_name)
+        print(f"Knowledge base {kb_name}: {result}")
+    except Exception as e:
+        print(f"Error ingesting {[saved.filename for saved in files]} into {kb_name}: {e}")
+
+
+def refresh_features(files: List[SavedFile]):
+    server = sys.modules.get("server")
+    if not files or server is None:
+        return
+    try:
+        server.feature_store.refresh()
+    except Exception as e:
+        print(f"Error refreshing features after uploading {[saved.filename for saved in files]}: {e}")
+
+
+def _extension(saved: SavedFile) -> str:
+    return os.path.splitext(saved.filename)[1].lower()
+
+
+def process_uploads(files: List[SavedFile], kb_name: str):
+    """Hand newly saved files to ingestion and the feature store"""
+    ingest_documents([saved for saved in files if _extension(saved) in TEXT_EXTENSIONS], kb_name)
+    refresh_features([saved for saved in files if _extension(saved) == ".csv"])
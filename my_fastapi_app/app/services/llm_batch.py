@@ -0,0 +1,151 @@
+"""
+Structured LLM assessments and helpers for scoring many users at once.
+
+An assessment is {"score": 0-100, "factors": [str], "reasoning": str}.
+`ASSESSMENT_SCHEMA` is the JSON schema the model can be constrained to
+(Ollama's `format=`), and `parse_assessment` validates whatever came back,
+returning None for anything malformed so the caller can fall back to the
+rule-based score.
+
+Two ways to spend fewer model round trips per user:
+
+    concurrent  one prompt per user, up to N requests in flight
+    packed      several users' summaries in one prompt, answered as a JSON
+                object {"assessments": [{"user_id", "score", "factors",
+                "reasoning"}, ...]}
+
+Every model call is retried with exponential backoff, except when the
+model is known to be down (`LLMUnavailable`). The packed reply is
+validated entry by entry: a user that is missing from the reply or has
+an invalid entry is reported as missing. The caller then scores that
+user with the rule-based fallback instead of failing the whole batch.
+"""
+import asyncio
+import json
+import re
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, TypeVar
+
+T = TypeVar('T')
+
+BATCH_MODES = ('concurrent', 'packed')
+# "text": free-text answer, "json": Ollama JSON mode, "schema": output constrained to the JSON schema
+OUTPUT_FORMATS = ('text', 'json', 'schema')
+
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+MAX_FACTORS = 5
+MAX_REASONING_CHARS = 400
+
+ASSESSMENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "score": {"type": "integer", "minimum": 0, "maximum": 100},
+        "factors": {"type": "array", "items": {"type": "string"}, "maxItems": MAX_FACTORS},
+        "reasoning": {"type": "string", "maxLength": MAX_REASONING_CHARS},
+    },
+    "required": ["score", "factors", "reasoning"],
+}
+
+BATCH_ASSESSMENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "assessments": {
+            "type": "array",
+            "items": {
+                **ASSESSMENT_SCHEMA,
+                "properties": {"user_id": {"type": "integer"}, **ASSESSMENT_SCHEMA["properties"]},
+                "required": ["user_id", *ASSESSMENT_SCHEMA["required"]],
+            },
+        },
+    },
+    "required": ["assessments"],
+}
+
+
+class LLMUnavailable(Exception):
+    """The health check or circuit breaker says not to call the model; retrying won't help"""
+
+
+def format_option(output_format: str, batch: bool = False):
+    """Ollama `format=` argument for an output format (None for free text)"""
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format {output_format!r}, expected one of {OUTPUT_FORMATS}")
+    if output_format == 'schema':
+        return BATCH_ASSESSMENT_SCHEMA if batch else ASSESSMENT_SCHEMA
+    return 'json' if output_format == 'json' else None
+
+
+def chunked(items: List[T], size: int) -> List[List[T]]:
+    size = max(1, size)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+async def retry_async(call: Callable[[], Awaitable[T]], attempts: int = 3, base_delay: float = 0.5,
+                      max_delay: float = 8.0, on_failure: Optional[Callable[[Exception], None]] = None,
+                      sleep=asyncio.sleep) -> T:
+    """Await `call()` up to `attempts` times, sleeping base_delay * 2**i between tries"""
+    for attempt in range(attempts):
+        try:
+            return await call()
+        except LLMUnavailable:
+            raise
+        except Exception as e:
+            if on_failure is not None:
+                on_failure(e)
+            if attempt == attempts - 1:
+                raise
+            await sleep(min(max_delay, base_delay * 2 ** attempt))
+
+
+def validate_assessment(entry) -> Optional[dict]:
+    """{"score": int 0-100, "factors": [str], "reasoning": str} or None if `entry` doesn't fit"""
+    if not isinstance(entry, dict):
+        return None
+    score = entry.get('score')
+    if isinstance(score, bool) or not isinstance(score, (int, float)) or not 0 <= score <= 100:
+        return None
+    factors = entry.get('factors', [])
+    if isinstance(factors, str):
+        factors = [factors]
+    if not isinstance(factors, list) or not all(isinstance(f, str) for f in factors):
+        return None
+    reasoning = entry.get('reasoning', '')
+    if not isinstance(reasoning, str):
+        return None
+    return {'score': int(round(score)), 'factors': factors[:MAX_FACTORS],
+            'reasoning': reasoning.strip()[:MAX_REASONING_CHARS]}
+
+
+def _json_object(content: str):
+    """The outermost {...} of a reply (models sometimes wrap JSON in prose or code fences), or None"""
+    match = _JSON_OBJECT_RE.search(content or '')
+    if match is None:
+        return None
+    try:
+        return json.loads(match.group(0))
+    except ValueError:
+        return None
+
+
+def parse_assessment(content: str) -> Optional[dict]:
+    """Validated single-user assessment from a model reply, or None if it is malformed"""
+    return validate_assessment(_json_object(content))
+
+
+def parse_batch_response(content: str, user_ids: Iterable) -> Dict[int, dict]:
+    """Valid assessments by user_id for the users that were asked about; anything else is dropped"""
+    expected = {int(user_id) for user_id in user_ids}
+    payload = _json_object(content)
+    entries = payload.get('assessments') if isinstance(payload, dict) else None
+    if not isinstance(entries, list):
+        return {}
+    parsed = {}
+    for entry in entries:
+        try:
+            user_id = int(entry.get('user_id'))
+        except (AttributeError, TypeError, ValueError):
+            continue
+        assessment = validate_assessment(entry)
+        if user_id in expected and user_id not in parsed and assessment is not None:
+            parsed[user_id] = assessment
+    return parsed
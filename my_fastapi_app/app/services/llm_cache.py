@@ -0,0 +1,123 @@
+"""
+Cache of LLM credit assessments.
+
+Entries are keyed on a SHA-256 of the exact feature summary the model sees,
+the model name and the prompt template version, so a user whose features
+did not change gets the previous assessment back instead of a new
+generation. The in-memory tier is an LRU with a TTL; an optional SQLite
+tier keeps entries across restarts. Entries also remember their user_id so
+the feature store can drop exactly the users whose rows changed.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+
+def assessment_key(summary: str, model: str, prompt_version: int) -> str:
+    return hashlib.sha256(f"{model}\0{prompt_version}\0{summary}".encode("utf-8")).hexdigest()
+
+
+class AssessmentCache:
+    def __init__(self, max_entries: int = 1024, ttl: float = 86400.0, path: Optional[str] = None,
+                 clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        # key -> (value, user_id, created_at), least recently used first
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS assessments ("
+                "key TEXT PRIMARY KEY, user_id TEXT, value TEXT, created_at REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS assessments_user ON assessments (user_id)")
+            self._db.commit()
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl is not None and self.clock() - created_at > self.ttl
+
+    def _remember(self, key: str, entry: tuple):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, user_id, created_at FROM assessments WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    entry = row
+                    self._remember(key, entry)
+            if entry is not None and self._expired(entry[2]):
+                self._delete([key])
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, value: str, user_id=None):
+        entry = (value, None if user_id is None else str(user_id), self.clock())
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO assessments (key, value, user_id, created_at) VALUES (?, ?, ?, ?)",
+                    (key, entry[0], entry[1], entry[2]),
+                )
+                self._db.commit()
+
+    def _delete(self, keys: Iterable[str]):
+        keys = list(keys)
+        for key in keys:
+            self._entries.pop(key, None)
+        if self._db is not None and keys:
+            self._db.executemany("DELETE FROM assessments WHERE key = ?", [(k,) for k in keys])
+            self._db.commit()
+
+    def invalidate_users(self, user_ids: Iterable) -> int:
+        """Drop every entry belonging to the given users; returns how many in-memory entries went"""
+        user_ids = {str(u) for u in user_ids}
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry[1] in user_ids]
+            self._delete(stale)
+            if self._db is not None and user_ids:
+                self._db.executemany("DELETE FROM assessments WHERE user_id = ?", [(u,) for u in user_ids])
+                self._db.commit()
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM assessments")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "disk": self._db is not None,
+        }
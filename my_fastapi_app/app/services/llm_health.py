@@ -0,0 +1,152 @@
+"""
+Ollama availability without a probe on the request path.
+
+`OllamaHealthMonitor` polls the cheap `/api/tags` endpoint from a background
+thread and caches the result for a TTL, and a `CircuitBreaker` tracks the
+outcome of real generation calls. Requests only read the cached state, so
+while the model is down they go straight to the rule-based fallback instead
+of waiting out a connection failure.
+"""
+import threading
+import time
+from typing import Optional, Set
+
+from app.core.metrics import stage
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitBreaker:
+    """
+    closed    -> calls allowed; `failure_threshold` consecutive failures open it
+    open      -> calls rejected until `reset_timeout` seconds have passed
+    half_open -> a single trial call is allowed; success closes, failure re-opens
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            now = self.clock()
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if now - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = HALF_OPEN
+                self._trial_started = None
+            # Half-open: one trial at a time; a trial that never reported back expires
+            if self._trial_started is None or now - self._trial_started >= self.reset_timeout:
+                self._trial_started = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = OPEN
+                self._opened_at = self.clock()
+                self._trial_started = None
+
+
+def _model_names(name: str) -> Set[str]:
+    return {name, f"{name}:latest"} if ":" not in name else {name}
+
+
+class OllamaHealthMonitor:
+    """TTL-cached Ollama status, refreshed by a background thread"""
+
+    def __init__(self, client, breaker: CircuitBreaker, interval: float = 15.0, ttl: float = 30.0,
+                 clock=time.monotonic):
+        self.client = client
+        self.breaker = breaker
+        self.interval = interval
+        self.ttl = ttl
+        self.clock = clock
+        self._healthy = False
+        self._models: Set[str] = set()
+        self._checked_at: Optional[float] = None
+        self._probe_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def probe(self) -> bool:
+        """Ask Ollama for its model list (no generation) and cache the result"""
+        with self._probe_lock, stage('health_check', 'probe'):
+            try:
+                response = self.client.list()
+                self._models = {m.model for m in response.models if m.model}
+                self._healthy = True
+            except Exception as e:
+                if self._healthy or self._checked_at is None:
+                    print(f"Ollama connection failed: {e}")
+                self._healthy = False
+                self._models = set()
+            self._checked_at = self.clock()
+            return self._healthy
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.probe()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ollama-health", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def is_healthy(self, model: Optional[str] = None) -> bool:
+        """Cached status; probes inline only when no fresh result exists (e.g. no monitor thread)"""
+        if self._checked_at is None or self.clock() - self._checked_at > self.ttl:
+            self.probe()
+        if not self._healthy:
+            return False
+        return model is None or bool(_model_names(model) & self._models)
+
+    def available(self, model: Optional[str] = None) -> bool:
+        """True if a real LLM call should be attempted right now"""
+        return self.is_healthy(model) and self.breaker.allow_request()
+
+    def record_success(self):
+        self.breaker.record_success()
+
+    def record_failure(self):
+        self.breaker.record_failure()
+
+    def status(self) -> dict:
+        return {
+            "healthy": self._healthy,
+            "models": sorted(self._models),
+            "circuit": self.breaker.state,
+            "checked_seconds_ago": None if self._checked_at is None else round(self.clock() - self._checked_at, 1),
+        }
@@ -0,0 +1,271 @@
+"""
+Trained credit scoring model.
+
+A logistic regression over the standardised master_agent() feature table
+predicts the probability that a user repays on time, learned from the
+`repayment_status` outcomes in loan_history.csv.
+
+That probability is not a score on the rule scorer's scale: with a base
+rate of about 0.3 its values bunch far below the 70/50 risk cut-offs. Each
+artifact therefore carries a score map fitted at training time. It sends
+the probability quantiles of the training population onto the quantiles
+of the rule-based scores of the same users. A model score keeps the
+model's ranking of users, and Low/Medium/High risk come out about as often
+as under the rules. In effect these are the model's own probability
+cut-offs.
+
+A linear model in log-odds gives exact per-feature contributions: each
+feature adds coef * (x - mean) / scale to the intercept, and the sum is the
+logit of the prediction. Serving only needs the fitted numbers, so a
+prediction is one NumPy matrix product over the whole batch; scikit-learn
+is only imported to train.
+
+Models are saved as versioned JSON artifacts, `credit_model_v<N>.json` in
+the model directory. Each artifact holds its feature list, the scaler and
+coefficients, training metrics and the time it was trained. The server
+loads the newest one at startup; train_model.py writes the next version.
+Columns computed from the outcome file itself should be excluded when
+training (train_model.py drops every column fed by loan_history.csv).
+Otherwise the model learns the label back from its own source.
+
+`serving_problem` says why an artifact should not replace the rules: its
+hold-out AUC is under a floor, or it has no hold-out metrics or score map.
+The server only serves a model without a problem.
+"""
+import json
+import os
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from app.services.rule_scoring import MAX_SCORE, MIN_SCORE, score_batch, select_users
+
+ARTIFACT_PATTERN = re.compile(r"^credit_model_v(\d+)\.json$")
+LABEL_COLUMN = 'repayment_status'
+GOOD_OUTCOME = 'On-Time'
+# Ordinal encoding of master_agent()'s one categorical scoring input
+CATEGORY_CODES = {'location_stability': {'low': 0.0, 'medium': 1.0, 'high': 2.0}}
+# Points of the score map: every percentile of the training population
+SCORE_MAP_QUANTILES = np.linspace(0.0, 1.0, 101)
+
+
+def feature_columns(features: pd.DataFrame, exclude: Iterable[str] = ()) -> List[str]:
+    """Numeric columns of a feature table, plus the encoded categorical ones, minus `exclude`"""
+    exclude = set(exclude) | {'user_id'}
+    return [col for col in features.columns
+            if col not in exclude and (col in CATEGORY_CODES or pd.api.types.is_numeric_dtype(features[col]))]
+
+
+def feature_matrix(features: pd.DataFrame, columns: Sequence[str]) -> np.ndarray:
+    """Rows of `features` as a float matrix over `columns`; missing or unparseable values are 0"""
+    matrix = np.zeros((len(features), len(columns)))
+    for j, col in enumerate(columns):
+        if col not in features:
+            continue
+        values = features[col]
+        if col in CATEGORY_CODES:
+            values = values.astype(object).map(CATEGORY_CODES[col])
+        matrix[:, j] = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    return np.nan_to_num(matrix, nan=0.0)
+
+
+def _user_vector(user_data: dict, columns: Sequence[str]) -> np.ndarray:
+    values = []
+    for col in columns:
+        value = user_data.get(col, 0)
+        if col in CATEGORY_CODES:
+            value = CATEGORY_CODES[col].get(value, 0.0)
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            value = 0.0
+        values.append(0.0 if value != value else value)
+    return np.array([values])
+
+
+class MLScores:
+    """Result of `CreditModel.predict`: one entry per input row"""
+
+    def __init__(self, user_id: np.ndarray, probability: np.ndarray, score: np.ndarray, contributions: np.ndarray,
+                 feature_names: List[str], version: int):
+        self.user_id = user_id
+        self.probability = probability
+        # on the rule scorer's scale (CreditModel.to_score)
+        self.score = score
+        # shape (n_users, n_features); log-odds each feature added to the intercept for each user
+        self.contributions = contributions
+        self.feature_names = feature_names
+        self.version = version
+
+    @property
+    def risk_level(self) -> np.ndarray:
+        return np.where(self.score >= 70, 'Low', np.where(self.score >= 50, 'Medium', 'High'))
+
+    def top_factors(self, row: int, count: int = 3) -> List[tuple]:
+        """(feature, log-odds contribution) pairs of one row, largest effect first"""
+        order = np.argsort(-np.abs(self.contributions[row]))[:count]
+        return [(self.feature_names[j], float(self.contributions[row, j])) for j in order]
+
+    def to_frame(self, include_contributions: bool = False) -> pd.DataFrame:
+        frame = pd.DataFrame({'user_id': self.user_id, 'score': self.score, 'risk_level': self.risk_level,
+                              'probability': self.probability.round(4)})
+        if include_contributions:
+            contributions = pd.DataFrame(self.contributions.round(4), columns=self.feature_names)
+            frame = pd.concat([frame, contributions], axis=1)
+        return frame
+
+
+class CreditModel:
+    def __init__(self, version: int, features: List[str], mean: Sequence[float], scale: Sequence[float],
+                 coef: Sequence[float], intercept: float, metrics: Optional[dict] = None,
+                 trained_at: Optional[float] = None, score_map: Optional[dict] = None):
+        self.version = version
+        self.features = list(features)
+        self.mean = np.asarray(mean, dtype=float)
+        self.scale = np.asarray(scale, dtype=float)
+        self.coef = np.asarray(coef, dtype=float)
+        self.intercept = float(intercept)
+        self.metrics = metrics or {}
+        self.trained_at = trained_at
+        # {'probability': [...], 'score': [...]}, increasing quantiles of the training population
+        self.score_map = score_map
+
+    def _contributions(self, matrix: np.ndarray) -> np.ndarray:
+        return (matrix - self.mean) / self.scale * self.coef
+
+    def to_score(self, probability: np.ndarray) -> np.ndarray:
+        """Probabilities on the rule scorer's 0-100 scale, through the score map (plain percent without one)"""
+        if self.score_map:
+            points = np.interp(probability, self.score_map['probability'], self.score_map['score'])
+        else:
+            points = probability * MAX_SCORE
+        return np.clip(np.rint(points), MIN_SCORE, MAX_SCORE).astype(np.int16)
+
+    def _scores(self, user_id: np.ndarray, contributions: np.ndarray) -> MLScores:
+        probability = 1.0 / (1.0 + np.exp(-(self.intercept + contributions.sum(axis=1))))
+        return MLScores(user_id, probability, self.to_score(probability), contributions, self.features, self.version)
+
+    def predict(self, features: pd.DataFrame, user_ids: Optional[Iterable] = None) -> MLScores:
+        """Score every row of a feature table (the master_agent() layout) at once, or the rows of `user_ids` in that order"""
+        if user_ids is not None:
+            features = select_users(features, user_ids)
+        contributions = self._contributions(feature_matrix(features, self.features))
+        user_id = features['user_id'].to_numpy() if 'user_id' in features else np.arange(len(features))
+        return self._scores(user_id, contributions)
+
+    def predict_user(self, user_data: dict) -> MLScores:
+        """`predict` for one feature row as a dict (feature_store.get_user), without building a frame"""
+        contributions = self._contributions(_user_vector(user_data, self.features))
+        return self._scores(np.array([user_data.get('user_id')]), contributions)
+
+    def to_dict(self) -> dict:
+        return {'version': self.version, 'model': 'logistic_regression', 'label': f"{LABEL_COLUMN} == {GOOD_OUTCOME}",
+                'features': self.features, 'mean': self.mean.tolist(), 'scale': self.scale.tolist(),
+                'coef': self.coef.tolist(), 'intercept': self.intercept, 'metrics': self.metrics,
+                'trained_at': self.trained_at, 'score_map': self.score_map}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CreditModel":
+        return cls(data['version'], data['features'], data['mean'], data['scale'], data['coef'],
+                   data['intercept'], data.get('metrics'), data.get('trained_at'), data.get('score_map'))
+
+    def save(self, model_dir: str) -> str:
+        os.makedirs(model_dir, exist_ok=True)
+        path = os.path.join(model_dir, f"credit_model_v{self.version}.json")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=1)
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> "CreditModel":
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+def artifact_versions(model_dir: str) -> Dict[int, str]:
+    try:
+        names = os.listdir(model_dir)
+    except FileNotFoundError:
+        return {}
+    return {int(match.group(1)): os.path.join(model_dir, name)
+            for name in names if (match := ARTIFACT_PATTERN.match(name))}
+
+
+def load_latest(model_dir: str) -> Optional[CreditModel]:
+    versions = artifact_versions(model_dir)
+    return CreditModel.load(versions[max(versions)]) if versions else None
+
+
+def serving_problem(model: CreditModel, min_auc: float) -> Optional[str]:
+    """Why `model` should not replace the rule-based scorer, or None if it may"""
+    auc = model.metrics.get('holdout_auc')
+    if auc is None:
+        return "no hold-out AUC recorded"
+    if auc < min_auc:
+        return f"hold-out AUC {auc} is under {min_auc}"
+    if not model.score_map:
+        return "no score map; retrain it"
+    return None
+
+
+def fit_score_map(probability: np.ndarray, rule_scores: np.ndarray) -> dict:
+    """Quantile map from model probabilities onto rule-based scores of the same users"""
+    return {'probability': np.round(np.quantile(probability, SCORE_MAP_QUANTILES), 6).tolist(),
+            'score': np.round(np.quantile(rule_scores, SCORE_MAP_QUANTILES), 2).tolist()}
+
+
+def training_set(features: pd.DataFrame, outcomes: pd.DataFrame) -> pd.DataFrame:
+    """Feature rows joined with each user's latest outcome, as a 0/1 `label` column"""
+    labels = outcomes[['user_id', LABEL_COLUMN]].dropna().drop_duplicates('user_id', keep='last')
+    joined = features.merge(labels, on='user_id', how='inner')
+    joined['label'] = (joined[LABEL_COLUMN].astype(str) == GOOD_OUTCOME).astype(int)
+    return joined
+
+
+def train_credit_model(features: pd.DataFrame, outcomes: pd.DataFrame, version: int,
+                       exclude: Iterable[str] = (), test_size: float = 0.2, C: float = 1.0,
+                       seed: int = 0) -> CreditModel:
+    """
+    Fit on `features` (master_agent() layout) against `outcomes` (loan_history.csv rows).
+    Metrics come from a stratified hold-out split; the saved model is then refit on every row,
+    and its score map fitted over every row of `features`
+    """
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.metrics import accuracy_score, log_loss, roc_auc_score
+    from sklearn.model_selection import train_test_split
+    from sklearn.preprocessing import StandardScaler
+
+    data = training_set(features, outcomes)
+    columns = feature_columns(features, exclude)
+    X, y = feature_matrix(data, columns), data['label'].to_numpy()
+    if len(np.unique(y)) < 2:
+        raise ValueError(f"Training needs both outcomes; got {len(y)} rows of one class")
+
+    def fit(X, y):
+        scaler = StandardScaler().fit(X)
+        # Constant columns would divide by zero; their coefficient is 0 anyway
+        scaler.scale_[scaler.scale_ == 0] = 1.0
+        model = LogisticRegression(C=C, max_iter=1000).fit(scaler.transform(X), y)
+        return scaler, model
+
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, stratify=y, random_state=seed)
+    scaler, model = fit(X_train, y_train)
+    probability = model.predict_proba(scaler.transform(X_test))[:, 1]
+    metrics = {
+        'rows': int(len(y)), 'positive_rate': round(float(y.mean()), 4), 'holdout_rows': int(len(y_test)),
+        'holdout_auc': round(float(roc_auc_score(y_test, probability)), 4),
+        'holdout_accuracy': round(float(accuracy_score(y_test, probability >= 0.5)), 4),
+        'holdout_log_loss': round(float(log_loss(y_test, probability)), 4),
+        'excluded': sorted(set(exclude)),
+    }
+
+    scaler, model = fit(X, y)
+    probability = model.predict_proba(scaler.transform(feature_matrix(features, columns)))[:, 1]
+    score_map = fit_score_map(probability, score_batch(features).score)
+    return CreditModel(version, columns, scaler.mean_, scaler.scale_, model.coef_[0], model.intercept_[0],
+                       metrics, time.time(), score_map)
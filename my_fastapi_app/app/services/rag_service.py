@@ -1,36 +1,105 @@
-from typing import List
+from typing import Callable, List, NamedTuple, Optional
 import os
+import threading
 import faiss
+import numpy as np
 import pickle
 from langchain.text_splitter import CharacterTextSplitter
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.vectorstores import FAISS
-from langchain.docstore.document import Document
 
+from app.core.settings import (DEFAULT_KB, KB_EMBEDDING_BATCH_SIZE, KB_EMBEDDING_CACHE_PATH, KB_EMBEDDING_LOCAL_ONLY,
+                               KB_EMBEDDING_MODEL, KB_INDEX_CHECK_INTERVAL, KB_INDEX_MMAP, KB_VECTOR_STORE_DIR)
+from app.services.embeddings import EmbeddingCache, LocalEmbedder
+from app.services.kb_chunks import ChunkTable, Delta
+from app.services.vector_index import IndexManager, new_version_dir
 
-VECTOR_STORE_PATH = "app/vectorstore/store.faiss"
-EMBEDDINGS_PICKLE = "app/vectorstore/index.pkl"
-embedding_model = OpenAIEmbeddings()
+embedder = LocalEmbedder(KB_EMBEDDING_MODEL, KB_EMBEDDING_BATCH_SIZE, EmbeddingCache(KB_EMBEDDING_CACHE_PATH),
+                         local_only=KB_EMBEDDING_LOCAL_ONLY)
+text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
 
 
-def processAndStoreFiles(file_contents: List[str], file_names: List[str]):
-    text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+class KBStore(NamedTuple):
+    """One version of a knowledge base: vectors by chunk id, and the chunks behind them"""
+    model: str
+    index: faiss.Index
+    chunks: ChunkTable
 
-    docs = [Document(page_content=text, metadata={"source": name})
-            for text, name in zip(file_contents, file_names)]
 
-    all_chunks = text_splitter.split_documents(docs)
+def load_store(path: str) -> KBStore:
+    """Read one version directory, with the index memory-mapped when KB_INDEX_MMAP is set"""
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if KB_INDEX_MMAP else 0
+    index = faiss.read_index(os.path.join(path, "index.faiss"), flags)
+    with open(os.path.join(path, "index.pkl"), "rb") as f:
+        model, chunks = pickle.load(f)
+    return KBStore(model, index, chunks)
 
-    vector_db = FAISS.from_documents(all_chunks, embedding_model)
-    vector_db.save_local(VECTOR_STORE_PATH)
 
-    with open(EMBEDDINGS_PICKLE, "wb") as f:
-        pickle.dump(vector_db.index, f)
+def save_store(store: KBStore, path: str):
+    faiss.write_index(store.index, os.path.join(path, "index.faiss"))
+    with open(os.path.join(path, "index.pkl"), "wb") as f:
+        pickle.dump((store.model, store.chunks), f)
 
-    return {"message": "Files processed and vector store updated"}
 
+# One resident index per knowledge base, shared by every query in the process
+kb_indexes: IndexManager[KBStore] = IndexManager(KB_VECTOR_STORE_DIR, load_store, KB_INDEX_CHECK_INTERVAL)
+# Ingestion builds the next version from the live one, so two at once would lose one's changes
+_ingest_lock = threading.Lock()
 
-def getRelevantChunks(query: str, k: int = 3) -> List[str]:
-    vector_db = FAISS.load_local(VECTOR_STORE_PATH, embedding_model)
-    results = vector_db.similarity_search(query, k=k)
-    return [doc.page_content for doc in results]
+
+def _update_store(kb_name: str, change: Callable[[ChunkTable], Delta]) -> dict:
+    with _ingest_lock:
+        current: Optional[KBStore] = kb_indexes.get(kb_name)
+        same_model = current is not None and current.model == embedder.model_name
+        chunks = current.chunks.copy() if same_model else ChunkTable()
+        if same_model:
+            delta = change(chunks)
+        else:
+            # First upload, or vectors of another model that the query vectors can't be compared with
+            if current is not None:
+                chunks.update(current.chunks.source_texts())
+            change(chunks)
+            delta = Delta({chunk.id: chunk.text for chunk in chunks.chunks.values()}, [])
+
+        summary = {"added": len(delta.added), "removed": len(delta.removed), "chunks": len(chunks)}
+        if delta.empty and (same_model or current is None):
+            return {"message": "Vector store already up to date", **summary}
+
+        # A copy, so searches keep using the live version while this one changes
+        index = faiss.clone_index(current.index) if same_model else faiss.IndexIDMap2(
+            faiss.IndexFlatIP(embedder.dimension))
+        if delta.removed:
+            index.remove_ids(np.asarray(delta.removed, dtype=np.int64))
+        if delta.added:
+            ids = np.fromiter(delta.added, dtype=np.int64, count=len(delta.added))
+            index.add_with_ids(embedder.embed(list(delta.added.values())), ids)
+
+        store = KBStore(embedder.model_name, index, chunks)
+        # Written as a new version and then swapped in; searches keep using the old one until then
+        version_dir = new_version_dir(kb_indexes.kb_dir(kb_name))
+        save_store(store, version_dir)
+        kb_indexes.publish(kb_name, version_dir, store)
+    return {"message": "Files processed and vector store updated", **summary}
+
+
+def processAndStoreFiles(file_contents: List[str], file_names: List[str], kb_name: str = DEFAULT_KB):
+    """
+    Add or replace files in a knowledge base. Only chunks not already in it are embedded,
+    and chunks that were only in the previous contents of these files are deleted
+    """
+    chunks_by_source = {name: text_splitter.split_text(text) for text, name in zip(file_contents, file_names)}
+    return _update_store(kb_name, lambda chunks: chunks.update(chunks_by_source))
+
+
+def removeFilesFromStore(file_names: List[str], kb_name: str = DEFAULT_KB):
+    return _update_store(kb_name, lambda chunks: chunks.remove_sources(file_names))
+
+
+def getRelevantChunks(query: str, k: int = 3, kb_name: str = DEFAULT_KB) -> List[str]:
+    store = kb_indexes.get(kb_name)
+    if store is None or store.index.ntotal == 0:
+        return []
+    if store.model != embedder.model_name:
+        print(f"Knowledge base {kb_name} was embedded with {store.model}, not {embedder.model_name}; "
+              f"the next upload re-embeds it")
+        return []
+    _, ids = store.index.search(embedder.embed_query(query), k)
+    return store.chunks.texts(int(i) for i in ids[0] if i >= 0)
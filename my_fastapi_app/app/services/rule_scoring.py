@@ -0,0 +1,152 @@
+"""
+Rule table for the rule-based credit score and a vectorized batch scorer.
+
+Each rule belongs to a group; within a group only the first matching rule
+applies (the if/elif chains of the original scorer). The same table drives
+both `get_rule_based_credit_score` in server.py (one user dict at a time)
+and `score_batch` (NumPy masks over the whole feature table).
+"""
+from collections import namedtuple
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+BASE_SCORE = 50
+MIN_SCORE, MAX_SCORE = 0, 100
+
+# op: "gt" -> x > value, "between" -> value[0] < x < value[1], "eq" -> x == value
+Rule = namedtuple('Rule', ['name', 'group', 'column', 'op', 'value', 'points', 'label'])
+
+RULES = [
+    # Income factors
+    Rule('high_salary', 'salary', 'avg_salary', 'gt', 20000, 15, "High salary income"),
+    Rule('moderate_salary', 'salary', 'avg_salary', 'gt', 10000, 8, "Moderate salary income"),
+    Rule('gig_income', 'gig', 'gig_income_total', 'gt', 5000, 10, "Additional gig income"),
+    # Payment behavior
+    Rule('regular_utility', 'utility', 'monthly_utility_spend', 'between', (0, 2000), 12, "Regular utility payments"),
+    Rule('high_utility', 'utility', 'monthly_utility_spend', 'gt', 3000, -8, "High utility expenses"),
+    # Digital activity
+    Rule('digital_activity', 'upi', 'upi_total_spent', 'gt', 5000, 8, "Active digital transactions"),
+    # Location stability
+    Rule('high_stability', 'location', 'location_stability', 'eq', 'high', 10, "High location stability"),
+    Rule('medium_stability', 'location', 'location_stability', 'eq', 'medium', 5, "Medium location stability"),
+    # Loan history
+    Rule('high_debt', 'debt', 'outstanding_amount', 'gt', 30000, -15, "High outstanding debt"),
+    Rule('moderate_debt', 'debt', 'outstanding_amount', 'gt', 10000, -8, "Moderate outstanding debt"),
+    Rule('good_repayment', 'repayment', 'on_time_repayments', 'gt', 0.8, 12, "Good repayment history"),
+    Rule('fair_repayment', 'repayment', 'on_time_repayments', 'gt', 0.5, 6, "Fair repayment history"),
+]
+
+RULE_NAMES = [rule.name for rule in RULES]
+
+
+def risk_level(score: int) -> str:
+    return 'Low' if score >= 70 else 'Medium' if score >= 50 else 'High'
+
+
+def _matches(rule: Rule, value) -> bool:
+    if rule.op == 'eq':
+        return value == rule.value
+    try:
+        if rule.op == 'between':
+            return rule.value[0] < value < rule.value[1]
+        return value > rule.value
+    except TypeError:
+        return False
+
+
+def matched_rules(user_data: dict) -> List[Rule]:
+    """Rules that apply to a single user, in table order"""
+    matched, done = [], set()
+    for rule in RULES:
+        if rule.group in done:
+            continue
+        default = '' if rule.op == 'eq' else 0
+        if _matches(rule, user_data.get(rule.column, default)):
+            matched.append(rule)
+            done.add(rule.group)
+    return matched
+
+
+def clip_score(score):
+    return np.clip(score, MIN_SCORE, MAX_SCORE)
+
+
+class BatchScores:
+    """Result of `score_batch`: one entry per input row"""
+
+    def __init__(self, user_id: np.ndarray, score: np.ndarray, contributions: np.ndarray):
+        self.user_id = user_id
+        self.score = score
+        # shape (n_users, len(RULES)); points each rule added for each user, 0 if it did not apply
+        self.contributions = contributions
+        self.rule_names = RULE_NAMES
+
+    @property
+    def risk_level(self) -> np.ndarray:
+        return np.where(self.score >= 70, 'Low', np.where(self.score >= 50, 'Medium', 'High'))
+
+    def to_frame(self, include_contributions: bool = False) -> pd.DataFrame:
+        frame = pd.DataFrame({'user_id': self.user_id, 'score': self.score, 'risk_level': self.risk_level})
+        if include_contributions:
+            contributions = pd.DataFrame(self.contributions, columns=self.rule_names)
+            frame = pd.concat([frame, contributions], axis=1)
+        return frame
+
+
+def select_users(features: pd.DataFrame, user_ids: Iterable) -> pd.DataFrame:
+    """Rows of a feature table for `user_ids`, in the requested order; ids without a row are skipped"""
+    positions = pd.Index(features['user_id']).get_indexer(list(user_ids))
+    return features.iloc[positions[positions >= 0]]
+
+
+def missing_user_ids(user_ids: Optional[Iterable], scored: np.ndarray) -> list:
+    """Requested ids that got no score, in request order"""
+    if user_ids is None:
+        return []
+    found = set(scored.tolist())
+    return [user_id for user_id in user_ids if user_id not in found]
+
+
+def _column(features: pd.DataFrame, rule: Rule, n: int) -> np.ndarray:
+    if rule.column not in features:
+        return np.zeros(n) if rule.op != 'eq' else np.full(n, '', dtype=object)
+    values = features[rule.column]
+    if rule.op == 'eq':
+        return values
+    return pd.to_numeric(values, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+
+
+def score_batch(features: pd.DataFrame, user_ids: Optional[Iterable] = None) -> BatchScores:
+    """
+    Score every row of a feature table (the master_agent() layout) at once,
+    or only the rows of `user_ids`, in that order (see `missing_user_ids`).
+    Produces the same scores as `get_rule_based_credit_score` row by row.
+    """
+    if user_ids is not None:
+        features = select_users(features, user_ids)
+    n = len(features)
+    contributions = np.zeros((n, len(RULES)), dtype=np.int16)
+    remaining = {}
+    columns = {}
+    for i, rule in enumerate(RULES):
+        if rule.column not in columns:
+            columns[rule.column] = _column(features, rule, n)
+        values = columns[rule.column]
+        if rule.op == 'eq':
+            mask = np.array(values == rule.value, dtype=bool)
+        elif rule.op == 'between':
+            mask = (values > rule.value[0]) & (values < rule.value[1])
+        else:
+            mask = values > rule.value
+        free = remaining.get(rule.group)
+        if free is not None:
+            mask &= free
+            free &= ~mask
+        else:
+            remaining[rule.group] = ~mask
+        contributions[mask, i] = rule.points
+    score = clip_score(BASE_SCORE + contributions.sum(axis=1, dtype=np.int32)).astype(np.int16)
+    user_id = features['user_id'].to_numpy() if 'user_id' in features else np.arange(n)
+    return BatchScores(user_id, score, contributions)
@@ -0,0 +1,74 @@
+"""
+Partitioning users into shards for the batch scorer.
+
+A shard is a predicate on user_id. The batch scorer applies it to every
+source table as the table is loaded, so each worker only aggregates and
+scores its own users, and every user's features come from exactly the
+same rows, in the same order, whatever the number of shards.
+
+"hash" mixes the id with a multiplicative (Fibonacci) hash before taking
+it modulo the shard count, so strided id patterns still spread evenly.
+"range" cuts the sorted ids of users.csv into runs of equal length, so
+each shard's output is one contiguous block of the final file.
+"""
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+SHARD_MODES = ('hash', 'range')
+
+# 2**64 / golden ratio
+_FIBONACCI = np.uint64(0x9E3779B97F4A7C15)
+
+
+class Shard:
+    """Users `index` of `count`: by hash, or lower <= user_id < upper"""
+
+    def __init__(self, index: int, count: int, mode: str = 'hash',
+                 lower: Optional[int] = None, upper: Optional[int] = None):
+        if mode not in SHARD_MODES:
+            raise ValueError(f"Unknown shard mode {mode!r}, expected one of {SHARD_MODES}")
+        self.index = index
+        self.count = count
+        self.mode = mode
+        self.lower = lower
+        self.upper = upper
+
+    def mask(self, user_ids) -> np.ndarray:
+        ids = np.asarray(user_ids, dtype=np.int64)
+        if self.mode == 'hash':
+            # High 32 bits of the mixed id, scaled to [0, count) by a multiply-shift instead of a modulo
+            mixed = (ids.astype(np.uint64) * _FIBONACCI) >> np.uint64(32)
+            return (mixed * np.uint64(self.count)) >> np.uint64(32) == self.index
+        mask = np.ones(len(ids), dtype=bool)
+        if self.lower is not None:
+            mask &= ids >= self.lower
+        if self.upper is not None:
+            mask &= ids < self.upper
+        return mask
+
+    def __repr__(self):
+        if self.mode == 'hash':
+            return f"Shard({self.index}/{self.count}, hash)"
+        return f"Shard({self.index}/{self.count}, [{self.lower}, {self.upper}))"
+
+
+def hash_shards(count: int) -> List[Shard]:
+    return [Shard(i, count, 'hash') for i in range(count)]
+
+
+def range_shards(user_ids: Iterable[int], count: int) -> List[Shard]:
+    """`count` shards holding (nearly) the same number of the given user_ids"""
+    ids = np.unique(np.asarray(list(user_ids), dtype=np.int64))
+    positions = np.linspace(0, len(ids), count + 1).astype(int)[1:-1]
+    cuts = [int(ids[i]) if len(ids) else 0 for i in np.minimum(positions, len(ids) - 1)]
+    bounds = [None, *cuts, None]
+    return [Shard(i, count, 'range', bounds[i], bounds[i + 1]) for i in range(count)]
+
+
+def make_shards(mode: str, count: int, user_ids: Iterable[int] = ()) -> List[Shard]:
+    if mode == 'range':
+        return range_shards(user_ids, count)
+    if mode == 'hash':
+        return hash_shards(count)
+    raise ValueError(f"Unknown shard mode {mode!r}, expected one of {SHARD_MODES}")
@@ -0,0 +1,102 @@
+"""
+Request coalescing ("single flight").
+
+When several requests need the same result at the same time, e.g. a burst
+of /process calls for one user, only the first one computes it. The
+others wait for that computation and all get its result, or its exception.
+Model load then follows the number of distinct users in flight, not the
+number of requests.
+
+A key is only shared while its computation runs. Once it has finished,
+the next request starts a new one (which usually answers from the
+assessment cache). Results are shared, not copied, so callers must not
+modify them.
+
+- `do(key, func, *args)` is for threads. The first caller runs `func` on
+  its own thread and the others block until it finishes.
+- `do_async(key, func, *args)` is for coroutines on one event loop. The
+  computation runs as its own task, and every caller awaits it through
+  asyncio.shield. A client that disconnects stops waiting without
+  cancelling the answer for the others. Calls on different event loops
+  never share a task.
+
+Started computations and merged requests are counted per group in
+credit_single_flights_total and credit_coalesced_requests_total.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Dict, Hashable, Tuple
+
+from app.core.metrics import COALESCED, SINGLE_FLIGHTS
+
+
+class SingleFlight:
+    def __init__(self, name: str, enabled: bool = True):
+        self.name = name
+        # False runs every call on its own, e.g. to measure what coalescing saves
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        # (event loop, key) -> Task
+        self._tasks: Dict[Tuple[asyncio.AbstractEventLoop, Hashable], asyncio.Task] = {}
+
+    def do(self, key: Hashable, func, *args):
+        """func(*args), shared with every other thread calling with the same key meanwhile"""
+        if not self.enabled:
+            return func(*args)
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            COALESCED.inc(flight=self.name)
+            return future.result()
+
+        SINGLE_FLIGHTS.inc(flight=self.name)
+        try:
+            result = func(*args)
+        except BaseException as e:
+            self._finish(key)
+            future.set_exception(e)
+            raise
+        self._finish(key)
+        future.set_result(result)
+        return result
+
+    def _finish(self, key: Hashable):
+        with self._lock:
+            del self._calls[key]
+
+    async def do_async(self, key: Hashable, func, *args):
+        """await func(*args), shared with every other coroutine on this loop awaiting the same key meanwhile"""
+        if not self.enabled:
+            return await func(*args)
+        loop = asyncio.get_running_loop()
+        task_key = (loop, key)
+        task = self._tasks.get(task_key)
+        if task is None:
+            SINGLE_FLIGHTS.inc(flight=self.name)
+            # The task runs in a copy of this caller's context, so its stage timings count for this request
+            task = self._tasks[task_key] = loop.create_task(func(*args))
+            task.add_done_callback(lambda done: self._task_done(task_key, done))
+        else:
+            COALESCED.inc(flight=self.name)
+        return await asyncio.shield(task)
+
+    def _task_done(self, task_key: tuple, task: asyncio.Task):
+        if self._tasks.get(task_key) is task:
+            del self._tasks[task_key]
+        # Mark a failure as retrieved even if every caller stopped waiting
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = len(self._calls)
+        return {
+            'in_flight': in_flight + len(self._tasks),
+            'started': int(SINGLE_FLIGHTS.value(flight=self.name)),
+            'coalesced': int(COALESCED.value(flight=self.name)),
+        }
@@ -0,0 +1,103 @@
+"""
+Minimal DAG scheduler for the feature build.
+
+Each `Task` names the tasks whose results it takes as arguments. Tasks run
+on a pool as soon as their dependencies have finished, so shared inputs
+(users.csv, location_data.csv) are loaded once and independent agents
+overlap. A failed task only takes down the tasks that depend on it;
+everything else still completes and reports its result and timing.
+
+pandas holds the GIL for most of a groupby, so CPU-bound tasks only run in
+parallel on a process pool (`processes=True`, forked workers; task
+functions and results must be picklable). The thread pool is the portable
+default and still overlaps file I/O.
+"""
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional
+
+FORK_AVAILABLE = "fork" in multiprocessing.get_all_start_methods()
+
+
+class Task:
+    """`func(*args, *results of deps)`"""
+
+    def __init__(self, name: str, func: Callable, deps: Iterable[str] = (), args: tuple = ()):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.args = tuple(args)
+
+
+class TaskResult:
+    def __init__(self, value=None, error: Optional[str] = None, seconds: float = 0.0):
+        self.value = value
+        self.error = error
+        self.seconds = seconds
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        status = "ok" if self.ok else f"failed: {self.error}"
+        return f"TaskResult({status}, {self.seconds * 1e3:.1f} ms)"
+
+
+def _timed(func: Callable, args: List) -> TaskResult:
+    start = time.perf_counter()
+    try:
+        value = func(*args)
+    except Exception as e:
+        return TaskResult(error=f"{type(e).__name__}: {e}", seconds=time.perf_counter() - start)
+    return TaskResult(value, seconds=time.perf_counter() - start)
+
+
+def _pool(max_workers: int, processes: bool):
+    if processes and FORK_AVAILABLE:
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("fork"))
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tasks")
+
+
+def run_tasks(tasks: Iterable[Task], max_workers: int = 4, processes: bool = False) -> Dict[str, TaskResult]:
+    """Run every task once its dependencies succeeded; returns name -> TaskResult"""
+    tasks = {task.name: task for task in tasks}
+    for task in tasks.values():
+        missing = [dep for dep in task.deps if dep not in tasks]
+        if missing:
+            raise ValueError(f"Task {task.name!r} depends on unknown tasks {missing}")
+
+    results: Dict[str, TaskResult] = {}
+    pending = dict(tasks)
+    running = {}
+    with _pool(max_workers, processes) as pool:
+        while pending or running:
+            # Rescan while a pass settles something: a failed dependency resolves its dependents
+            # right away, and they may be listed before it
+            progress = True
+            while progress:
+                progress = False
+                for name, task in list(pending.items()):
+                    if not all(dep in results for dep in task.deps):
+                        continue
+                    del pending[name]
+                    progress = True
+                    failed = [dep for dep in task.deps if not results[dep].ok]
+                    if failed:
+                        results[name] = TaskResult(error=f"dependency failed: {', '.join(failed)}")
+                        continue
+                    args = [*task.args, *(results[dep].value for dep in task.deps)]
+                    running[pool.submit(_timed, task.func, args)] = name
+            if not running:
+                if pending:
+                    raise ValueError(f"Dependency cycle among tasks {sorted(pending)}")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:  # e.g. a worker process died or the result did not pickle
+                    results[name] = TaskResult(error=f"{type(e).__name__}: {e}")
+    return results
@@ -0,0 +1,88 @@
+"""
+Lookup index over the users in the feature table.
+
+Names are normalized to lower-case word tokens and stored as a token trie
+(a flat dict of token-tuple prefixes), so every user named in a query is
+found in one left-to-right pass over the query's tokens, independent of
+the number of users. user_ids map straight to their precomputed rows.
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+TOKEN_RE = re.compile(r"[^\W_]+")
+# "user 42", "user_id 42", "user #42", "id: 42"
+USER_ID_RE = re.compile(r"\b(?:user(?:[ _-]?id)?|id)\s*[:#]?\s*(\d+)\b")
+
+
+def normalize_tokens(text: str) -> Tuple[str, ...]:
+    return tuple(TOKEN_RE.findall(text.lower()))
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(normalize_tokens(name))
+
+
+class UserIndex:
+    def __init__(self, frame: pd.DataFrame, version: Optional[int] = None):
+        self.version = version
+        self.names: Dict[int, str] = {}
+        # normalized name -> user_ids carrying it, in table order
+        self.by_name: Dict[str, List[int]] = {}
+        # token prefix -> True if the prefix is a complete name
+        self._prefixes: Dict[Tuple[str, ...], bool] = {}
+        for user_id, name in zip(frame['user_id'].tolist(), frame['name'].tolist()):
+            if not isinstance(name, str):
+                continue
+            self.names[user_id] = name
+            tokens = normalize_tokens(name)
+            if not tokens:
+                continue
+            self.by_name.setdefault(" ".join(tokens), []).append(user_id)
+            for end in range(1, len(tokens)):
+                self._prefixes.setdefault(tokens[:end], False)
+            self._prefixes[tokens] = True
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def ids_for_name(self, name: str) -> List[int]:
+        """user_ids whose normalized name equals `name` exactly"""
+        return self.by_name.get(normalize_name(name), [])
+
+    def find_mentions(self, query: str) -> List[Tuple[int, str]]:
+        """
+        Every (user_id, name) referred to in the query, in order of appearance.
+        At each position the longest matching name wins ("Ann Lee Smith"
+        over "Ann Lee"). Explicit ids ("user 42") are included as well.
+        """
+        mentions = []
+        seen = set()
+        for match in USER_ID_RE.finditer(query.lower()):
+            user_id = int(match.group(1))
+            if user_id in self.names and user_id not in seen:
+                seen.add(user_id)
+                mentions.append((user_id, self.names[user_id]))
+
+        tokens = normalize_tokens(query)
+        i = 0
+        while i < len(tokens):
+            longest = None
+            end = i + 1
+            while end <= len(tokens):
+                is_name = self._prefixes.get(tokens[i:end])
+                if is_name is None:
+                    break
+                if is_name:
+                    longest = end
+                end += 1
+            if longest is None:
+                i += 1
+                continue
+            for user_id in self.by_name[" ".join(tokens[i:longest])]:
+                if user_id not in seen:
+                    seen.add(user_id)
+                    mentions.append((user_id, self.names[user_id]))
+            i = longest
+        return mentions
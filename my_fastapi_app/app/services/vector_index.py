@@ -0,0 +1,133 @@
+"""
+Resident, hot-swappable knowledge-base indexes.
+
+Each knowledge base is kept on disk as immutable versions:
+
+    <root>/<kb>/<version>/   one complete store (for FAISS: index.faiss + index.pkl)
+    <root>/<kb>/CURRENT      name of the live version
+
+A writer fills a new version directory and then replaces CURRENT with
+os.replace, so a reader finds either the old version or the new one, never
+a half-written store. The newest KEEP_VERSIONS versions are kept, which lets
+a process that read CURRENT just before a swap still load what it found.
+
+`IndexManager` loads the live version of every knowledge base once and
+keeps it in memory for the life of the process. Searches take no lock:
+they read the current snapshot, and publishing a version is a single
+reference assignment, so a search that started on the old snapshot simply
+finishes on it (the old store is freed with its last reader). Loading runs
+under a per-knowledge-base lock, so a version is loaded once however many
+queries arrive meanwhile, and while a new version loads the others keep
+searching the old one. At most every `check_interval` seconds a search also
+reads CURRENT, which picks up versions published by other processes.
+"""
+import os
+import shutil
+import threading
+import time
+from typing import Callable, Dict, Generic, NamedTuple, Optional, TypeVar
+
+T = TypeVar('T')
+
+CURRENT = "CURRENT"
+KEEP_VERSIONS = 2
+
+
+class Snapshot(NamedTuple):
+    version: str
+    store: object
+    loaded_at: float
+
+
+def current_version(kb_dir: str) -> Optional[str]:
+    try:
+        with open(os.path.join(kb_dir, CURRENT), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def new_version_dir(kb_dir: str) -> str:
+    """An empty directory for the next version; readers don't see it until it is published"""
+    os.makedirs(kb_dir, exist_ok=True)
+    path = os.path.join(kb_dir, f"v{time.time_ns()}")
+    os.makedirs(path)
+    return path
+
+
+def publish_version(kb_dir: str, version_dir: str, keep: int = KEEP_VERSIONS):
+    """Atomically make `version_dir` the live version, then delete all but the newest `keep` versions"""
+    tmp = os.path.join(kb_dir, f".{CURRENT}.{os.getpid()}.{threading.get_ident()}")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(os.path.basename(version_dir))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(kb_dir, CURRENT))
+    versions = sorted(name for name in os.listdir(kb_dir) if name.startswith("v"))
+    for name in versions[:-keep]:
+        if name != os.path.basename(version_dir):
+            shutil.rmtree(os.path.join(kb_dir, name), ignore_errors=True)
+
+
+class IndexManager(Generic[T]):
+    def __init__(self, root: str, load: Callable[[str], T], check_interval: float = 1.0, clock=time.monotonic):
+        self.root = root
+        self.load = load
+        self.check_interval = check_interval
+        self.clock = clock
+        self._snapshots: Dict[str, Snapshot] = {}
+        self._checked: Dict[str, float] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def kb_dir(self, kb: str) -> str:
+        return os.path.join(self.root, kb)
+
+    def _lock(self, kb: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(kb, threading.Lock())
+
+    def get(self, kb: str) -> Optional[T]:
+        """The live store of `kb`, or None if nothing was published for it yet"""
+        snapshot = self._snapshots.get(kb)
+        if snapshot is not None and self.clock() - self._checked.get(kb, float("-inf")) < self.check_interval:
+            return snapshot.store
+        return self._refresh(kb, snapshot)
+
+    def _refresh(self, kb: str, snapshot: Optional[Snapshot]) -> Optional[T]:
+        self._checked[kb] = self.clock()
+        version = current_version(self.kb_dir(kb))
+        if version is None or (snapshot is not None and snapshot.version == version):
+            return None if snapshot is None else snapshot.store
+        lock = self._lock(kb)
+        # With a version already loaded, don't wait for another thread's load; keep serving the old one
+        if not lock.acquire(blocking=snapshot is None):
+            return snapshot.store
+        try:
+            current = self._snapshots.get(kb)
+            if current is not None and current.version == version:
+                return current.store
+            store = self.load(os.path.join(self.kb_dir(kb), version))
+            self._snapshots[kb] = Snapshot(version, store, time.time())
+            return store
+        except Exception as e:
+            print(f"Could not load version {version} of knowledge base {kb}: {e}")
+            return None if snapshot is None else snapshot.store
+        finally:
+            lock.release()
+
+    def publish(self, kb: str, version_dir: str, store: Optional[T] = None):
+        """
+        Make a fully written version live for every process; `store` is the
+        same version already in memory (e.g. just built), which this process
+        then swaps in without loading it back from disk
+        """
+        publish_version(self.kb_dir(kb), version_dir)
+        if store is not None:
+            with self._lock(kb):
+                self._snapshots[kb] = Snapshot(os.path.basename(version_dir), store, time.time())
+            self._checked[kb] = self.clock()
+
+    def status(self) -> Dict[str, dict]:
+        return {kb: {"version": snapshot.version, "loaded_at": snapshot.loaded_at}
+                for kb, snapshot in list(self._snapshots.items())}
@@ -0,0 +1,166 @@
+"""
+Typed columnar cache for the CSV sources in docs/.
+
+The first load of a CSV parses it once, converts it to compact column types
+(int32 user_id, datetime64 timestamps, float32 amounts, categorical strings)
+and writes every column as its own .npy file under a directory keyed by the
+SHA-1 of the CSV contents. Later loads memory-map those arrays instead of
+parsing text, so repeated reads of the same file cost a few page faults.
+
+Each source gets its own subdirectory, named after the file and a hash of its
+absolute path, so two CSVs with the same name never share or evict entries;
+writing a new version only removes older versions of the same source.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.core.metrics import stage
+from app.core.settings import COLUMNAR_CACHE_DIR
+
+# Bump when the on-disk layout or the type conversions change
+CACHE_FORMAT_VERSION = 2
+
+TIMESTAMP_COLUMNS = ('timestamp',)
+# String columns with at most this share of distinct values stay categorical on load
+CATEGORICAL_MAX_RATIO = 0.5
+
+_hash_memo: Dict[Tuple[str, int, int], str] = {}
+_lock = threading.Lock()
+
+
+def file_hash(path: str) -> str:
+    """SHA-1 of the file contents, memoized on (path, mtime, size)"""
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    digest = _hash_memo.get(key)
+    if digest is None:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        _hash_memo[key] = digest
+    return digest
+
+
+def coerce_types(df: pd.DataFrame) -> pd.DataFrame:
+    """Apply the cache's compact column types to a freshly parsed frame"""
+    df = df.copy()
+    for col in df.columns:
+        values = df[col]
+        if col == 'user_id' and pd.api.types.is_integer_dtype(values):
+            df[col] = values.astype(np.int32)
+        elif col in TIMESTAMP_COLUMNS and not pd.api.types.is_datetime64_any_dtype(values):
+            df[col] = pd.to_datetime(values)
+        elif 'amount' in col and pd.api.types.is_float_dtype(values):
+            df[col] = values.astype(np.float32)
+    return df
+
+
+def _source_dir(path: str, cache_dir: str) -> str:
+    stem = os.path.splitext(os.path.basename(path))[0]
+    source = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(cache_dir, f"{stem}-{source}")
+
+
+def _cache_dir(path: str, cache_dir: str) -> str:
+    return os.path.join(_source_dir(path, cache_dir), f"v{CACHE_FORMAT_VERSION}-{file_hash(path)[:16]}")
+
+
+def _write(df: pd.DataFrame, target: str):
+    parent = os.path.dirname(target)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+    columns = []
+    for i, col in enumerate(df.columns):
+        values = df[col]
+        entry = {"name": col, "file": f"{i}.npy"}
+        if pd.api.types.is_bool_dtype(values) or pd.api.types.is_numeric_dtype(values) \
+                or pd.api.types.is_datetime64_dtype(values):
+            entry["kind"] = "array"
+            np.save(os.path.join(tmp, entry["file"]), values.to_numpy())
+        else:
+            # Strings are stored as codes + categories so they can be memory-mapped too
+            cat = values.astype('category').cat
+            entry["kind"] = "category"
+            entry["categories"] = [str(c) for c in cat.categories]
+            entry["as_strings"] = len(cat.categories) > CATEGORICAL_MAX_RATIO * max(len(values), 1)
+            np.save(os.path.join(tmp, entry["file"]), cat.codes.to_numpy())
+        columns.append(entry)
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"rows": len(df), "columns": columns}, f)
+    try:
+        os.rename(tmp, target)
+    except OSError:
+        # Another process cached the same file first
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+    # Older versions of this CSV are no longer reachable; other sources live in their own directories
+    for name in os.listdir(parent):
+        old = os.path.join(parent, name)
+        if old != target and not name.startswith(".tmp-"):
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def _read(target: str, user_filter: Callable[[np.ndarray], np.ndarray] = None) -> pd.DataFrame:
+    with open(os.path.join(target, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    rows = None
+    if user_filter is not None:
+        for entry in meta["columns"]:
+            if entry["name"] == "user_id":
+                rows = user_filter(np.load(os.path.join(target, entry["file"]), mmap_mode='r'))
+    data = {}
+    for entry in meta["columns"]:
+        values = np.load(os.path.join(target, entry["file"]), mmap_mode='r')
+        if rows is not None:
+            # Only the selected rows are copied out of the mapping (and decoded to strings below)
+            values = values[rows]
+        if entry["kind"] == "category":
+            cat = pd.Categorical.from_codes(values, categories=entry["categories"])
+            data[entry["name"]] = np.asarray(cat, dtype=object) if entry["as_strings"] else cat
+        else:
+            data[entry["name"]] = values
+    return pd.DataFrame(data)
+
+
+def load_csv(path: str, cache_dir: Optional[str] = None,
+             user_filter: Callable[[np.ndarray], np.ndarray] = None) -> pd.DataFrame:
+    """
+    Drop-in replacement for `pd.read_csv(path)` backed by the columnar cache
+    in `cache_dir` (COLUMNAR_CACHE_DIR by default).
+    Falls back to parsing the CSV if the cache can't be read or written.
+    `user_filter(user_ids) -> bool mask` keeps only the matching rows of
+    tables with a user_id column.
+    """
+    with stage('csv_load', os.path.basename(path)):
+        return _load(path, cache_dir or COLUMNAR_CACHE_DIR, user_filter)
+
+
+def _load(path: str, cache_dir: str, user_filter) -> pd.DataFrame:
+    target = _cache_dir(path, cache_dir)
+    if os.path.isdir(target):
+        try:
+            return _read(target, user_filter)
+        except Exception as e:
+            print(f"Columnar cache unreadable for {path}, re-parsing: {e}")
+            shutil.rmtree(target, ignore_errors=True)
+    df = coerce_types(pd.read_csv(path))
+    with _lock:
+        try:
+            if not os.path.isdir(target):
+                _write(df, target)
+                return _read(target, user_filter)
+        except Exception as e:
+            print(f"Could not write columnar cache for {path}: {e}")
+    if user_filter is not None and 'user_id' in df.columns:
+        df = df[user_filter(df['user_id'].to_numpy())].reset_index(drop=True)
+    return df
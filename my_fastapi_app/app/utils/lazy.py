@@ -0,0 +1,36 @@
+"""
+Deferred construction of heavy objects.
+
+`Lazy(factory)` stands in for `factory()` and only calls it on the first
+attribute access, so a module can hold, say, an Ollama client from import
+time without importing the client library (and httpx behind it) until
+something actually talks to the model.
+"""
+import threading
+from typing import Callable, Generic, TypeVar
+
+T = TypeVar('T')
+
+
+class Lazy(Generic[T]):
+    def __init__(self, factory: Callable[[], T]):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value = None
+        self._created = False
+
+    @property
+    def created(self) -> bool:
+        return self._created
+
+    def get(self) -> T:
+        if not self._created:
+            with self._lock:
+                if not self._created:
+                    self._value = self._factory()
+                    self._created = True
+        return self._value
+
+    def __getattr__(self, name):
+        # Only called for names not set in __init__, i.e. the wrapped object's attributes
+        return getattr(self.get(), name)
@@ -0,0 +1,25 @@
+# Server-sent events helpers shared by /process/stream and the chat router
+import json
+from typing import AsyncIterator, Optional, Tuple
+
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    """Format one SSE frame with a JSON payload"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+async def iter_sse(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[str, dict]]:
+    """Parse an SSE line stream (e.g. httpx `aiter_lines()`) into (event, payload) pairs"""
+    event, data = "message", []
+    async for line in lines:
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+    if data:
+        yield event, json.loads("\n".join(data))
@@ -0,0 +1,281 @@
+"""
+Streaming multipart uploads.
+
+`receive_files(request, dest_dir, max_bytes)` parses a multipart/form-data
+body as it arrives, instead of letting Starlette spool every file and then
+copying it. Each file part is written straight to a temp file in
+`dest_dir` and hashed on the way. When the body is complete the part is
+renamed into place with os.replace, so readers of `dest_dir` (the feature
+store, ingestion) never see a half-written file.
+
+- Memory use is one network chunk, whatever the file size.
+- Disk writes and hashing run on a worker thread, so the event loop keeps
+  serving other requests during a multi-GB upload.
+- A body larger than `max_bytes` is refused from its Content-Length, or
+  aborted as soon as it crosses the cap (UploadTooLarge). Its temp files
+  are removed.
+
+A file is not written again when its name already holds the same bytes
+("unchanged"). Skipping the rewrite keeps the file's mtime, so the feature
+store does not rebuild for an identical re-upload. Every other upload is
+placed under the name it was sent with, since readers look files up by
+name. When the same bytes already exist under another name, the file is
+still placed and only marked "duplicate" (with `duplicate_of`); knowledge
+base ingestion shares the chunks of identical texts, so a duplicate
+document is not embedded again. Hashes of placed files are kept in a
+small manifest in `dest_dir`, checked against each file's size and mtime.
+A file not in the manifest is only hashed when an upload of the same size
+arrives for it.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.formparsers import parse_options_header
+from starlette.requests import Request
+
+try:
+    import python_multipart as multipart
+except ImportError:  # python-multipart < 0.0.13
+    import multipart
+
+MANIFEST = ".uploads.json"
+TEMP_PREFIX = ".upload-"
+# Plain form fields (e.g. kb_name) are kept in memory; they are never large
+MAX_FIELD_BYTES = 64 * 1024
+HASH_BLOCK = 1024 * 1024
+
+
+class UploadError(Exception):
+    """The body is not a well-formed multipart upload"""
+
+
+class UploadTooLarge(UploadError):
+    pass
+
+
+class SavedFile(NamedTuple):
+    filename: str
+    path: str
+    size: int
+    sha256: str
+    status: str  # "saved", "unchanged" (not rewritten) or "duplicate" (saved; same bytes as duplicate_of)
+    duplicate_of: Optional[str] = None
+
+
+class _FilePart:
+    def __init__(self, dest_dir: str, filename: str):
+        self.filename = filename
+        fd, self.tmp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=dest_dir)
+        self.file = os.fdopen(fd, "wb")
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes):
+        self.file.write(data)
+        self.hash.update(data)
+        self.size += len(data)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def discard(self):
+        self.close()
+        if self.tmp_path is not None:
+            try:
+                os.remove(self.tmp_path)
+            except FileNotFoundError:
+                pass
+            self.tmp_path = None
+
+
+class _Receiver:
+    """
+    python-multipart callbacks. They only queue the bytes of the chunk being
+    parsed; `flush()` writes them out on a worker thread before the next chunk
+    """
+
+    def __init__(self, dest_dir: str):
+        self.dest_dir = dest_dir
+        self.fields: Dict[str, str] = {}
+        self.parts: List[_FilePart] = []
+        self.pending: List[Tuple[_FilePart, bytes]] = []
+        self._headers: List[Tuple[bytes, bytes]] = []
+        self._header_name = b""
+        self._header_value = b""
+        self._name = ""
+        self._part: Optional[_FilePart] = None
+        self._data = bytearray()
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._headers, self._part, self._data = [], None, bytearray()
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers.append((self._header_name.lower(), self._header_value))
+        self._header_name, self._header_value = b"", b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(Headers(raw=self._headers).get("content-disposition", ""))
+        if b"name" not in options:
+            raise UploadError('Part without a Content-Disposition "name"')
+        self._name = options[b"name"].decode("utf-8", "replace")
+        if b"filename" in options:
+            # Only the last path component: a client can't write outside dest_dir
+            filename = os.path.basename(options[b"filename"].decode("utf-8", "replace").replace("\\", "/"))
+            if not filename or filename.startswith("."):
+                raise UploadError(f"Invalid file name {filename!r}")
+            self._part = _FilePart(self.dest_dir, filename)
+            self.parts.append(self._part)
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._part is not None:
+            self.pending.append((self._part, data[start:end]))
+        elif len(self._data) + end - start > MAX_FIELD_BYTES:
+            raise UploadError(f"Form field {self._name!r} is over {MAX_FIELD_BYTES} bytes")
+        else:
+            self._data += data[start:end]
+
+    def on_part_end(self):
+        if self._part is None:
+            self.fields[self._name] = self._data.decode("utf-8", "replace")
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        for part, data in pending:
+            part.write(data)
+
+    def discard(self):
+        for part in self.parts:
+            part.discard()
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class UploadManifest:
+    """sha256 of the files placed in a directory, trusted while a file's size and mtime are unchanged"""
+
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, MANIFEST)
+        self.directory = directory
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.entries: Dict[str, dict] = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+    def sha256(self, filename: str, size: Optional[int] = None) -> Optional[str]:
+        """Hash of the file as it is now; a file the manifest doesn't know is hashed if it has `size` bytes"""
+        try:
+            stat = os.stat(os.path.join(self.directory, filename))
+        except FileNotFoundError:
+            return None
+        entry = self.entries.get(filename)
+        if entry is not None and (entry["size"], entry["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+            return entry["sha256"]
+        if size is not None and stat.st_size == size:
+            return self.record(filename, file_sha256(os.path.join(self.directory, filename)))
+        return None
+
+    def find(self, sha256: str) -> Optional[str]:
+        for filename, entry in self.entries.items():
+            if entry["sha256"] == sha256 and self.sha256(filename) == sha256:
+                return filename
+        return None
+
+    def record(self, filename: str, sha256: str) -> str:
+        stat = os.stat(os.path.join(self.directory, filename))
+        self.entries[filename] = {"sha256": sha256, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        return sha256
+
+    def save(self):
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+
+
+# Placing files reads and rewrites the manifest
+_place_lock = threading.Lock()
+
+
+def place_files(parts: List[_FilePart], dest_dir: str) -> List[SavedFile]:
+    saved = []
+    with _place_lock:
+        manifest = UploadManifest(dest_dir)
+        for part in parts:
+            part.close()
+            sha256 = part.hash.hexdigest()
+            path = os.path.join(dest_dir, part.filename)
+            if manifest.sha256(part.filename, part.size) == sha256:
+                part.discard()
+                saved.append(SavedFile(part.filename, path, part.size, sha256, "unchanged"))
+                continue
+            # Another name with these bytes, if any; this name was checked above
+            other = manifest.find(sha256)
+            os.replace(part.tmp_path, path)
+            part.tmp_path = None
+            manifest.record(part.filename, sha256)
+            saved.append(SavedFile(part.filename, path, part.size, sha256,
+                                   "saved" if other is None else "duplicate", other))
+        manifest.save()
+    return saved
+
+
+async def receive_files(request: Request, dest_dir: str, max_bytes: int) -> Tuple[Dict[str, str], List[SavedFile]]:
+    """Stream a multipart body into `dest_dir`; returns its plain fields and the files it held"""
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    if b"boundary" not in params:
+        raise UploadError("Expected a multipart/form-data body")
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > max_bytes:
+        raise UploadTooLarge(f"Upload of {int(length)} bytes is over the {max_bytes} byte limit")
+
+    os.makedirs(dest_dir, exist_ok=True)
+    receiver = _Receiver(dest_dir)
+    parser = multipart.MultipartParser(params[b"boundary"], receiver.callbacks())
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_bytes:
+                raise UploadTooLarge(f"Upload is over the {max_bytes} byte limit")
+            parser.write(chunk)
+            if receiver.pending:
+                await asyncio.to_thread(receiver.flush)
+        parser.finalize()
+        await asyncio.to_thread(receiver.flush)
+        return receiver.fields, await asyncio.to_thread(place_files, receiver.parts, dest_dir)
+    except multipart.exceptions.MultipartParseError as e:
+        raise UploadError(f"Malformed multipart body: {e}") from e
+    finally:
+        # Placed parts were renamed or removed already; anything left is from an aborted upload
+        await asyncio.to_thread(receiver.discard)
@@ -0,0 +1,129 @@
+"""
+Re-score the whole portfolio with the rule-based scorer.
+
+    python batch_score.py --output scores.csv [--contributions] [--user-ids 1 2 3]
+    python batch_score.py --workers 8 [--shard-by hash|range] [--llm --llm-concurrency 4]
+    python batch_score.py --llm --llm-mode packed [--llm-batch-size 8]
+
+Users are split into shards by user_id (app/services/sharding.py) and each
+shard runs in its own forked process: it builds the feature table for its
+users only, straight from the docs/ sources, scores them and optionally
+asks the LLM for an assessment (server.score_users_with_llm), at most
+--llm-concurrency calls at a time per worker. The shards' rows are merged
+in user_id order into one file, which comes out byte-for-byte the same for
+any number of workers.
+"""
+import argparse
+import asyncio
+import copy
+import os
+import time
+from typing import Dict
+
+import pandas as pd
+
+import server
+from app.core.settings import (LLM_BATCH_MODE, LLM_BATCH_SIZE, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_PATH, LLM_CACHE_TTL,
+                               LLM_MAX_CONCURRENCY)
+from app.services.feature_store import FeatureStore
+from app.services.llm_batch import BATCH_MODES
+from app.services.llm_cache import AssessmentCache
+from app.services.rule_scoring import score_batch
+from app.services.sharding import SHARD_MODES, Shard, make_shards
+from app.services.task_graph import FORK_AVAILABLE, Task, TaskResult, run_tasks
+from app.utils.columnar_cache import load_csv
+
+_MAIN_PID = os.getpid()
+
+# Per-shard timings and errors of the last run_sharded() call
+last_shard_run: Dict[str, TaskResult] = {}
+
+
+def shard_store(shard: Shard, data_dir: str) -> FeatureStore:
+    """Feature store over only the shard's rows of every source"""
+    # Private copies of the nodes, so the shard's state never replaces the server store's
+    nodes = [copy.copy(node) for node in server.FEATURE_NODES]
+    for node in nodes:
+        node.state = None
+    return FeatureStore(nodes, server.assemble_feature_table, data_dir,
+                        loader=lambda path: load_csv(path, user_filter=shard.mask), prepare=server.prepare_source)
+
+
+def score_shard(shard: Shard, data_dir: str, user_ids=None, contributions: bool = False,
+                llm: bool = False, llm_concurrency: int = LLM_MAX_CONCURRENCY,
+                llm_mode: str = LLM_BATCH_MODE, llm_batch_size: int = LLM_BATCH_SIZE) -> pd.DataFrame:
+    features = shard_store(shard, data_dir).warm()
+    frame = score_batch(features, user_ids).to_frame(contributions)
+    frame.insert(1, 'name', frame['user_id'].map(features.set_index('user_id')['name']))
+    if llm:
+        if os.getpid() != _MAIN_PID:
+            # A forked worker must not share the parent's SQLite connection
+            server.assessment_cache = AssessmentCache(LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL, LLM_CACHE_PATH or None)
+        selected = features.set_index('user_id').loc[frame['user_id']].reset_index()
+        frame['llm_assessment'] = asyncio.run(server.score_users_with_llm(
+            selected.to_dict('records'), llm_mode, llm_batch_size, llm_concurrency))
+    return frame
+
+
+def warm_sources(data_dir: str):
+    """Parse every source into the columnar cache once, before the workers fork"""
+    for source in sorted({node.source for node in server.FEATURE_NODES}):
+        try:
+            load_csv(os.path.join(data_dir, source))
+        except Exception as e:
+            print(f"Error loading {source}: {e}")
+
+
+def run_sharded(data_dir: str, workers: int = 1, shards: int = None, shard_by: str = 'hash',
+                user_ids=None, contributions: bool = False, llm: bool = False,
+                llm_concurrency: int = LLM_MAX_CONCURRENCY, llm_mode: str = LLM_BATCH_MODE,
+                llm_batch_size: int = LLM_BATCH_SIZE) -> pd.DataFrame:
+    """Score every user of `data_dir` across `workers` processes; rows in user_id order"""
+    warm_sources(data_dir)
+    users = load_csv(os.path.join(data_dir, "users.csv"))['user_id'] if shard_by == 'range' else ()
+    tasks = [Task(repr(shard), score_shard, args=(shard, data_dir, user_ids, contributions,
+                                                  llm, llm_concurrency, llm_mode, llm_batch_size))
+             for shard in make_shards(shard_by, shards or workers, users)]
+    results = run_tasks(tasks, max_workers=workers, processes=workers > 1)
+    last_shard_run.clear()
+    last_shard_run.update(results)
+    failed = {name: result.error for name, result in results.items() if not result.ok}
+    if failed:
+        raise RuntimeError(f"Shards failed: {failed}")
+    frame = pd.concat([results[task.name].value for task in tasks], ignore_index=True)
+    return frame.sort_values('user_id', kind='stable').reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch rule-based credit scoring over docs/")
+    parser.add_argument("--output", default="scores.csv", help="CSV file to write the scores to")
+    parser.add_argument("--contributions", action="store_true", help="Include the per-rule contribution columns")
+    parser.add_argument("--user-ids", type=int, nargs="*", help="Only score these users")
+    parser.add_argument("--data-dir", default=server.DATA_DIR, help="Directory with the source CSVs")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes")
+    parser.add_argument("--shards", type=int, help="Number of shards (default: one per worker)")
+    parser.add_argument("--shard-by", choices=SHARD_MODES, default='hash')
+    parser.add_argument("--llm", action="store_true", help="Add an LLM assessment column (rule-based if unavailable)")
+    parser.add_argument("--llm-concurrency", type=int, default=LLM_MAX_CONCURRENCY,
+                        help="Simultaneous LLM calls per worker")
+    parser.add_argument("--llm-mode", choices=BATCH_MODES, default=LLM_BATCH_MODE,
+                        help="One prompt per user, or several users packed into one JSON prompt")
+    parser.add_argument("--llm-batch-size", type=int, default=LLM_BATCH_SIZE, help="Users per packed prompt")
+    args = parser.parse_args()
+    if args.workers > 1 and not FORK_AVAILABLE:
+        print("Warning: fork is not available here, shards run on threads")
+
+    start = time.perf_counter()
+    frame = run_sharded(args.data_dir, args.workers, args.shards, args.shard_by, args.user_ids,
+                        args.contributions, args.llm, args.llm_concurrency, args.llm_mode, args.llm_batch_size)
+    elapsed = time.perf_counter() - start
+    if frame.empty:
+        raise SystemExit("Error: Unable to load user data. Please check if CSV files are available.")
+
+    frame.to_csv(args.output, index=False)
+    print(f"Scored {len(frame)} users in {elapsed:.2f} s on {args.workers} worker(s) -> {args.output}")
+    print(frame['risk_level'].value_counts().to_string())
+
+
+if __name__ == "__main__":
+    main()
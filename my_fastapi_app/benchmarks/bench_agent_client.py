@@ -0,0 +1,86 @@
+"""
+Per-message overhead of the chat router -> agent hop.
+
+    python -m benchmarks.bench_agent_client [--messages 500] [--concurrency 1 16]
+
+Compares a new httpx.AsyncClient per message (the previous behaviour), the
+pooled keep-alive HttpAgentClient and the InProcessAgentClient. The query is
+"help", which the agent answers without touching the model or the feature
+table, so the timings are the cost of the hop itself.
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from app.services.agent_service import HttpAgentClient, InProcessAgentClient
+from benchmarks.load_test import free_port, start_server, use_stub
+from benchmarks.stub_ollama import StubOllama
+
+QUERY = "help"
+
+
+class PerMessageClient:
+    """A fresh client (connection pool, TCP handshake) for every message"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+
+    async def start(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+    async def process(self, query: str) -> str:
+        async with httpx.AsyncClient() as client:
+            response = await client.post(f"{self.base_url}/process", json={"query": query}, timeout=60)
+            response.raise_for_status()
+            return response.json().get("result", "Agent returned no result.")
+
+
+async def run(agent, messages: int, concurrency: int) -> float:
+    await agent.start()
+    try:
+        await agent.process(QUERY)  # warm-up
+
+        async def worker(n):
+            for _ in range(n):
+                await agent.process(QUERY)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(messages // concurrency) for _ in range(concurrency)))
+        return (time.perf_counter() - start) / (messages // concurrency * concurrency)
+    finally:
+        await agent.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16])
+    args = parser.parse_args()
+
+    stub = StubOllama()
+    use_stub(stub)
+    port = free_port()
+    srv = start_server(port)
+    base_url = f"http://127.0.0.1:{port}"
+
+    modes = {
+        "new client per message": lambda: PerMessageClient(base_url),
+        "pooled keep-alive": lambda: HttpAgentClient(base_url),
+        "in-process": InProcessAgentClient,
+    }
+    print(f"{'mode':<24}" + "".join(f"{f'{c} client(s) ms/msg':>22}" for c in args.concurrency))
+    for name, factory in modes.items():
+        timings = [asyncio.run(run(factory(), args.messages, c)) for c in args.concurrency]
+        print(f"{name:<24}" + "".join(f"{t * 1e3:>22.3f}" for t in timings))
+
+    srv.should_exit = True
+    stub.close()
+
+
+if __name__ == "__main__":
+    main()
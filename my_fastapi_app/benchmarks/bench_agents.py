@@ -0,0 +1,53 @@
+"""
+Feature build: the three agents one after another vs the task graph.
+
+    python -m benchmarks.bench_agents [--scale 20]
+
+The docs/ CSVs are replicated `--scale` times with shifted user_ids into a
+temporary directory (benchmarks/synthetic_data.py), so each agent has enough
+work to time.
+"""
+import argparse
+import tempfile
+import time
+
+import server
+from benchmarks.synthetic_data import generate
+
+
+def sequential():
+    users_df, loc_df = server.load_shared_tables()
+    return {name: agent(users_df, loc_df) for name, agent in server.AGENTS.items()}
+
+
+def best_of(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server.DATA_DIR = generate(tmp, args.scale)
+        server.master_agent()  # warm the columnar cache
+
+        serial = best_of(sequential, args.repeat)
+        parallel = best_of(server.master_agent, args.repeat)
+        print(f"scale {args.scale}x ({len(server.master_agent())} users), {server.AGENT_WORKERS} workers")
+        for name, result in server.last_agent_run.items():
+            print(f"  {name:<32}{result.seconds * 1e3:8.1f} ms")
+        slowest = max(result.seconds for result in server.last_agent_run.values())
+        print(f"agents one after another: {serial * 1e3:8.1f} ms")
+        print(f"master_agent (task graph): {parallel * 1e3:7.1f} ms (slowest agent {slowest * 1e3:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Vectorized batch scoring vs the per-user rule-based scorer.
+
+    python -m benchmarks.bench_batch_scoring [--users 1000000]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.services.rule_scoring import score_batch
+from server import get_rule_based_credit_score
+
+
+def synthetic_features(n: int, seed: int = 0) -> pd.DataFrame:
+    """Random feature rows covering both sides of every rule threshold"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'user_id': np.arange(1, n + 1, dtype=np.int32),
+        'avg_salary': rng.uniform(0, 40000, n),
+        'gig_income_total': rng.uniform(0, 10000, n),
+        'monthly_utility_spend': rng.uniform(0, 5000, n),
+        'upi_total_spent': rng.uniform(0, 20000, n),
+        'location_stability': pd.Categorical(rng.choice(['high', 'medium', 'low'], n)),
+        'outstanding_amount': rng.uniform(0, 50000, n),
+        'on_time_repayments': rng.uniform(0, 4, n),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--sample", type=int, default=10_000, help="Users scored one by one for comparison")
+    args = parser.parse_args()
+
+    features = synthetic_features(args.users)
+    score_batch(features.head(1000))  # warm-up
+
+    start = time.perf_counter()
+    scores = score_batch(features)
+    batch = time.perf_counter() - start
+    print(f"batch:    {args.users} users in {batch * 1e3:.1f} ms ({batch / args.users * 1e9:.0f} ns/user)")
+
+    sample = features.head(args.sample).to_dict('records')
+    start = time.perf_counter()
+    single = [get_rule_based_credit_score(row) for row in sample]
+    per_user = (time.perf_counter() - start) / len(sample)
+    print(f"per-user: {per_user * 1e6:.1f} us/user -> {per_user * args.users:.1f} s projected for {args.users} users")
+
+    mismatches = sum(f"Credit Score: {s}/100" not in text for s, text in zip(scores.score, single))
+    print(f"score mismatches on the {len(sample)}-user sample: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
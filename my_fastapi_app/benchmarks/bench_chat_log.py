@@ -0,0 +1,73 @@
+"""
+Cost of recording one chat turn as the history grows: whole-file JSON
+rewrite (the old chat log) vs the append-only ChatStore.
+
+    python -m benchmarks.bench_chat_log [--sizes 1000 10000 100000 1000000]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from app.services.chat_store import ChatStore
+
+
+def turn(i: int) -> list:
+    now = time.time()
+    return [
+        {"role": "user", "content": f"what is user {i}'s credit score?", "timestamp": now, "processed": True},
+        {"role": "assistant", "content": "Credit Score: 68/100 " + "x" * 400, "timestamp": now, "processed": True},
+    ]
+
+
+def json_rewrite(path: str, messages: list):
+    with open(path, encoding="utf-8") as f:
+        chat_data = json.load(f)
+    chat_data.extend(messages)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(chat_data, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10_000, 100_000, 1_000_000],
+                        help="History sizes in turns")
+    parser.add_argument("--turns", type=int, default=50, help="Turns timed at each size")
+    parser.add_argument("--json-max", type=int, default=100_000, help="Largest history timed for the JSON log")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ChatStore(os.path.join(tmp, "chat.sqlite3"))
+        history = 0
+        for size in sorted(args.sizes):
+            batch = [m for i in range(history, size) for m in turn(i)]
+            for start in range(0, len(batch), 20_000):
+                store.append(batch[start:start + 20_000])
+            history = size
+
+            start = time.perf_counter()
+            for i in range(args.turns):
+                store.append(turn(size + i), session_id=f"s{i % 4}")
+            append = (time.perf_counter() - start) / args.turns
+            line = f"{size:>9} turns  store: {append * 1e3:7.3f} ms/turn"
+
+            if size <= args.json_max:
+                path = os.path.join(tmp, "chat.json")
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump([m for i in range(size) for m in turn(i)], f, indent=2)
+                timed = max(1, min(args.turns, 5))
+                start = time.perf_counter()
+                for i in range(timed):
+                    json_rewrite(path, turn(size + i))
+                rewrite = (time.perf_counter() - start) / timed
+                line += f"  json rewrite: {rewrite * 1e3:9.1f} ms/turn"
+            print(line)
+
+        start = time.perf_counter()
+        page, cursor = store.page("s1", limit=100)
+        print(f"page of {len(page)} from a {store.count()}-message log: {(time.perf_counter() - start) * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
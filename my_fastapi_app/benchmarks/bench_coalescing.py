@@ -0,0 +1,72 @@
+"""
+Request coalescing: model calls and latency of a burst of concurrent assessments.
+
+    python -m benchmarks.bench_coalescing [--requests 200] [--users 10] [--latency 0.2] [--parallel 4]
+
+`--requests` assessments (get_user_credit_assessment_async, what /process
+runs for "assess <name>") of `--users` distinct users arrive at once, each
+user about equally often. The stub model server takes `--latency` per
+call and runs at most `--parallel` calls at a time. The assessment cache
+starts empty for each run. Compared:
+
+    off  REQUEST_COALESCING=0: every request asks the model itself
+    on   requests for a user already being assessed wait for that call
+         (app/services/single_flight.py)
+
+With coalescing, model calls match the number of distinct users whatever
+the request count.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import numpy as np
+
+import server
+from app.services.llm_cache import AssessmentCache
+from benchmarks.load_test import use_stub
+from benchmarks.stub_ollama import StubOllama
+
+
+async def burst(users: list) -> list:
+    async def one(user):
+        start = time.perf_counter()
+        await server.get_user_credit_assessment_async(user['name'], user['user_id'])
+        return time.perf_counter() - start
+
+    return await asyncio.gather(*(one(user) for user in users))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--users", type=int, default=10, help="Distinct users among the requests")
+    parser.add_argument("--latency", type=float, default=0.2, help="Stub seconds per model call")
+    parser.add_argument("--parallel", type=int, default=4, help="Stub model calls at once")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    stub = StubOllama(models=[server.OLLAMA_MODEL], latency=args.latency, parallel=args.parallel)
+    use_stub(stub)
+    users = server.feature_store.get().head(args.users).to_dict('records')
+    rng = random.Random(args.seed)
+    requests = [rng.choice(users) for _ in range(args.requests)]
+
+    print(f"{len(requests)} requests for {len(set(user['user_id'] for user in requests))} users, "
+          f"stub {args.latency * 1e3:.0f} ms/call, {args.parallel} parallel")
+    print(f"{'coalescing':<12}{'model calls':>12}{'seconds':>9}{'p50 ms':>8}{'p95 ms':>8}")
+    for enabled in (False, True):
+        server.assessment_cache = AssessmentCache()
+        server.assessment_flights.enabled = server.llm_flights.enabled = enabled
+        calls = stub.chat_calls()
+        start = time.perf_counter()
+        latencies = asyncio.run(burst(requests))
+        elapsed = time.perf_counter() - start
+        p50, p95 = np.percentile(latencies, [50, 95]) * 1e3
+        print(f"{'on' if enabled else 'off':<12}{stub.chat_calls() - calls:>12}{elapsed:>9.2f}{p50:>8.0f}{p95:>8.0f}")
+    stub.close()
+
+
+if __name__ == "__main__":
+    main()
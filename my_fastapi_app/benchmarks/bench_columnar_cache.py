@@ -0,0 +1,54 @@
+"""
+Cold vs warm load times for the docs/ CSV sources.
+
+    python -m benchmarks.bench_columnar_cache [--repeat N]
+
+"csv" is the old path (pd.read_csv + parse_timestamp), "cold" is the first
+load_csv() call (parse + convert + write the cache) and "warm" is a later
+load_csv() call that memory-maps the cached columns.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from app.utils.columnar_cache import load_csv
+from server import DATA_DIR, parse_timestamp
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    files = sorted(f for f in os.listdir(DATA_DIR) if f.endswith(".csv"))
+    print(f"{'file':<30}{'rows':>8}{'csv ms':>10}{'cold ms':>10}{'warm ms':>10}{'speedup':>9}")
+    totals = [0.0, 0.0, 0.0]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for name in files:
+            path = os.path.join(DATA_DIR, name)
+            csv = best_of(lambda: parse_timestamp(pd.read_csv(path)), args.repeat)
+            start = time.perf_counter()
+            rows = len(load_csv(path, cache_dir=cache_dir))
+            cold = time.perf_counter() - start
+            warm = best_of(lambda: parse_timestamp(load_csv(path, cache_dir=cache_dir)), args.repeat)
+            for i, t in enumerate((csv, cold, warm)):
+                totals[i] += t
+            print(f"{name:<30}{rows:>8}{csv * 1e3:>10.2f}{cold * 1e3:>10.2f}{warm * 1e3:>10.2f}{csv / warm:>8.1f}x")
+    print(f"{'total':<38}{totals[0] * 1e3:>10.2f}{totals[1] * 1e3:>10.2f}{totals[2] * 1e3:>10.2f}"
+          f"{totals[0] / totals[2]:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
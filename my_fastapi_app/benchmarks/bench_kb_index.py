@@ -0,0 +1,150 @@
+"""
+Knowledge-base retrieval latency: index reloaded per query vs kept resident.
+
+    python -m benchmarks.bench_kb_index [--sizes 10000 100000 1000000] [--dim 384] [--threads 4]
+
+Needs faiss (pip install faiss-cpu). For each size a flat inner-product
+index of random unit vectors and a pickled {id: chunk text} docstore are
+written as one version of a knowledge base (the layout of
+app/services/vector_index.py). Compared, per query of k=3:
+
+    reload     read index.faiss + index.pkl, then search (what getRelevantChunks did)
+    resident   IndexManager.get + search on the index loaded once
+    mmap       the same, with the index opened with IO_FLAG_MMAP
+
+The last column is resident throughput with `--threads` searching while
+the main thread publishes a new version every 100 ms; "errors" counts
+searches that failed or got no store during the swaps.
+"""
+import argparse
+import os
+import pickle
+import statistics
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from app.services.vector_index import IndexManager, current_version, new_version_dir, publish_version
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+K = 3
+
+
+def write_version(kb_dir: str, vectors: np.ndarray) -> str:
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    path = new_version_dir(kb_dir)
+    faiss.write_index(index, os.path.join(path, "index.faiss"))
+    with open(os.path.join(path, "index.pkl"), "wb") as f:
+        pickle.dump(({i: f"chunk {i} " * 40 for i in range(len(vectors))}, list(range(len(vectors)))), f)
+    return path
+
+
+def loader(mmap: bool):
+    def load(path: str):
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        index = faiss.read_index(os.path.join(path, "index.faiss"), flags)
+        with open(os.path.join(path, "index.pkl"), "rb") as f:
+            docstore, ids = pickle.load(f)
+        return index, docstore, ids
+    return load
+
+
+def search(store, query: np.ndarray):
+    index, docstore, ids = store
+    _, rows = index.search(query, K)
+    return [docstore[ids[row]] for row in rows[0] if row >= 0]
+
+
+def per_query_ms(func, queries) -> float:
+    start = time.perf_counter()
+    for query in queries:
+        func(query)
+    return (time.perf_counter() - start) / len(queries) * 1e3
+
+
+def swap_throughput(manager: IndexManager, kb: str, queries, threads: int, seconds: float = 2.0):
+    stop = threading.Event()
+    counts, errors, latencies = [0] * threads, [0] * threads, []
+
+    def reader(i):
+        j = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                store = manager.get(kb)
+                if store is None or not search(store, queries[j % len(queries)]):
+                    errors[i] += 1
+            except Exception:
+                errors[i] += 1
+            latencies.append(time.perf_counter() - start)
+            counts[i] += 1
+            j += 1
+
+    workers = [threading.Thread(target=reader, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    end = time.perf_counter() + seconds
+    swaps = 0
+    kb_dir = manager.kb_dir(kb)
+    live = os.path.join(kb_dir, current_version(kb_dir))
+    while time.perf_counter() < end:
+        time.sleep(0.1)
+        # A "new" version: a hard-linked copy of the live files, published like processAndStoreFiles does
+        path = new_version_dir(kb_dir)
+        for name in ("index.faiss", "index.pkl"):
+            os.link(os.path.join(live, name), os.path.join(path, name))
+        publish_version(kb_dir, path)
+        live = path
+        swaps += 1
+    stop.set()
+    for worker in workers:
+        worker.join()
+    p99 = statistics.quantiles(latencies, n=100)[98] * 1e3 if len(latencies) >= 100 else float("nan")
+    return sum(counts) / seconds, sum(errors), swaps, p99
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--reload-queries", type=int, default=5, help="Queries timed with a reload each")
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+    if faiss is None:
+        raise SystemExit("faiss is not installed (pip install faiss-cpu)")
+
+    rng = np.random.default_rng(0)
+    queries = [q[None, :] for q in rng.standard_normal((args.queries, args.dim)).astype('float32')]
+    print(f"dim {args.dim}, k={K}, {os.cpu_count()} CPU(s), {args.threads} threads during swaps")
+    print(f"{'chunks':>9}{'load':>10}{'reload':>12}{'resident':>10}{'mmap':>10}{'qps (swaps)':>16}{'p99':>9}  errors")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as root:
+            vectors = rng.standard_normal((size, args.dim)).astype('float32')
+            faiss.normalize_L2(vectors)
+            version = write_version(os.path.join(root, "kb"), vectors)
+            publish_version(os.path.join(root, "kb"), version)
+            del vectors
+
+            start = time.perf_counter()
+            manager = IndexManager(root, loader(mmap=False), check_interval=0.05)
+            manager.get("kb")
+            load_ms = (time.perf_counter() - start) * 1e3
+            reload_ms = per_query_ms(lambda q: search(loader(False)(version), q), queries[:args.reload_queries])
+            resident_ms = per_query_ms(lambda q: search(manager.get("kb"), q), queries)
+            mapped = IndexManager(root, loader(mmap=True))
+            mmap_ms = per_query_ms(lambda q: search(mapped.get("kb"), q), queries)
+            qps, errors, swaps, p99 = swap_throughput(manager, "kb", queries, args.threads)
+            print(f"{size:>9}{load_ms:>8.0f}ms{reload_ms:>10.2f}ms{resident_ms:>8.2f}ms{mmap_ms:>8.2f}ms"
+                  f"{qps:>10.0f} ({swaps:>2}){p99:>7.2f}ms  {errors}")
+
+
+if __name__ == "__main__":
+    main()
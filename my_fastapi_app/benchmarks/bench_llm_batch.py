@@ -0,0 +1,74 @@
+"""
+LLM portfolio scoring throughput (users/minute) against a stub model server.
+
+    python -m benchmarks.bench_llm_batch [--users 64] [--latency 0.2] [--word-latency 0.004] [--parallel 4]
+
+The stub charges `--latency` per request (queueing, prompt evaluation) plus
+`--word-latency` per generated word, and runs at most `--parallel`
+generations at once. A single-user prompt is answered with a free-text
+assessment of typical length; packed prompts get one short JSON entry per
+user. Compared paths:
+
+    sequential  get_credit_score_from_llm one user after another (previous behaviour)
+    concurrent  score_users_with_llm(mode="concurrent"), --concurrency calls in flight
+    packed      score_users_with_llm(mode="packed"), --batch-size users per prompt
+
+The assessment cache is emptied before every run.
+"""
+import argparse
+import asyncio
+import time
+
+import server
+from app.services.llm_cache import AssessmentCache
+from benchmarks.load_test import use_stub
+from benchmarks.stub_ollama import StubOllama, assessment_reply
+
+# Roughly the length of a free-text "score, key factors, reasoning" answer
+FREE_TEXT_REPLY = "Credit Score: 72/100. " + " ".join(["The user shows steady utility payments and income."] * 15)
+
+
+def reply(body: dict) -> str:
+    if "--- user " in body["messages"][-1]["content"]:
+        return assessment_reply(body)
+    return FREE_TEXT_REPLY
+
+
+def run(name: str, users: list, args) -> float:
+    server.assessment_cache = AssessmentCache()
+    start = time.perf_counter()
+    if name == 'sequential':
+        for user in users:
+            server.get_credit_score_from_llm(user)
+    else:
+        asyncio.run(server.score_users_with_llm(users, name, args.batch_size, args.concurrency))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.2, help="Stub seconds per request")
+    parser.add_argument("--word-latency", type=float, default=0.004, help="Stub seconds per generated word")
+    parser.add_argument("--parallel", type=int, default=4, help="Stub generations at once")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=8)
+    args = parser.parse_args()
+
+    stub = StubOllama(models=[server.OLLAMA_MODEL], latency=args.latency, reply=reply,
+                      word_latency=args.word_latency, parallel=args.parallel)
+    use_stub(stub)
+    users = server.feature_store.get().head(args.users).to_dict('records')
+
+    print(f"{len(users)} users, stub {args.latency * 1e3:.0f} ms/request + {args.word_latency * 1e3:.1f} ms/word, "
+          f"{args.parallel} parallel")
+    print(f"{'mode':<12}{'seconds':>9}{'users/min':>11}{'model calls':>13}")
+    for name in ('sequential', 'concurrent', 'packed'):
+        calls = stub.chat_calls()
+        elapsed = run(name, users, args)
+        print(f"{name:<12}{elapsed:>9.2f}{len(users) / elapsed * 60:>11.0f}{stub.chat_calls() - calls:>13}")
+    stub.close()
+
+
+if __name__ == "__main__":
+    main()
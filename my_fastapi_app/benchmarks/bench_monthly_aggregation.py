@@ -0,0 +1,89 @@
+"""
+Monthly spend features: per-month merge fan-out (the previous agent joins)
+vs the one-row-per-user aggregation engine.
+
+    python -m benchmarks.bench_monthly_aggregation [--users 200000] [--months 24]
+
+The fan-out path merges per-(user, month) totals onto the users table and
+then onto the other per-user frames, and collapses the result with
+groupby('user_id').mean() as master_agent() did. Peak memory is measured
+with tracemalloc around each path.
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from app.services.aggregation import MonthlySpec, user_monthly_stats
+
+SPEC = MonthlySpec('amount', {'monthly_spend': 'mean', 'spend_std': 'std', 'spend_trend': 'trend',
+                              'regularity': 'regularity'})
+
+
+def synthetic_events(users: int, months: int, per_month: int, seed: int = 0) -> pd.DataFrame:
+    """Random events grouped by user_id, like the docs/ event files"""
+    rng = np.random.default_rng(seed)
+    n = users * months * per_month // 2
+    start = np.datetime64('2023-01-01')
+    return pd.DataFrame({
+        'user_id': np.sort(rng.integers(1, users + 1, n)).astype(np.int32),
+        'timestamp': pd.to_datetime(start + rng.integers(0, months * 30, n).astype('timedelta64[D]')),
+        'amount': rng.uniform(100, 3000, n).astype(np.float32),
+    })
+
+
+def other_features(users: int, columns: int = 12) -> pd.DataFrame:
+    """Stand-in for the other per-user aggregates joined alongside the monthly spend"""
+    rng = np.random.default_rng(1)
+    frame = pd.DataFrame(rng.uniform(0, 1000, (users, columns)), columns=[f"f{i}" for i in range(columns)])
+    frame.insert(0, 'user_id', np.arange(1, users + 1, dtype=np.int32))
+    return frame
+
+
+def fan_out(users_df, others, events):
+    events = events.assign(month=events['timestamp'].dt.to_period('M'))
+    monthly = events.groupby(['user_id', 'month'])['amount'].sum().reset_index(name='monthly_spend')
+    joined = users_df.merge(monthly, on='user_id', how='left').merge(others, on='user_id', how='left').fillna(0)
+    return joined.groupby('user_id').mean(numeric_only=True).reset_index()
+
+
+def engine(users_df, others, events):
+    stats = user_monthly_stats(events, SPEC).reset_index()
+    return users_df.merge(stats, on='user_id', how='left').merge(others, on='user_id', how='left').fillna(0)
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--per-month", type=int, default=3, help="Events per user per month (x2 average)")
+    args = parser.parse_args()
+
+    events = synthetic_events(args.users, args.months, args.per_month)
+    users_df = pd.DataFrame({'user_id': np.arange(1, args.users + 1, dtype=np.int32)})
+    others = other_features(args.users)
+    print(f"{args.users} users, {args.months} months, {len(events)} events")
+
+    old, old_time, old_peak = measure(fan_out, users_df, others, events)
+    new, new_time, new_peak = measure(engine, users_df, others, events)
+    print(f"fan-out: {old_time:6.2f} s, peak {old_peak / 2**20:8.1f} MiB")
+    print(f"engine:  {new_time:6.2f} s, peak {new_peak / 2**20:8.1f} MiB")
+
+    diff = np.abs(old.set_index('user_id')['monthly_spend'] - new.set_index('user_id')['monthly_spend']).max()
+    print(f"max |monthly_spend| difference: {diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Sharded batch scoring: wall time by worker count, and identical output.
+
+    python -m benchmarks.bench_sharded_scoring [--scale 20] [--workers 1 2 4 8] [--shard-by hash]
+
+Generates docs/ at `--scale` (benchmarks/synthetic_data.py), warms the
+columnar cache once, then runs batch_score.run_sharded with each worker
+count and hashes the CSV it would write. Speedup can only approach the
+worker count on a machine with at least that many cores (os.cpu_count()
+is printed), so the same shards are also run one after another in this
+process: the slowest one is the wall time with a core per worker (before
+fork and merge), and "projected" is the speedup that implies.
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+import batch_score
+from app.services.sharding import SHARD_MODES
+from benchmarks.synthetic_data import generate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", type=int, default=20)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--shard-by", choices=SHARD_MODES, default='hash')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        generate(tmp, args.scale)
+        batch_score.warm_sources(tmp)
+        print(f"scale {args.scale}x, {os.cpu_count()} CPU(s), shard by {args.shard_by}")
+        print(f"{'workers':>8}{'users':>9}{'seconds':>9}{'speedup':>9}{'slowest shard':>15}{'projected':>11}"
+              f"  output sha1")
+        baseline = None
+        for workers in args.workers:
+            start = time.perf_counter()
+            frame = batch_score.run_sharded(tmp, workers, shard_by=args.shard_by)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            digest = hashlib.sha1(frame.to_csv(index=False).encode()).hexdigest()[:12]
+            batch_score.run_sharded(tmp, 1, shards=workers, shard_by=args.shard_by)
+            slowest = max(result.seconds for result in batch_score.last_shard_run.values())
+            print(f"{workers:>8}{len(frame):>9}{elapsed:>9.2f}{baseline / elapsed:>8.2f}x{slowest:>15.2f}"
+                  f"{baseline / slowest:>10.2f}x  {digest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Server import and startup time, in fresh processes.
+
+    python -m benchmarks.bench_startup [--runs 5] [--latency 1.0] [--load-latency 2.0]
+
+Each run starts a new interpreter that imports server.py and enters the
+app's lifespan (the startup handlers), against a StubOllama taking
+`--latency` per generation and `--load-latency` to load the model. It
+reports the median time from the start of the import until:
+
+    import      `import server` returned
+    accepting   the startup handlers returned, so requests are served (/health/live)
+    ready       /health/ready answered 200 (feature table built)
+    model warm  /health/model answered 200 (model loaded)
+
+The assessment cache is kept in memory so that every run starts cold.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmarks.stub_ollama import StubOllama
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import server
+imported = time.perf_counter()
+lazy = 'ollama' not in sys.modules
+from fastapi.testclient import TestClient
+
+def wait_for(client, path):
+    deadline = time.perf_counter() + 60
+    while client.get(path).status_code != 200 and time.perf_counter() < deadline:
+        time.sleep(0.002)
+    return time.perf_counter() - start
+
+with TestClient(server.app) as client:
+    accepting = time.perf_counter() - start
+    ready = wait_for(client, "/health/ready")
+    model = wait_for(client, "/health/model")
+print(json.dumps({'import': imported - start, 'accepting': accepting, 'ready': ready, 'model warm': model,
+                  'lazy': lazy}))
+"""
+
+
+def run_once(host: str) -> dict:
+    env = {**os.environ, "OLLAMA_HOST": host, "LLM_CACHE_PATH": "", "PYTHONPATH": APP_DIR}
+    out = subprocess.run([sys.executable, "-c", CHILD], cwd=APP_DIR, env=env, capture_output=True, text=True,
+                         check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=1.0, help="Stub seconds per generation")
+    parser.add_argument("--load-latency", type=float, default=2.0, help="Stub seconds to load the model")
+    args = parser.parse_args()
+
+    stub = StubOllama(latency=args.latency, load_latency=args.load_latency)
+    runs = [run_once(stub.host) for _ in range(args.runs)]
+    stub.close()
+    print(f"{args.runs} runs, stub {args.latency * 1e3:.0f} ms/generation, {args.load_latency * 1e3:.0f} ms model load, "
+          f"ollama imported lazily: {all(run['lazy'] for run in runs)}")
+    for key in ('import', 'accepting', 'ready', 'model warm'):
+        print(f"{key:<12}{statistics.median(run[key] for run in runs) * 1e3:>8.0f} ms")
+    print(f"{'chat calls':<12}{stub.chat_calls() / args.runs:>8.1f} per startup")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Feature table build: whole-file reads vs chunked reads under a memory budget.
+
+    python -m benchmarks.bench_streaming [--scale 20 50] [--budget-mb 16]
+
+Generates docs/ at each `--scale` (benchmarks/synthetic_data.py) and builds
+the feature table with a FeatureStore that loads every CSV whole, then
+with one that streams them in chunks sized to `--budget-mb`. Peak memory
+is measured with tracemalloc above what was allocated before the build;
+"kept" is what the finished store holds (feature table, per-user records,
+node state), which is O(users) either way. The two tables are compared
+value by value.
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import server
+from app.services.feature_store import FeatureStore
+from benchmarks.synthetic_data import generate
+
+
+def build(data_dir: str, memory_budget: int = None):
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    store = FeatureStore(server.FEATURE_NODES, server.assemble_feature_table, data_dir,
+                         loader=pd.read_csv, prepare=server.prepare_source, memory_budget=memory_budget)
+    table = store.refresh()
+    elapsed = time.perf_counter() - start
+    kept, peak = (used - base for used in tracemalloc.get_traced_memory())
+    tracemalloc.stop()
+    return table, elapsed, peak, kept
+
+
+def max_difference(a: pd.DataFrame, b: pd.DataFrame) -> float:
+    numeric = a.select_dtypes('number').columns
+    text = a.columns.difference(numeric)
+    if not (a[text].astype(str) == b[text].astype(str)).all().all():
+        return float('inf')
+    return float(np.nanmax(np.abs(a[numeric].to_numpy(float) - b[numeric].to_numpy(float))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", type=int, nargs="+", default=[20, 50])
+    parser.add_argument("--budget-mb", type=int, default=16)
+    args = parser.parse_args()
+
+    print(f"{'scale':>6}{'CSV MiB':>9}{'users':>9}{'kept MiB':>10}{'whole s':>9}{'peak MiB':>10}"
+          f"{'stream s':>10}{'peak MiB':>10}{'max diff':>10}")
+    for scale in args.scale:
+        with tempfile.TemporaryDirectory() as tmp:
+            generate(tmp, scale)
+            size = sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp))
+            whole, whole_time, whole_peak, _ = build(tmp)
+            streamed, stream_time, stream_peak, kept = build(tmp, args.budget_mb * 2**20)
+            print(f"{scale:>5}x{size / 2**20:>9.0f}{len(whole):>9}{kept / 2**20:>10.1f}"
+                  f"{whole_time:>9.2f}{whole_peak / 2**20:>10.1f}"
+                  f"{stream_time:>10.2f}{stream_peak / 2**20:>10.1f}{max_difference(whole, streamed):>10.1e}")
+
+
+if __name__ == "__main__":
+    main()
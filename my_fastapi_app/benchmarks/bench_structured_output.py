@@ -0,0 +1,69 @@
+"""
+Free-text vs structured (JSON / JSON-schema) credit assessments.
+
+    python -m benchmarks.bench_structured_output [--users 20] [--latency 0.1] [--word-latency 0.02]
+
+get_credit_score_from_llm is called for `--users` users, one after another,
+with LLM_OUTPUT_FORMAT set to each mode, against a stub model server that
+charges `--latency` per request plus `--word-latency` per generated word
+(--word-latency 0.02 is ~50 tokens/s). Free-text requests are answered
+with an assessment of typical length. Structured requests get a JSON
+object, cut at LLM_STRUCTURED_MAX_TOKENS like a real num_predict cap. The
+table shows generated words and latency per assessment, and how many
+answers parsed into a numeric score.
+"""
+import argparse
+import json
+import time
+
+import server
+from app.services.llm_batch import OUTPUT_FORMATS
+from app.services.llm_cache import AssessmentCache
+from benchmarks.bench_llm_batch import FREE_TEXT_REPLY
+from benchmarks.load_test import use_stub
+from benchmarks.stub_ollama import StubOllama
+
+# A typical complete structured answer
+STRUCTURED_REPLY = json.dumps({
+    "score": 72,
+    "factors": ["Regular utility payments", "High salary income", "Moderate outstanding debt"],
+    "reasoning": "Steady income and on-time bills outweigh the moderate debt. Digital activity is consistent.",
+})
+
+
+def reply(body: dict) -> str:
+    return STRUCTURED_REPLY if body.get("format") else FREE_TEXT_REPLY
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.1, help="Stub seconds per request")
+    parser.add_argument("--word-latency", type=float, default=0.02, help="Stub seconds per generated word")
+    args = parser.parse_args()
+
+    stub = StubOllama(models=[server.OLLAMA_MODEL], latency=args.latency, reply=reply, word_latency=args.word_latency)
+    use_stub(stub)
+    users = server.feature_store.get().head(args.users).to_dict('records')
+
+    print(f"{len(users)} users, stub {args.latency * 1e3:.0f} ms/request + {args.word_latency * 1e3:.0f} ms/word")
+    print(f"{'format':<8}{'words/assessment':>18}{'ms/assessment':>15}{'numeric scores':>16}")
+    for output_format in OUTPUT_FORMATS:
+        server.LLM_OUTPUT_FORMAT = output_format
+        server.assessment_cache = AssessmentCache()
+        words = stub.generated_words
+        start = time.perf_counter()
+        for user in users:
+            server.get_credit_score_from_llm(user)
+        elapsed = time.perf_counter() - start
+        # Structured answers are cached as validated JSON; free text never yields a usable score
+        numeric = 0 if output_format == 'text' else sum(
+            server.assessment_cache.get(server.structured_cache_key(user, server.OLLAMA_MODEL, output_format))
+            is not None for user in users)
+        print(f"{output_format:<8}{(stub.generated_words - words) / len(users):>18.0f}"
+              f"{elapsed / len(users) * 1e3:>15.0f}{numeric:>11}/{len(users)}")
+    stub.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+/kb/add-files: memory and event-loop stalls while a large file uploads.
+
+    python -m benchmarks.bench_upload [--sizes 64 512] [--chunk-kb 64]
+
+A file of each size (MiB) is posted as a multipart body in `--chunk-kb`
+chunks, through httpx's ASGI transport. Meanwhile a second client pings
+a trivial endpoint on the same event loop every 10 ms. Compared:
+
+    legacy     the old handler: UploadFile, `await file.read()`, blocking write
+    streaming  app.api.routes.knowledgebase.upload_files (app/utils/uploads.py)
+
+Peak memory is the tracemalloc peak of Python allocations during the
+upload. "ping max" is the slowest ping; a handler that blocks the loop
+shows up there. Each mode runs in a fresh subprocess.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import asyncio, json, os, sys, time, tracemalloc
+from typing import List
+import httpx
+from fastapi import FastAPI, File, Form, UploadFile
+from app.api.routes import knowledgebase
+
+mode, size, chunk, upload_dir = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), sys.argv[4]
+app = FastAPI()
+
+@app.get("/ping")
+async def ping():
+    return {}
+
+if mode == "legacy":
+    @app.post("/kb/add-files")
+    async def upload_files(files: List[UploadFile] = File(...), kb_name: str = Form(default="default_kb")):
+        for file in files:
+            with open(os.path.join(upload_dir, file.filename), "wb") as f:
+                content = await file.read()
+                f.write(content)
+        return {"files": [file.filename for file in files]}
+else:
+    knowledgebase.KB_UPLOAD_DIR = upload_dir
+    knowledgebase.process_uploads = lambda files, kb_name: None
+    app.include_router(knowledgebase.router, prefix="/kb")
+
+async def body():
+    yield b'--b\\r\\nContent-Disposition: form-data; name="files"; filename="export.csv"\\r\\n\\r\\n'
+    block = os.urandom(chunk)
+    for _ in range(size // chunk):
+        yield block
+    yield b"\\r\\n--b--\\r\\n"
+
+async def main():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        done, pings = False, []
+
+        async def pinger():
+            while not done:
+                start = time.perf_counter()
+                await client.get("/ping")
+                pings.append(time.perf_counter() - start)
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(pinger())
+        tracemalloc.start()
+        start = time.perf_counter()
+        response = await client.post("/kb/add-files", content=body(),
+                                     headers={"Content-Type": "multipart/form-data; boundary=b"})
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        done = True
+        await task
+    assert response.status_code == 200, response.text
+    assert os.path.getsize(os.path.join(upload_dir, "export.csv")) == size // chunk * chunk
+    print(json.dumps({"seconds": seconds, "peak": peak, "ping_max": max(pings), "pings": len(pings)}))
+
+asyncio.run(main())
+"""
+
+
+def run_once(mode: str, size: int, chunk: int) -> dict:
+    with tempfile.TemporaryDirectory() as upload_dir:
+        out = subprocess.run([sys.executable, "-c", CHILD, mode, str(size), str(chunk), upload_dir], cwd=APP_DIR,
+                             env={**os.environ, "PYTHONPATH": APP_DIR}, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 512], help="File sizes in MiB")
+    parser.add_argument("--chunk-kb", type=int, default=64)
+    args = parser.parse_args()
+
+    chunk = args.chunk_kb * 1024
+    print(f"{'MiB':>6}  {'mode':<10}{'seconds':>9}{'MiB/s':>8}{'peak memory':>14}{'ping max':>11}")
+    for size_mb in args.sizes:
+        for mode in ("legacy", "streaming"):
+            result = run_once(mode, size_mb * 1024 * 1024, chunk)
+            print(f"{size_mb:>6}  {mode:<10}{result['seconds']:>8.2f}s{size_mb / result['seconds']:>8.0f}"
+                  f"{result['peak'] / 2 ** 20:>10.1f} MiB{result['ping_max'] * 1e3:>8.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+User lookup: token-trie index vs the iterrows name scan.
+
+    python -m benchmarks.bench_user_lookup [--users 100000]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.services.user_index import UserIndex
+
+FIRST = ["james", "mary", "robert", "patricia", "john", "jennifer", "michael", "linda", "david", "elizabeth",
+         "william", "barbara", "richard", "susan", "joseph", "jessica", "thomas", "sarah", "priya", "arjun"]
+LAST = ["smith", "johnson", "williams", "brown", "jones", "garcia", "miller", "davis", "rodriguez", "martinez",
+        "sharma", "patel", "nguyen", "kim", "lee", "walker", "hall", "allen", "young", "king"]
+
+
+def synthetic_users(n: int, seed: int = 0) -> pd.DataFrame:
+    """n users with mostly distinct "First Last Suffix" names"""
+    rng = np.random.default_rng(seed)
+    first = rng.choice(FIRST, n)
+    last = rng.choice(LAST, n)
+    suffix = rng.integers(0, max(n // 10, 1), n)
+    names = [f"{f.title()} {l.title()}{s:x}" for f, l, s in zip(first, last, suffix)]
+    return pd.DataFrame({'user_id': np.arange(1, n + 1, dtype=np.int32), 'name': names})
+
+
+def scan(users: pd.DataFrame, query_lower: str):
+    for _, row in users.iterrows():
+        if pd.notna(row['name']) and row['name'].lower() in query_lower:
+            return row['name']
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=10_000)
+    parser.add_argument("--scans", type=int, default=3, help="Queries answered with the iterrows scan")
+    args = parser.parse_args()
+
+    users = synthetic_users(args.users)
+    rng = np.random.default_rng(1)
+    picks = users['name'].to_numpy()[rng.integers(0, args.users, args.queries)]
+    queries = [f"what is the credit score for {name.lower()}?" for name in picks]
+
+    start = time.perf_counter()
+    index = UserIndex(users)
+    build = time.perf_counter() - start
+    print(f"index build: {args.users} users in {build * 1e3:.0f} ms")
+
+    start = time.perf_counter()
+    found = [index.find_mentions(q) for q in queries]
+    lookup = (time.perf_counter() - start) / len(queries)
+    print(f"index:       {lookup * 1e6:.1f} us/query")
+
+    start = time.perf_counter()
+    for q in queries[:args.scans]:
+        scan(users, q)
+    scanned = (time.perf_counter() - start) / args.scans
+    print(f"iterrows:    {scanned * 1e3:.0f} ms/query ({scanned / lookup:.0f}x slower)")
+
+    misses = sum(not any(name == picked for _, name in hits) for hits, picked in zip(found, picks))
+    print(f"queries whose user was not found: {misses}")
+
+
+if __name__ == "__main__":
+    main()
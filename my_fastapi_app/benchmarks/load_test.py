@@ -0,0 +1,92 @@
+"""
+Throughput of /process under concurrent clients, against a stub Ollama.
+
+    python -m benchmarks.load_test [--latency 0.25] [--concurrency 1 2 4 8 16 32]
+
+Runs server.py's app in-process with uvicorn and the model replaced by
+`StubOllama` (fixed latency per generation), then fires credit-assessment
+queries from N concurrent clients. "/process" is the async pipeline; the
+"blocking" column is the previous behaviour (process_user_query called on
+the event loop), registered here only for comparison.
+"""
+import argparse
+import asyncio
+import socket
+import threading
+import time
+
+import httpx
+import ollama
+import uvicorn
+
+import server
+from app.services.llm_health import CircuitBreaker, OllamaHealthMonitor
+from benchmarks.stub_ollama import StubOllama
+
+
+@server.app.post("/process-blocking")
+async def process_blocking(request: server.QueryRequest):
+    return {"result": server.process_user_query(request.query)}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def use_stub(stub: StubOllama):
+    server.OLLAMA_HOST = stub.host
+    server.ollama_client = ollama.Client(host=stub.host)
+    server.ollama_health = OllamaHealthMonitor(ollama.Client(host=stub.host, timeout=2), CircuitBreaker())
+    server._async_llm = None
+
+
+def start_server(port: int) -> uvicorn.Server:
+    config = uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning")
+    srv = uvicorn.Server(config)
+    threading.Thread(target=srv.run, daemon=True).start()
+    while not srv.started:
+        time.sleep(0.05)
+    return srv
+
+
+async def run_clients(url: str, query: str, clients: int, requests_per_client: int) -> float:
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(timeout=300, limits=limits) as client:
+        async def worker():
+            for _ in range(requests_per_client):
+                response = await client.post(url, json={"query": query})
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        return clients * requests_per_client / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.25, help="Stub model latency per generation (s)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--requests", type=int, default=4, help="Requests per client")
+    args = parser.parse_args()
+
+    stub = StubOllama(models=[server.OLLAMA_MODEL], latency=args.latency)
+    use_stub(stub)
+    port = free_port()
+    srv = start_server(port)
+    query = f"What is the credit score for {server.feature_store.get()['name'].iloc[0]}?"
+
+    print(f"stub latency {args.latency * 1e3:.0f} ms, LLM concurrency limit {server.LLM_MAX_CONCURRENCY}")
+    print(f"{'clients':>8}{'async req/s':>14}{'blocking req/s':>16}")
+    for clients in args.concurrency:
+        rates = [asyncio.run(run_clients(f"http://127.0.0.1:{port}{path}", query, clients, args.requests))
+                 for path in ("/process", "/process-blocking")]
+        print(f"{clients:>8}{rates[0]:>14.1f}{rates[1]:>16.1f}")
+
+    srv.should_exit = True
+    stub.close()
+
+
+if __name__ == "__main__":
+    main()
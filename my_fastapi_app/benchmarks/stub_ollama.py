@@ -0,0 +1,143 @@
+"""
+Minimal stand-in for the Ollama HTTP API, for tests and load tests.
+
+Serves /api/tags (model list) and /api/chat with a canned reply after an
+optional artificial latency, and records every request path it receives.
+Streaming chat requests get the reply word by word as chunked NDJSON, with
+the latency spread across the chunks.
+
+`reply` may also be a function of the request body (e.g. to answer a
+packed multi-user prompt), `word_latency` adds generation time per word of
+the reply, `parallel` caps how many generations run at once (like
+OLLAMA_NUM_PARALLEL) and the next `fail_next` chat requests are answered
+with 500. A chat without messages only "loads the model", taking
+`load_latency`. A request's `num_predict` option cuts the reply to that many
+words, standing in for tokens, and the final response reports the words
+as `eval_count` and their generation time as `eval_duration`, like Ollama.
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_REPLY = "Credit Score: 77/100 (stub)"
+STUB_SCORE = 77
+
+
+def assessment_reply(body: dict) -> str:
+    """
+    Reply for `reply=`: packed prompts ("--- user N ---" sections) get one
+    JSON assessment per user, other requests for structured output (format=)
+    a single JSON assessment, and everything else STUB_REPLY.
+    """
+    assessment = {"score": STUB_SCORE, "factors": ["Stub factor"], "reasoning": "Stub reasoning."}
+    user_ids = re.findall(r"--- user (\d+) ---", body["messages"][-1]["content"])
+    if user_ids:
+        return json.dumps({"assessments": [{"user_id": int(user_id), **assessment} for user_id in user_ids]})
+    return json.dumps(assessment) if body.get("format") else STUB_REPLY
+
+
+class StubOllama:
+    def __init__(self, models=("gemma3:4b",), latency: float = 0.0, reply=STUB_REPLY, word_latency: float = 0.0,
+                 parallel: int = None, load_latency: float = 0.0):
+        self.models = list(models)
+        self.latency = latency
+        self.load_latency = load_latency
+        self.reply = reply
+        self.word_latency = word_latency
+        self.chat_status = 200
+        self.fail_next = 0
+        self.generated_words = 0
+        self.last_chat = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(parallel) if parallel else None
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; with Nagle on, the body waits for a delayed ACK (~40 ms)
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                stub.requests.append(self.path)
+                self._reply(200, {"models": [{"model": name, "name": name} for name in stub.models]})
+
+            def _stream(self, text):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                words = text.split(" ")
+                for i, word in enumerate(words):
+                    time.sleep(stub.latency / len(words) + stub.word_latency)
+                    content = word if i == len(words) - 1 else word + " "
+                    self._chunk({"model": stub.models[0], "done": False,
+                                 "message": {"role": "assistant", "content": content}})
+                self._chunk({"model": stub.models[0], "done": True, "message": {"role": "assistant", "content": ""},
+                             **stub._eval_stats(text)})
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _chunk(self, payload):
+                line = json.dumps(payload).encode() + b"\n"
+                self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                self.wfile.flush()
+
+            def do_POST(self):
+                stub.requests.append(self.path)
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.last_chat = body
+                with stub._lock:
+                    failing = stub.fail_next > 0
+                    stub.fail_next -= failing
+                if failing or stub.chat_status != 200:
+                    return self._reply(500 if failing else stub.chat_status, {"error": "model crashed"})
+                if not body.get("messages"):
+                    # Ollama only loads the model for a chat without messages
+                    time.sleep(stub.load_latency)
+                    return self._reply(200, {"model": stub.models[0], "done": True, "done_reason": "load",
+                                             "message": {"role": "assistant", "content": ""}})
+                content = stub.reply(body) if callable(stub.reply) else stub.reply
+                max_words = (body.get("options") or {}).get("num_predict")
+                if max_words:
+                    content = " ".join(content.split(" ")[:max_words])
+                with stub._lock:
+                    stub.generated_words += len(content.split())
+                if body.get("stream"):
+                    return self._stream(content)
+                delay = stub.latency + stub.word_latency * len(content.split())
+                if stub._slots is not None:
+                    with stub._slots:
+                        time.sleep(delay)
+                elif delay:
+                    time.sleep(delay)
+                self._reply(200, {"model": stub.models[0], "done": True,
+                                  "message": {"role": "assistant", "content": content}, **stub._eval_stats(content)})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.host = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def _eval_stats(self, content: str) -> dict:
+        words = len(content.split())
+        return {"eval_count": words, "eval_duration": int(self.word_latency * words * 1e9)}
+
+    def chat_calls(self) -> int:
+        return self.requests.count("/api/chat")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,262 @@
+"""
+Benchmark suite for the scoring pipeline, with JSON baselines.
+
+    python -m benchmarks.suite run [--scales 1 10 100] [--repeat 3] [--cases 'agent_*' ...] [--output FILE]
+    python -m benchmarks.suite run --compare benchmarks/baselines/baseline.json [--threshold 0.1]
+    python -m benchmarks.suite compare BASELINE CURRENT [--threshold 0.1] [--stat best|median]
+
+Times parse_timestamp, each agent_* function, master_agent,
+process_user_query for every intent (list, assess, help, general),
+get_rule_based_credit_score over every user, and the trained model
+(app/services/ml_scoring.py, fitted on the case's data first) over every
+user, both as one batch and one user dict at a time. Scale 1 is the bundled docs/;
+other scales are synthetic copies (benchmarks/synthetic_data.py). Ollama is
+replaced by StubOllama with no latency, so the LLM intents time only our side
+of the call, and the assessment cache is emptied before every assess run.
+Each case runs once untimed (warming the columnar cache), then `--repeat`
+times; the best and median run are recorded.
+
+`compare` flags a case as a regression when its time grew by more than
+--threshold (a fraction) and by at least --min-delta-ms, and exits with
+status 1 if any case regressed. Timings only compare on the same machine, so
+the machine details stored with each result are checked too.
+"""
+import argparse
+import copy
+import fnmatch
+import functools
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, NamedTuple
+
+import pandas as pd
+
+import server
+from app.services.feature_store import FeatureStore
+from app.services.ml_scoring import CreditModel, train_credit_model
+from app.services.llm_cache import AssessmentCache
+from app.utils.columnar_cache import load_csv
+from benchmarks.load_test import use_stub
+from benchmarks.stub_ollama import StubOllama
+from benchmarks.synthetic_data import generate
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "baseline.json")
+SCALES = [1, 10, 100]
+QUERIES = {
+    'list': "List all users",
+    'assess': "Assess the creditworthiness of {name}",
+    'help': "help",
+    'general': "How does alternative credit scoring work?",
+}
+STATS = {'best': 'best_ms', 'median': 'median_ms'}
+
+
+class Case(NamedTuple):
+    setup: Callable[[], tuple]  # fresh arguments for one run, not timed
+    run: Callable
+
+
+def _no_args() -> tuple:
+    return ()
+
+
+def _empty_cache() -> tuple:
+    server.assessment_cache = AssessmentCache()
+    return ()
+
+
+def _score_all(records: List[dict]):
+    return [server.get_rule_based_credit_score(record) for record in records]
+
+
+def _predict_each(model: CreditModel, records: List[dict]):
+    return [model.predict_user(record) for record in records]
+
+
+def build_cases(features: pd.DataFrame) -> Dict[str, Case]:
+    raw = pd.read_csv(os.path.join(server.DATA_DIR, "financial_transactions.csv"))
+    tables = server.load_shared_tables()
+    records = features.to_dict('records')
+    cases = {'parse_timestamp': Case(lambda: (raw.copy(),), server.parse_timestamp)}
+    for name, agent in server.AGENTS.items():
+        cases[name] = Case(lambda: tables, agent)
+    cases['master_agent'] = Case(_no_args, server.master_agent)
+    for intent, query in QUERIES.items():
+        query = query.format(name=features['name'].iloc[0])
+        cases[f'process_user_query[{intent}]'] = Case(_empty_cache, functools.partial(server.process_user_query, query))
+    cases['get_rule_based_credit_score'] = Case(lambda: (records,), _score_all)
+    outcomes = pd.read_csv(os.path.join(server.DATA_DIR, "loan_history.csv"))
+    model = train_credit_model(features, outcomes, 0, exclude=server.feature_store.dependents("loan_history.csv"))
+    cases['ml_predict_batch'] = Case(lambda: (features,), model.predict)
+    cases['ml_predict_user'] = Case(lambda: (model, records), _predict_each)
+    return cases
+
+
+@contextmanager
+def dataset(scale: int):
+    """Directory with the source CSVs at `scale` times the bundled size"""
+    if scale == 1:
+        yield server.DATA_DIR
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        yield generate(tmp, scale)
+
+
+@contextmanager
+def use_data(data_dir: str):
+    """Point the agents and the feature store at `data_dir`; yields the feature table"""
+    saved = server.DATA_DIR, server.feature_store, server._user_index
+    nodes = [copy.copy(node) for node in server.FEATURE_NODES]
+    for node in nodes:
+        node.state = None
+    server.DATA_DIR = data_dir
+    server.feature_store = FeatureStore(nodes, server.assemble_feature_table, data_dir,
+                                        loader=load_csv, prepare=server.prepare_source)
+    server._user_index = None
+    try:
+        yield server.feature_store.warm()
+    finally:
+        server.DATA_DIR, server.feature_store, server._user_index = saved
+
+
+@contextmanager
+def stubbed_ollama():
+    saved = (server.OLLAMA_HOST, server.ollama_client, server.ollama_health, server._async_llm,
+             server.assessment_cache)
+    stub = StubOllama(models=[server.OLLAMA_MODEL])
+    use_stub(stub)
+    try:
+        yield stub
+    finally:
+        stub.close()
+        (server.OLLAMA_HOST, server.ollama_client, server.ollama_health, server._async_llm,
+         server.assessment_cache) = saved
+
+
+def time_case(case: Case, repeat: int) -> dict:
+    case.run(*case.setup())
+    timings = []
+    for _ in range(repeat):
+        args = case.setup()
+        start = time.perf_counter()
+        case.run(*args)
+        timings.append(time.perf_counter() - start)
+    return {'best_ms': round(min(timings) * 1e3, 4), 'median_ms': round(statistics.median(timings) * 1e3, 4),
+            'runs': repeat}
+
+
+def machine() -> dict:
+    return {'python': platform.python_version(), 'pandas': pd.__version__, 'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(), 'cpu_count': os.cpu_count()}
+
+
+def run_suite(scales: List[int] = SCALES, repeat: int = 3, patterns: List[str] = ("*",), log=print) -> dict:
+    """{"created", "machine", "users", "results": {"<scale>x": {case: {"best_ms", "median_ms", "runs"}}}}"""
+    report = {'created': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'machine': machine(),
+              'users': {}, 'results': {}}
+    with stubbed_ollama():
+        for scale in scales:
+            with dataset(scale) as data_dir, use_data(data_dir) as features:
+                key = f"{scale}x"
+                report['users'][key] = len(features)
+                results = report['results'][key] = {}
+                for name, case in build_cases(features).items():
+                    if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns):
+                        results[name] = time_case(case, repeat)
+                        log(f"{key:>5} {name:<40}{results[name]['best_ms']:>11.2f} ms")
+    return report
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1, stat: str = 'best',
+            min_delta_ms: float = 0.1) -> List[dict]:
+    """One row per case of `current`; status is "REGRESSION", "faster", "ok" or "new" (not in the baseline)"""
+    field = STATS[stat]
+    rows = []
+    for scale, cases in current['results'].items():
+        for name, result in cases.items():
+            row = {'scale': scale, 'case': name, 'baseline_ms': None, 'current_ms': result[field],
+                   'change': None, 'status': 'new'}
+            base = baseline['results'].get(scale, {}).get(name)
+            if base is not None:
+                before, after = base[field], result[field]
+                change = after / before - 1 if before else 0.0
+                if change > threshold and after - before >= min_delta_ms:
+                    status = 'REGRESSION'
+                elif change < -threshold:
+                    status = 'faster'
+                else:
+                    status = 'ok'
+                row.update(baseline_ms=before, change=change, status=status)
+            rows.append(row)
+    return rows
+
+
+def machine_mismatch(baseline: dict, current: dict) -> Dict[str, tuple]:
+    before, after = baseline.get('machine', {}), current.get('machine', {})
+    return {key: (before.get(key), after.get(key)) for key in after if before.get(key) != after.get(key)}
+
+
+def report_comparison(baseline: dict, current: dict, args) -> int:
+    """Print the comparison table; 1 if any case regressed"""
+    for key, (before, after) in machine_mismatch(baseline, current).items():
+        print(f"Warning: baseline {key} {before!r} differs from {after!r}; timings may not be comparable")
+    rows = compare(baseline, current, args.threshold, args.stat, args.min_delta_ms)
+    print(f"{'scale':>5} {'case':<40}{'baseline ms':>12}{'current ms':>12}{'change':>9}  status")
+    for row in rows:
+        before = "-" if row['baseline_ms'] is None else f"{row['baseline_ms']:.2f}"
+        change = "-" if row['change'] is None else f"{row['change']:+.1%}"
+        print(f"{row['scale']:>5} {row['case']:<40}{before:>12}{row['current_ms']:>12.2f}{change:>9}  {row['status']}")
+    regressions = [row for row in rows if row['status'] == 'REGRESSION']
+    print(f"{len(regressions)} regression(s) above {args.threshold:.0%} ({args.stat} of each case)")
+    return 1 if regressions else 0
+
+
+def _load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _add_compare_options(parser):
+    parser.add_argument("--threshold", type=float, default=0.1, help="Slowdown that counts as a regression (0.1 = 10%%)")
+    parser.add_argument("--stat", choices=sorted(STATS), default='best', help="Which run of each case to compare")
+    parser.add_argument("--min-delta-ms", type=float, default=0.1, help="Ignore slowdowns smaller than this")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="Time the cases and write the results as JSON")
+    run.add_argument("--scales", type=int, nargs="+", default=SCALES)
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--cases", nargs="+", default=["*"], help="Case name patterns, e.g. 'agent_*'")
+    run.add_argument("--output", default="benchmark_results.json",
+                     help=f"Result file; write to {os.path.relpath(BASELINE)} to update the baseline")
+    run.add_argument("--compare", metavar="BASELINE", help="Compare the results against this file afterwards")
+    _add_compare_options(run)
+    check = commands.add_parser("compare", help="Compare two result files")
+    check.add_argument("baseline")
+    check.add_argument("current")
+    _add_compare_options(check)
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        sys.exit(report_comparison(_load(args.baseline), _load(args.current), args))
+
+    report = run_suite(args.scales, args.repeat, args.cases)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        sys.exit(report_comparison(_load(args.compare), report, args))
+
+
+if __name__ == "__main__":
+    main()
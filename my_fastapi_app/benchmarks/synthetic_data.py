@@ -0,0 +1,68 @@
+"""
+Synthetic copies of the docs/ tables at N times their size.
+
+    python -m benchmarks.synthetic_data TARGET_DIR [--scale 10]
+
+Each table is written `--scale` times in a row under shifted user_ids
+(replica i holds users i * max_id + 1 ...), so every replica is a new set
+of users with the shape of the originals, and files stay grouped by
+user_id like the bundled ones. Amount columns get a random +/-20% jitter
+so replicas do not aggregate to identical features. Replicas are appended
+one at a time; memory holds one copy of the source table, not the output.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import server
+
+JITTER = 0.2
+
+
+def _replica(df: pd.DataFrame, i: int, step: int, rng: np.random.Generator) -> pd.DataFrame:
+    df = df.copy()
+    if 'user_id' in df.columns:
+        df['user_id'] += i * step
+    if i:
+        for column in df.columns:
+            if 'amount' in column and pd.api.types.is_numeric_dtype(df[column]):
+                jittered = df[column] * rng.uniform(1 - JITTER, 1 + JITTER, len(df))
+                df[column] = jittered.round(2 if pd.api.types.is_float_dtype(df[column]) else 0).astype(df[column].dtype)
+    return df
+
+
+def generate(target: str, scale: int, seed: int = 0, source: str = None) -> str:
+    """Write every CSV of `source` (default docs/) into `target` at `scale` times its size"""
+    source = source or server.DATA_DIR
+    rng = np.random.default_rng(seed)
+    os.makedirs(target, exist_ok=True)
+    for file in sorted(os.listdir(source)):
+        if not file.endswith(".csv"):
+            continue
+        df = pd.read_csv(os.path.join(source, file))
+        path = os.path.join(target, file)
+        if 'user_id' not in df.columns or df.empty:
+            df.to_csv(path, index=False)
+            continue
+        step = int(df['user_id'].max())
+        for i in range(scale):
+            _replica(df, i, step, rng).to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("target")
+    parser.add_argument("--scale", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate(args.target, args.scale, args.seed)
+    size = sum(os.path.getsize(os.path.join(args.target, f)) for f in os.listdir(args.target))
+    print(f"wrote {args.scale}x docs/ to {args.target} ({size / 2**20:.1f} MiB)")
+
+
+if __name__ == "__main__":
+    main()
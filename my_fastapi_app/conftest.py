@@ -0,0 +1,12 @@
+# Keep the persistent caches out of the test run. Settings are read when server
+# and the services are imported, so this must run before any module is collected
+# (benchmarks/load_test.py matches pytest's *_test.py pattern and imports server).
+import os
+import tempfile
+
+_cache_dir = tempfile.TemporaryDirectory(prefix="credit-tests-")
+
+# In-memory LLM assessment and embedding caches, a throwaway columnar cache
+os.environ["LLM_CACHE_PATH"] = ""
+os.environ["KB_EMBEDDING_CACHE_PATH"] = ""
+os.environ["COLUMNAR_CACHE_DIR"] = os.path.join(_cache_dir.name, "columnar")
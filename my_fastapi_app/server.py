@@ -1,57 +1,236 @@
+import asyncio
+import contextvars
+import functools
+import json
 import os
+import threading
+import time
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import ollama
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 
 # main.py
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "docs")
 
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+from app.core.metrics import (ASSESSMENTS, CONTENT_TYPE, LLM_CALLS, LLM_TOKENS, LLM_TOKENS_PER_SECOND, observe_stage,
+                              render as render_metrics, stage, stage_timing_middleware)
+from app.core.settings import (AGENT_PROCESSES, AGENT_WORKERS, FEATURE_MEMORY_BUDGET_MB, FEATURE_WORKERS,
+                               LLM_BATCH_MODE, LLM_BATCH_SIZE, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_PATH,
+                               LLM_CACHE_TTL, LLM_MAX_CONCURRENCY, LLM_OUTPUT_FORMAT, LLM_RETRIES,
+                               LLM_RETRY_DELAY, LLM_STRUCTURED_MAX_TOKENS, ML_MIN_HOLDOUT_AUC, ML_MODEL_DIR,
+                               OLLAMA_BREAKER_FAILURES, OLLAMA_BREAKER_RESET, OLLAMA_HEALTH_INTERVAL,
+                               OLLAMA_HEALTH_TTL, OLLAMA_HOST, OLLAMA_MODEL, OLLAMA_PROBE_TIMEOUT,
+                               REQUEST_COALESCING)
+from app.services.aggregation import MonthlySpec, monthly_stats, monthly_totals, user_monthly_stats
+from app.services.feature_store import FeatureNode, FeatureStore
+from app.services.llm_batch import (BATCH_MODES, MAX_FACTORS, OUTPUT_FORMATS, LLMUnavailable, chunked,
+                                    format_option, parse_assessment, parse_batch_response, retry_async)
+from app.services.llm_cache import AssessmentCache, assessment_key
+from app.services.llm_health import CircuitBreaker, OllamaHealthMonitor
+from app.services.ml_scoring import CreditModel, MLScores, load_latest, serving_problem
+from app.services.rule_scoring import (BASE_SCORE, MAX_SCORE, MIN_SCORE, RULE_NAMES, matched_rules, missing_user_ids,
+                                       risk_level, score_batch)
+from app.services.single_flight import SingleFlight
+from app.services.task_graph import Task, TaskResult, run_tasks
+from app.services.user_index import UserIndex
+from app.utils.columnar_cache import coerce_types, load_csv
+from app.utils.lazy import Lazy
+from app.utils.sse import sse_event
 # from logic import process_query
 
 app = FastAPI()
+app.middleware("http")(stage_timing_middleware)
 
 class QueryRequest(BaseModel):
     query: str
 
+class BatchScoreRequest(BaseModel):
+    user_ids: Optional[List[int]] = None
+    include_contributions: bool = False
+
+class LLMScoreRequest(BaseModel):
+    user_ids: List[int]
+    output_format: Optional[str] = None
+
+class MLScoreRequest(BaseModel):
+    user_ids: Optional[List[int]] = None
+    include_contributions: bool = False
+    # Add a narrative explanation of each score (LLM when available); needs user_ids
+    explain: bool = False
+
 
 @app.on_event("startup")
 async def startup_event():
-    if test_system():
-        print("\n" + "="*50)
-        run_credit_agent()
-    else:
-        raise RuntimeError("System test failed. Please check your data files and Ollama installation.")
-    
+    start_background_warm_up()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    ollama_health.stop()
+
     
 @app.post("/process")
 async def process(request: QueryRequest):
-    response = process_user_query(request.query)
+    response = await process_user_query_async(request.query)
     return {"result": response}
 
 
+@app.get("/health/live")
+async def liveness():
+    """The process is up and its event loop is answering"""
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+def readiness():
+    """200 once the feature table is built: every query can be answered, by the LLM or the rule-based fallback"""
+    ready = warmup_status['features_ready']
+    return JSONResponse({"ready": ready, "error": warmup_status['error'], "seconds": warmup_status['seconds'],
+                         "ml_model": warmup_status['ml_model']},
+                        status_code=200 if ready else 503)
+
+
+@app.get("/health/model")
+def model_readiness():
+    """200 while the model is loaded and reachable; 503 means assessments currently use the rule-based scorer"""
+    warm = warmup_status['model_warm'] and ollama_health.is_healthy(OLLAMA_MODEL)
+    return JSONResponse({"warm": warm, "model": OLLAMA_MODEL, "ollama": ollama_health.status()},
+                        status_code=200 if warm else 503)
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {"llm_assessments": assessment_cache.stats(),
+            "single_flight": {flights.name: flights.stats() for flights in (assessment_flights, llm_flights)}}
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text format: stage timings, request latency, LLM calls and tokens, assessment sources"""
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE)
+
+
+@app.post("/process/stream")
+async def process_stream(request: QueryRequest):
+    """Same as /process, but LLM output is sent as server-sent events while it is generated"""
+    async def events():
+        async for chunk in stream_user_query(request.query):
+            yield sse_event({"delta": chunk})
+        yield sse_event({}, event="done")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/score/batch")
+def score_batch_endpoint(request: BatchScoreRequest):
+    """Rule-based scores for every user (or the given user_ids, in that order) in one vectorized pass"""
+    features = feature_store.get()
+    if features.empty:
+        return {"error": "Unable to load user data. Please check if CSV files are available."}
+    scores = score_batch(features, request.user_ids)
+    return {
+        "count": len(scores.score),
+        "missing_user_ids": missing_user_ids(request.user_ids, scores.user_id),
+        "rules": RULE_NAMES if request.include_contributions else [],
+        "results": scores.to_frame(request.include_contributions).to_dict('records'),
+    }
+
+
+@app.post("/score/llm")
+async def score_llm_endpoint(request: LLMScoreRequest):
+    """Structured assessments (score, factors, reasoning); "source" says whether the trained model, the LLM or the rules produced each"""
+    if request.output_format not in (None, *OUTPUT_FORMATS):
+        return {"error": f"output_format must be one of {list(OUTPUT_FORMATS)}"}
+    users = await asyncio.gather(*(run_blocking(feature_store.get_user, user_id) for user_id in request.user_ids))
+    found = [user for user in users if user is not None]
+    assessments = await asyncio.gather(*(get_structured_credit_score_async(user, output_format=request.output_format)
+                                         for user in found))
+    return {
+        "count": len(found),
+        "missing_user_ids": [user_id for user_id, user in zip(request.user_ids, users) if user is None],
+        "results": [{"user_id": user['user_id'], **assessment} for user, assessment in zip(found, assessments)],
+    }
+
+
+@app.post("/score/ml")
+async def score_ml_endpoint(request: MLScoreRequest):
+    """Trained-model scores for every user (or the given user_ids, in that order) in one pass, with per-feature log-odds"""
+    model = credit_model
+    if model is None:
+        if credit_model_problem:
+            return {"error": f"Trained model not served: {credit_model_problem}"}
+        return {"error": f"No trained model in {ML_MODEL_DIR}; run python train_model.py"}
+    if request.explain and not request.user_ids:
+        return {"error": "explain needs user_ids"}
+    features = await run_blocking(feature_store.get)
+    if features.empty:
+        return {"error": NO_DATA_MESSAGE}
+    with stage('ml_scoring', f"v{model.version}"):
+        scores = model.predict(features, request.user_ids)
+    results = scores.to_frame(request.include_contributions).to_dict('records')
+    if request.explain:
+        users = {user['user_id']: user for user in
+                 await asyncio.gather(*(run_blocking(feature_store.get_user, uid) for uid in scores.user_id))}
+        explanations = await asyncio.gather(*(explain_ml_score_async(users[uid], scores, i)
+                                              for i, uid in enumerate(scores.user_id)))
+        for result, explanation in zip(results, explanations):
+            result.update(explanation)
+    return {
+        "count": len(results),
+        "missing_user_ids": missing_user_ids(request.user_ids, scores.user_id),
+        "model_version": model.version,
+        "features": model.features if request.include_contributions else [],
+        "results": results,
+    }
+
+
 # ---------------------------
 # 1️⃣ DATA PREPROCESSING
 # ---------------------------
 
+# Per-user statistics of monthly spend (see app/services/aggregation.py)
+UTILITY_MONTHLY = MonthlySpec('amount', {
+    'monthly_utility_spend': 'mean',
+    'utility_spend_std': 'std',
+    'utility_spend_trend': 'trend',
+    'utility_payment_regularity': 'regularity',
+})
+ECOMMERCE_MONTHLY = MonthlySpec('amount', {
+    'monthly_ecom_spend': 'mean',
+    'ecom_spend_std': 'std',
+    'ecom_spend_trend': 'trend',
+    'ecom_regularity': 'regularity',
+})
+
 def parse_timestamp(df):
     if 'timestamp' in df.columns:
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df['month'] = df['timestamp'].dt.to_period('M')
+        # Frames from the columnar cache already hold datetime64 timestamps
+        if not pd.api.types.is_datetime64_any_dtype(df['timestamp']):
+            df['timestamp'] = pd.to_datetime(df['timestamp'])
     return df
 
-def agent_1_utilities_rent_telecom():
+def load_shared_tables(users_df=None, loc_df=None):
+    """users.csv and location_data.csv, unless the caller already loaded them"""
+    if users_df is None:
+        users_df = load_csv(os.path.join(DATA_DIR, "users.csv"))
+    if loc_df is None:
+        loc_df = load_csv(os.path.join(DATA_DIR, "location_data.csv"))
+    return users_df, loc_df
+
+def agent_1_utilities_rent_telecom(users_df=None, loc_df=None):
     try:
-        users_df = pd.read_csv(os.path.join(DATA_DIR, "users.csv"))
-        loc_df = pd.read_csv(os.path.join(DATA_DIR, "location_data.csv"))
-        bill_df = parse_timestamp(pd.read_csv(os.path.join(DATA_DIR, "bill_payments.csv")))
-        rent_df = parse_timestamp(pd.read_csv(os.path.join(DATA_DIR, "inferred_rent_payments.csv")))
-        telecom_df = parse_timestamp(pd.read_csv(os.path.join(DATA_DIR, "telecom_usage.csv")))
+        users_df, loc_df = load_shared_tables(users_df, loc_df)
+        bill_df = parse_timestamp(load_csv(os.path.join(DATA_DIR, "bill_payments.csv")))
+        rent_df = parse_timestamp(load_csv(os.path.join(DATA_DIR, "inferred_rent_payments.csv")))
+        telecom_df = parse_timestamp(load_csv(os.path.join(DATA_DIR, "telecom_usage.csv")))
 
-        utility_spend = bill_df.groupby(['user_id', 'month'])['amount'].sum().reset_index(name='monthly_utility_spend')
+        # One row per user; merging per-month rows here would multiply every user by their month count
+        utility_spend = user_monthly_stats(bill_df, UTILITY_MONTHLY).reset_index()
         rent_avg = rent_df.groupby('user_id')['amount'].mean().reset_index(name='avg_rent_payment')
         telecom_avg = telecom_df.groupby('user_id')[['monthly_data_usage_gb', 'monthly_recharge_amount']].mean().reset_index()
 
@@ -65,16 +244,15 @@ def agent_1_utilities_rent_telecom():
         print(f"Error in agent_1_utilities_rent_telecom: {e}")
         return pd.DataFrame()
 
-def agent_2_financials():
+def agent_2_financials(users_df=None, loc_df=None):
     try:
-        users_df = pd.read_csv(os.path.join(DATA_DIR, "users.csv"))
-        loc_df = pd.read_csv(os.path.join(DATA_DIR, "location_data.csv"))
-        upi_df = parse_timestamp(pd.read_csv(os.path.join(DATA_DIR, "upi_transactions.csv")))
-        wallet_df = parse_timestamp(pd.read_csv(os.path.join(DATA_DIR, "wallet_balances.csv")))
-        fin_df = parse_timestamp(pd.read_csv(os.path.join(DATA_DIR, "financial_transactions.csv")))
-        gig_df = parse_timestamp(pd.read_csv(os.path.join(DATA_DIR, "gig_income.csv")))
-        salary_df = parse_timestamp(pd.read_csv(os.path.join(DATA_DIR, "salary_income.csv")))
-        loan_df = pd.read_csv(os.path.join(DATA_DIR, "loan_history.csv"))
+        users_df, loc_df = load_shared_tables(users_df, loc_df)
+        upi_df = parse_timestamp(load_csv(os.path.join(DATA_DIR, "upi_transactions.csv")))
+        wallet_df = parse_timestamp(load_csv(os.path.join(DATA_DIR, "wallet_balances.csv")))
+        fin_df = parse_timestamp(load_csv(os.path.join(DATA_DIR, "financial_transactions.csv")))
+        gig_df = parse_timestamp(load_csv(os.path.join(DATA_DIR, "gig_income.csv")))
+        salary_df = parse_timestamp(load_csv(os.path.join(DATA_DIR, "salary_income.csv")))
+        loan_df = load_csv(os.path.join(DATA_DIR, "loan_history.csv"))
 
         upi_total = upi_df.groupby('user_id')['amount'].sum().reset_index(name='upi_total_spent')
         wallet_bal = wallet_df.groupby(['user_id', 'wallet_type'])['balance_amount'].last().unstack().fillna(0).reset_index()
@@ -95,13 +273,12 @@ def agent_2_financials():
         print(f"Error in agent_2_financials: {e}")
         return pd.DataFrame()
 
-def agent_3_ecommerce():
+def agent_3_ecommerce(users_df=None, loc_df=None):
     try:
-        users_df = pd.read_csv(os.path.join(DATA_DIR, "users.csv"))
-        loc_df = pd.read_csv(os.path.join(DATA_DIR, "location_data.csv"))
-        ecommerce_df = parse_timestamp(pd.read_csv(os.path.join(DATA_DIR, "ecommerce_activity.csv")))
+        users_df, loc_df = load_shared_tables(users_df, loc_df)
+        ecommerce_df = parse_timestamp(load_csv(os.path.join(DATA_DIR, "ecommerce_activity.csv")))
 
-        monthly_spend = ecommerce_df.groupby(['user_id', 'month'])['amount'].sum().reset_index(name='monthly_ecom_spend')
+        monthly_spend = user_monthly_stats(ecommerce_df, ECOMMERCE_MONTHLY).reset_index()
         return users_df.merge(monthly_spend, on='user_id', how='left') \
                        .merge(loc_df, on='user_id', how='left') \
                        .fillna(0)
@@ -109,60 +286,316 @@ def agent_3_ecommerce():
         print(f"Error in agent_3_ecommerce: {e}")
         return pd.DataFrame()
 
-def master_agent(user_query="Generate score"):
-    try:
-        df1 = agent_1_utilities_rent_telecom()
-        df2 = agent_2_financials()
-        df3 = agent_3_ecommerce()
+AGENTS = {
+    'agent_1_utilities_rent_telecom': agent_1_utilities_rent_telecom,
+    'agent_2_financials': agent_2_financials,
+    'agent_3_ecommerce': agent_3_ecommerce,
+}
 
-        if df1.empty or df2.empty or df3.empty:
-            print("Warning: Some agent data is missing")
-            return pd.DataFrame()
+# name -> TaskResult (value, error, seconds) of the most recent master_agent() build
+last_agent_run: Dict[str, TaskResult] = {}
+
+def load_source(file: str) -> pd.DataFrame:
+    return load_csv(os.path.join(DATA_DIR, file))
+
+def run_agent(name: str, users_df, loc_df) -> pd.DataFrame:
+    """One agent as a task: module-level so process workers can unpickle it, raises instead of returning empty"""
+    df = AGENTS[name](users_df, loc_df)
+    if df.empty:
+        raise RuntimeError("returned no data")
+    return df
+
+def run_agents() -> Dict[str, TaskResult]:
+    """Load the shared tables once, then run the agents concurrently"""
+    tasks = [
+        Task('users', load_source, args=("users.csv",)),
+        Task('location', load_source, args=("location_data.csv",)),
+    ]
+    tasks += [Task(name, run_agent, deps=['users', 'location'], args=(name,)) for name in AGENTS]
+    return run_tasks(tasks, max_workers=AGENT_WORKERS, processes=AGENT_PROCESSES)
 
-        string_columns = ['user_id', 'name']
-        context_df = df1[string_columns].drop_duplicates()
+def merge_agent_frames(frames: List[pd.DataFrame], results: Dict[str, TaskResult]) -> pd.DataFrame:
+    """One row per user: the agents' numeric features averaged per user, then name and location"""
+    string_columns = ['user_id', 'name']
+    context_df = results['users'].value[string_columns].drop_duplicates()
 
-        df1_num = df1.groupby('user_id').mean(numeric_only=True).reset_index()
-        df2_num = df2.groupby('user_id').mean(numeric_only=True).reset_index()
-        df3_num = df3.groupby('user_id').mean(numeric_only=True).reset_index()
+    final_numeric = None
+    for df in frames:
+        df_num = df.groupby('user_id').mean(numeric_only=True).reset_index()
+        final_numeric = df_num if final_numeric is None else final_numeric.merge(df_num, on='user_id', how='outer')
+    # Amounts are stored as float32; report the aggregated features as float64
+    final_numeric = final_numeric.astype({col: float for col in final_numeric.columns if col != 'user_id'})
 
-        final_numeric = df1_num.merge(df2_num, on='user_id', how='outer') \
-                             .merge(df3_num, on='user_id', how='outer')
+    final = final_numeric.merge(context_df.drop_duplicates('user_id'), on='user_id', how='left') \
+                       .merge(results['location'].value.drop_duplicates('user_id'), on='user_id', how='left')
+    return final
 
-        final = final_numeric.merge(context_df.drop_duplicates('user_id'), on='user_id', how='left') \
-                           .merge(pd.read_csv(os.path.join(DATA_DIR, "location_data.csv")).drop_duplicates('user_id'), on='user_id', how='left')
+def master_agent(user_query="Generate score"):
+    global last_agent_run
+    try:
+        results = last_agent_run = run_agents()
+        # Timed where they ran (thread or forked process), recorded here so both end up in this registry
+        for name in AGENTS:
+            observe_stage('agent', name, results[name].seconds)
+        failed = {name: result.error for name, result in results.items() if not result.ok}
+        if failed:
+            print(f"Warning: Some agent data is missing: {failed}")
 
-        return final
+        # A failed agent only drops its own columns
+        frames = [results[name].value for name in AGENTS if results[name].ok]
+        if not frames:
+            return pd.DataFrame()
+
+        with stage('master_agent_merge'):
+            return merge_agent_frames(frames, results)
     except Exception as e:
         print(f"Error in master_agent: {e}")
         return pd.DataFrame()
 
 
+# ---------------------------
+# 1️⃣b FEATURE DEPENDENCY GRAPH
+# ---------------------------
+# The same aggregates as the agents above, split per source CSV so that a
+# change to one file only recomputes the features it feeds. Event files keep
+# sums/counts per key, which lets appended rows be folded in without a re-read.
+# Sums are kept in float64 so the result does not depend on how rows were split
+# into appends or chunks.
+
+def _add(old, new):
+    return old.add(new, fill_value=0)
+
+def _sum_node(name, source, column):
+    return FeatureNode(
+        name, source, [column],
+        partial=lambda df: df['amount'].astype('float64').groupby(df['user_id']).sum(),
+        finalize=lambda state: state.to_frame(column),
+        combine=_add,
+    )
+
+def _mean_node(name, source, columns, value_columns):
+    def partial(df):
+        grouped = df[value_columns].astype('float64').groupby(df['user_id'])
+        return pd.concat({'sum': grouped.sum(), 'count': grouped.count()}, axis=1)
+
+    def finalize(state):
+        mean = state['sum'] / state['count']
+        mean.columns = columns
+        return mean
+
+    return FeatureNode(name, source, columns, partial=partial, finalize=finalize, combine=_add)
+
+def _monthly_stats_node(name, source, spec):
+    # State is the narrow per-(user, month) totals series, so appended rows fold into their month
+    return FeatureNode(
+        name, source, spec.columns,
+        partial=lambda df: monthly_totals(df, spec.value),
+        finalize=lambda state: monthly_stats(state, spec),
+        combine=_add,
+    )
+
+def _last_wallet_balance(df):
+    return df.groupby(['user_id', 'wallet_type'])['balance_amount'].last()
+
+def _first_row(old, new):
+    # Later chunks only add users that have not been seen yet, like drop_duplicates keeping the first row
+    return pd.concat([old, new[~new.index.isin(old.index)]])
+
+FEATURE_NODES = [
+    FeatureNode('users', "users.csv", ['name'],
+                partial=lambda df: df[['user_id', 'name']].drop_duplicates('user_id').set_index('user_id', drop=False),
+                combine=_first_row),
+    FeatureNode('location', "location_data.csv", ['home_location', 'work_location', 'location_stability'],
+                partial=lambda df: df.drop_duplicates('user_id').set_index('user_id'),
+                combine=_first_row),
+    # agent_1_utilities_rent_telecom
+    _monthly_stats_node('utility', "bill_payments.csv", UTILITY_MONTHLY),
+    _mean_node('rent', "inferred_rent_payments.csv", ['avg_rent_payment'], ['amount']),
+    _mean_node('telecom', "telecom_usage.csv", ['monthly_data_usage_gb', 'monthly_recharge_amount'],
+               ['monthly_data_usage_gb', 'monthly_recharge_amount']),
+    # agent_2_financials
+    _sum_node('upi', "upi_transactions.csv", 'upi_total_spent'),
+    FeatureNode('wallet', "wallet_balances.csv", ['GooglePay', 'Paytm', 'PhonePe'],
+                partial=_last_wallet_balance,
+                finalize=lambda state: state.unstack().fillna(0),
+                combine=lambda old, new: new.combine_first(old)),
+    _sum_node('financial', "financial_transactions.csv", 'total_transactions'),
+    _sum_node('gig', "gig_income.csv", 'gig_income_total'),
+    _mean_node('salary', "salary_income.csv", ['avg_salary'], ['amount']),
+    _mean_node('loans', "loan_history.csv", ['total_loans', 'on_time_repayments', 'outstanding_amount'],
+               ['total_loans', 'on_time_repayments', 'outstanding_amount']),
+    # agent_3_ecommerce
+    _monthly_stats_node('ecommerce', "ecommerce_activity.csv", ECOMMERCE_MONTHLY),
+]
+
+# Numeric nodes in the column order master_agent() produces
+NUMERIC_FEATURE_NODES = ['utility', 'rent', 'telecom', 'upi', 'wallet', 'financial',
+                         'gig', 'salary', 'loans', 'ecommerce']
+
+def assemble_feature_table(outputs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Join the per-node outputs into the same table master_agent() returns. A numeric node
+    whose source never loaded is left out, like a failed agent; users and location are required
+    """
+    users = outputs['users']
+    table = pd.DataFrame(index=users.index.sort_values())
+    for name in NUMERIC_FEATURE_NODES:
+        if name in outputs:
+            table = table.join(outputs[name].astype(float))
+    table = table.fillna(0)
+    table = table.join(users['name']).join(outputs['location'])
+    table.index.name = 'user_id'
+    table = table.reset_index()
+    # Keep the compact user_id type of the source tables (index ops widen it to int64)
+    table['user_id'] = table['user_id'].astype(users['user_id'].dtype)
+    return table
+
+
+def prepare_source(df):
+    # Appended rows are parsed from raw CSV text, so bring them to the cached column types too
+    return parse_timestamp(coerce_types(df))
+
+# Built once and shared by every request; only the nodes whose source CSV changed are recomputed
+feature_store = FeatureStore(FEATURE_NODES, assemble_feature_table, DATA_DIR,
+                             loader=load_csv, prepare=prepare_source, workers=AGENT_WORKERS,
+                             memory_budget=FEATURE_MEMORY_BUDGET_MB * 2**20)
+
+
 # ---------------------------
 # 2️⃣ LLM CREDIT SCORING FUNCTIONS
 # ---------------------------
 
-def check_ollama_connection(model='gemma3:4b') -> bool:
-    """Check if Ollama is running and model is available"""
+def make_ollama_client(**options):
+    # Imported here: ollama (with httpx behind it) is a fifth of the server's import time
+    import ollama
+    return ollama.Client(host=OLLAMA_HOST, **options)
+
+ollama_client = Lazy(make_ollama_client)
+
+# Polls Ollama's model list in the background; requests only read the cached
+# status and the circuit breaker, never probe the model themselves
+ollama_health = OllamaHealthMonitor(
+    Lazy(functools.partial(make_ollama_client, timeout=OLLAMA_PROBE_TIMEOUT)),
+    CircuitBreaker(OLLAMA_BREAKER_FAILURES, OLLAMA_BREAKER_RESET),
+    interval=OLLAMA_HEALTH_INTERVAL,
+    ttl=OLLAMA_HEALTH_TTL,
+)
+
+# Blocking pandas work of async requests runs here instead of on the event loop
+feature_executor = ThreadPoolExecutor(max_workers=FEATURE_WORKERS, thread_name_prefix="features")
+
+# (event loop, AsyncClient, Semaphore); httpx pools and asyncio primitives belong to one loop
+_async_llm = None
+
+# Bump whenever build_credit_prompt changes so cached assessments from the old prompt are not reused
+CREDIT_PROMPT_VERSION = 1
+
+# LLM assessments keyed on the user's feature summary; entries of users whose
+# features change are dropped by the feature store
+assessment_cache = AssessmentCache(LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL, LLM_CACHE_PATH or None)
+feature_store.subscribe(assessment_cache.invalidate_users)
+
+# Concurrent requests for the same assessment (features, model, prompt) share one computation,
+# and identical model calls one generation; see app/services/single_flight.py
+assessment_flights = SingleFlight('assessment', REQUEST_COALESCING)
+llm_flights = SingleFlight('llm', REQUEST_COALESCING)
+
+CREDIT_SYSTEM_PROMPT = 'You assess credit risk based on alternative data such as utility bills, telecom usage, digital transactions, and location stability.'
+GENERAL_SYSTEM_PROMPT = 'You are an expert in alternative credit scoring for underserved populations.'
+
+def check_ollama_connection(model=OLLAMA_MODEL) -> bool:
+    """Check if Ollama is running, the model is available and the circuit breaker allows a call"""
+    with stage('health_check', 'request'):
+        return ollama_health.available(model)
+
+async def run_blocking(func, *args):
+    """Run blocking feature/pandas work on the bounded executor"""
+    # In a copy of the caller's context, so its stage timings count towards the request's breakdown
+    call = functools.partial(contextvars.copy_context().run, func, *args)
+    return await asyncio.get_running_loop().run_in_executor(feature_executor, call)
+
+def get_async_llm():
+    """Async Ollama client and concurrency limit for the running event loop"""
+    global _async_llm
+    loop = asyncio.get_running_loop()
+    if _async_llm is None or _async_llm[0] is not loop:
+        import ollama
+        _async_llm = (loop, ollama.AsyncClient(host=OLLAMA_HOST), asyncio.Semaphore(LLM_MAX_CONCURRENCY))
+    return _async_llm[1], _async_llm[2]
+
+def record_generation(model: str, seconds: float, response=None):
+    """Metrics of one finished model call; `response` is the reply (or last streamed part), None if it failed"""
+    observe_stage('llm_generation', model, seconds)
+    LLM_CALLS.inc(model=model, outcome='ok' if response is not None else 'error')
+    if response is not None:
+        # Ollama has the model loaded now, whether or not the startup warm-up got to it
+        warmup_status['model_warm'] = True
+    tokens = response.get('eval_count') if response is not None else None
+    if tokens:
+        LLM_TOKENS.inc(tokens, model=model)
+        # eval_duration (ns) covers generation only; without it, fall back to the call's wall time
+        generation_seconds = (response.get('eval_duration') or seconds * 1e9) / 1e9
+        if generation_seconds > 0:
+            LLM_TOKENS_PER_SECOND.observe(tokens / generation_seconds, model=model)
+
+def chat_key(model: str, messages: list, options: dict) -> tuple:
+    return model, json.dumps([messages, options], sort_keys=True, default=str)
+
+def chat_sync(model: str, messages: list, **options):
+    """ollama.chat on the shared sync client; identical concurrent calls share one generation"""
+    return llm_flights.do(chat_key(model, messages, options), _chat_sync, model, messages, options)
+
+def _chat_sync(model: str, messages: list, options: dict):
+    start = time.perf_counter()
+    response = None
     try:
-        response = ollama.chat(
-            model=model,
-            messages=[{'role': 'user', 'content': 'Hello'}]
-        )
-        return True
-    except Exception as e:
-        print(f"Ollama connection failed: {e}")
-        return False
+        response = ollama_client.chat(model=model, messages=messages, **options)
+        return response
+    finally:
+        record_generation(model, time.perf_counter() - start, response)
 
-def get_credit_score_from_llm(user_data: dict, model='gemma3:4b') -> str:
-    """Get credit score using LLM with fallback to rule-based scoring"""
-    
-    # Try LLM first
-    if check_ollama_connection(model):
+async def chat_async(model: str, messages: list, **options):
+    """ollama.chat on the async client, at most LLM_MAX_CONCURRENCY at a time; identical concurrent calls share one"""
+    return await llm_flights.do_async(chat_key(model, messages, options), _chat_async, model, messages, options)
+
+async def _chat_async(model: str, messages: list, options: dict):
+    client, limit = get_async_llm()
+    async with limit:
+        start = time.perf_counter()
+        response = None
         try:
-            summary = "\n".join([f"{k}: {v}" for k, v in user_data.items() if isinstance(v, (int, float, str))])
-            
-            prompt = f"""
+            response = await client.chat(model=model, messages=messages, **options)
+            return response
+        finally:
+            record_generation(model, time.perf_counter() - start, response)
+
+async def stream_chat_async(model: str, messages: list):
+    """ollama.chat(stream=True) on the async client, yielding text chunks as they arrive"""
+    client, limit = get_async_llm()
+    async with limit:
+        start = time.perf_counter()
+        part = None
+        try:
+            async for part in await client.chat(model=model, messages=messages, stream=True):
+                content = part['message']['content']
+                if content:
+                    yield content
+        except Exception:
+            part = None
+            raise
+        finally:
+            record_generation(model, time.perf_counter() - start, part)
+
+def build_credit_summary(user_data: dict) -> str:
+    return "\n".join([f"{k}: {v}" for k, v in user_data.items() if isinstance(v, (int, float, str))])
+
+def credit_cache_key(user_data: dict, model: str) -> str:
+    return assessment_key(build_credit_summary(user_data), model, CREDIT_PROMPT_VERSION)
+
+def build_credit_prompt(user_data: dict) -> list:
+    summary = build_credit_summary(user_data)
+
+    prompt = f"""
 You are an AI financial analyst specializing in alternative credit scoring for underserved communities.
 Assess creditworthiness based on the following user data and provide:
 1. A credit score out of 100
@@ -172,84 +605,358 @@ Assess creditworthiness based on the following user data and provide:
 User data:
 {summary}
 """
-            response = ollama.chat(
-                model=model,
-                messages=[
-                    {'role': 'system', 'content': 'You assess credit risk based on alternative data such as utility bills, telecom usage, digital transactions, and location stability.'},
-                    {'role': 'user', 'content': prompt}
-                ]
-            )
+    return [
+        {'role': 'system', 'content': CREDIT_SYSTEM_PROMPT},
+        {'role': 'user', 'content': prompt}
+    ]
+
+def get_credit_score_from_llm(user_data: dict, model=OLLAMA_MODEL) -> str:
+    """Get credit score from the trained model when one is served, else from the LLM with fallback to rule-based scoring"""
+    if credit_model is not None:
+        return ml_credit_score(user_data)
+    if LLM_OUTPUT_FORMAT != 'text':
+        return assessment_text(user_data, get_structured_credit_score(user_data, model))
+    # Concurrent requests for the same features and model wait for one assessment
+    cache_key = credit_cache_key(user_data, model)
+    return assessment_flights.do(cache_key, _credit_score_from_llm, user_data, model, cache_key)
+
+def _credit_score_from_llm(user_data: dict, model: str, cache_key: str) -> str:
+    # A previous LLM assessment of the same features is reused, even while the model is down
+    cached = assessment_cache.get(cache_key)
+    if cached is not None:
+        ASSESSMENTS.inc(source='cache')
+        return cached
+
+    # Try LLM first
+    if check_ollama_connection(model):
+        try:
+            response = chat_sync(model, build_credit_prompt(user_data))
+            ollama_health.record_success()
+            assessment_cache.put(cache_key, response['message']['content'], user_data.get('user_id'))
+            ASSESSMENTS.inc(source='llm')
             return response['message']['content']
         except Exception as e:
+            ollama_health.record_failure()
             print(f"LLM scoring failed, using rule-based fallback: {e}")
     
-    # Fallback to rule-based scoring
-    return get_rule_based_credit_score(user_data)
+    return fallback_credit_score(user_data)
+
+async def get_credit_score_from_llm_async(user_data: dict, model=OLLAMA_MODEL) -> str:
+    """Async variant of get_credit_score_from_llm"""
+    if credit_model is not None:
+        return ml_credit_score(user_data)
+    if LLM_OUTPUT_FORMAT != 'text':
+        return assessment_text(user_data, await get_structured_credit_score_async(user_data, model))
+    cache_key = credit_cache_key(user_data, model)
+    return await assessment_flights.do_async(cache_key, _credit_score_from_llm_async, user_data, model, cache_key)
+
+async def _credit_score_from_llm_async(user_data: dict, model: str, cache_key: str) -> str:
+    cached = assessment_cache.get(cache_key)
+    if cached is not None:
+        ASSESSMENTS.inc(source='cache')
+        return cached
+
+    if check_ollama_connection(model):
+        try:
+            response = await chat_async(model, build_credit_prompt(user_data))
+            ollama_health.record_success()
+            assessment_cache.put(cache_key, response['message']['content'], user_data.get('user_id'))
+            ASSESSMENTS.inc(source='llm')
+            return response['message']['content']
+        except Exception as e:
+            ollama_health.record_failure()
+            print(f"LLM scoring failed, using rule-based fallback: {e}")
+
+    return fallback_credit_score(user_data)
+
+async def stream_credit_score_from_llm(user_data: dict, model=OLLAMA_MODEL):
+    """Streaming variant of get_credit_score_from_llm; falls back to the rule-based text if the LLM fails before its first token"""
+    if credit_model is not None:
+        yield ml_credit_score(user_data)
+        return
+    if LLM_OUTPUT_FORMAT != 'text':
+        # A JSON answer is only useful once it is complete and validated
+        yield assessment_text(user_data, await get_structured_credit_score_async(user_data, model))
+        return
+    cache_key = credit_cache_key(user_data, model)
+    cached = assessment_cache.get(cache_key)
+    if cached is not None:
+        ASSESSMENTS.inc(source='cache')
+        yield cached
+        return
+
+    if check_ollama_connection(model):
+        started = False
+        parts = []
+        try:
+            async for chunk in stream_chat_async(model, build_credit_prompt(user_data)):
+                started = True
+                parts.append(chunk)
+                yield chunk
+            ollama_health.record_success()
+            assessment_cache.put(cache_key, "".join(parts), user_data.get('user_id'))
+            ASSESSMENTS.inc(source='llm')
+            return
+        except Exception as e:
+            ollama_health.record_failure()
+            print(f"LLM scoring failed, using rule-based fallback: {e}")
+            if started:
+                yield f"\n[LLM stream interrupted: {e}]"
+                return
+
+    yield fallback_credit_score(user_data)
+
+# Bump whenever build_structured_credit_prompt changes
+STRUCTURED_PROMPT_VERSION = 1
+
+def structured_format(output_format: Optional[str] = None) -> str:
+    """Requested structured output format; free-text configurations get plain JSON mode"""
+    output_format = output_format or LLM_OUTPUT_FORMAT
+    return 'json' if output_format == 'text' else output_format
+
+def structured_cache_key(user_data: dict, model: str, output_format: str) -> str:
+    return assessment_key(build_credit_summary(user_data), model, f"{output_format}-{STRUCTURED_PROMPT_VERSION}")
+
+def build_structured_credit_prompt(user_data: dict) -> list:
+    prompt = f"""
+Assess the creditworthiness of this user from their alternative data.
+Reply with JSON only, at most {MAX_FACTORS} factors and one or two sentences of reasoning:
+{{"score": <credit score 0-100>, "factors": ["<key factor>", ...], "reasoning": "<why>"}}
+
+User data:
+{build_credit_summary(user_data)}
+"""
+    return [
+        {'role': 'system', 'content': CREDIT_SYSTEM_PROMPT},
+        {'role': 'user', 'content': prompt}
+    ]
+
+def structured_options(output_format: str, users: int = 1) -> dict:
+    """chat() arguments that constrain the answer's format and bound its length"""
+    return {'format': format_option(output_format, batch=users > 1),
+            'options': {'num_predict': LLM_STRUCTURED_MAX_TOKENS * users}}
+
+def rule_based_assessment(user_data: dict) -> dict:
+    """get_rule_based_credit_score as a structured assessment"""
+    ASSESSMENTS.inc(source='rules')
+    rules = matched_rules(user_data)
+    score = max(MIN_SCORE, min(MAX_SCORE, BASE_SCORE + sum(rule.points for rule in rules)))
+    return {'score': score, 'factors': [f"{rule.label} ({rule.points:+d})" for rule in rules],
+            'reasoning': "Rule-based assessment from alternative data.", 'source': 'rules'}
+
+def assessment_text(user_data: dict, assessment: dict) -> str:
+    if assessment['source'] == 'llm':
+        return format_llm_assessment(assessment)
+    return fallback_credit_text(user_data)
+
+def _cached_assessment(cache_key: str) -> Optional[dict]:
+    cached = assessment_cache.get(cache_key)
+    if cached is None:
+        return None
+    ASSESSMENTS.inc(source='cache')
+    return {**json.loads(cached), 'source': 'llm'}
+
+def _parsed_assessment(user_data: dict, content: str, cache_key: str) -> Optional[dict]:
+    assessment = parse_assessment(content)
+    if assessment is None:
+        print("LLM returned a malformed assessment, using rule-based fallback")
+        return None
+    assessment_cache.put(cache_key, json.dumps(assessment), user_data.get('user_id'))
+    ASSESSMENTS.inc(source='llm')
+    return {**assessment, 'source': 'llm'}
+
+def get_structured_credit_score(user_data: dict, model=OLLAMA_MODEL, output_format: Optional[str] = None) -> dict:
+    """
+    {"score", "factors", "reasoning", "source"} from the trained model when
+    one is served (source "ml"), else from the LLM's JSON answer (source
+    "llm"), or from the rule-based scorer (source "rules") when the LLM is
+    unavailable or its answer does not validate.
+    """
+    if credit_model is not None:
+        return ml_assessment(user_data)
+    output_format = structured_format(output_format)
+    cache_key = structured_cache_key(user_data, model, output_format)
+    return assessment_flights.do(cache_key, _structured_credit_score, user_data, model, output_format, cache_key)
+
+def _structured_credit_score(user_data: dict, model: str, output_format: str, cache_key: str) -> dict:
+    cached = _cached_assessment(cache_key)
+    if cached is not None:
+        return cached
+
+    if check_ollama_connection(model):
+        try:
+            response = chat_sync(model, build_structured_credit_prompt(user_data),
+                                 **structured_options(output_format))
+            ollama_health.record_success()
+            assessment = _parsed_assessment(user_data, response['message']['content'], cache_key)
+            if assessment is not None:
+                return assessment
+        except Exception as e:
+            ollama_health.record_failure()
+            print(f"LLM scoring failed, using rule-based fallback: {e}")
+
+    return fallback_assessment(user_data)
+
+async def get_structured_credit_score_async(user_data: dict, model=OLLAMA_MODEL,
+                                            output_format: Optional[str] = None) -> dict:
+    """Async variant of get_structured_credit_score"""
+    if credit_model is not None:
+        return ml_assessment(user_data)
+    output_format = structured_format(output_format)
+    cache_key = structured_cache_key(user_data, model, output_format)
+    return await assessment_flights.do_async(cache_key, _structured_credit_score_async, user_data, model,
+                                             output_format, cache_key)
+
+async def _structured_credit_score_async(user_data: dict, model: str, output_format: str, cache_key: str) -> dict:
+    cached = _cached_assessment(cache_key)
+    if cached is not None:
+        return cached
+
+    if check_ollama_connection(model):
+        try:
+            response = await chat_async(model, build_structured_credit_prompt(user_data),
+                                        **structured_options(output_format))
+            ollama_health.record_success()
+            assessment = _parsed_assessment(user_data, response['message']['content'], cache_key)
+            if assessment is not None:
+                return assessment
+        except Exception as e:
+            ollama_health.record_failure()
+            print(f"LLM scoring failed, using rule-based fallback: {e}")
+
+    return fallback_assessment(user_data)
+
+# Bump whenever build_batch_credit_prompt changes
+BATCH_PROMPT_VERSION = 1
+
+def batch_cache_key(user_data: dict, model: str) -> str:
+    return assessment_key(build_credit_summary(user_data), model, f"batch-{BATCH_PROMPT_VERSION}")
+
+def build_batch_credit_prompt(users: list) -> list:
+    sections = "\n\n".join(f"--- user {user.get('user_id')} ---\n{build_credit_summary(user)}" for user in users)
+    prompt = f"""
+Assess the creditworthiness of each of the following {len(users)} users from their alternative data.
+Reply with JSON only, one entry per user:
+{{"assessments": [{{"user_id": <user_id>, "score": <credit score 0-100>, "factors": ["<key factor>", ...], "reasoning": "<one or two sentences>"}}]}}
+
+{sections}
+"""
+    return [
+        {'role': 'system', 'content': CREDIT_SYSTEM_PROMPT},
+        {'role': 'user', 'content': prompt}
+    ]
+
+def format_llm_assessment(assessment: dict) -> str:
+    """Text of a parsed {score, factors, reasoning} assessment, laid out like the rule-based one"""
+    score = assessment['score']
+    return f"""
+**LLM CREDIT ASSESSMENT**
+Credit Score: {score}/100
+
+Key Factors:
+{chr(10).join([f'• {factor}' for factor in assessment['factors']])}
+
+Risk Level: {risk_level(score)}
+
+Reasoning: {assessment['reasoning']}
+"""
+
+async def llm_call_with_retry(model: str, messages: list, retries: int = LLM_RETRIES, **options) -> str:
+    """One chat call, retried with backoff; raises once the attempts are used up or the model is down"""
+    async def attempt():
+        if not check_ollama_connection(model):
+            raise LLMUnavailable(f"model {model} is not available")
+        return await chat_async(model, messages, **options)
+
+    def failed(e):
+        ollama_health.record_failure()
+        print(f"LLM call failed: {e}")
+
+    response = await retry_async(attempt, attempts=retries, base_delay=LLM_RETRY_DELAY, on_failure=failed)
+    ollama_health.record_success()
+    return response['message']['content']
+
+async def score_users_with_llm(users: List[dict], mode: str = LLM_BATCH_MODE, batch_size: int = LLM_BATCH_SIZE,
+                               concurrency: int = LLM_MAX_CONCURRENCY, model=OLLAMA_MODEL) -> List[str]:
+    """
+    LLM assessments for many users, in input order. "concurrent" sends one
+    prompt per user, "packed" asks about `batch_size` users per prompt; at
+    most `concurrency` calls are in flight. Users the LLM could not assess
+    get the rule-based assessment.
+    """
+    if mode not in BATCH_MODES:
+        raise ValueError(f"Unknown batch mode {mode!r}, expected one of {BATCH_MODES}")
+    # Free-text answers are cached as they are, structured ones as their validated JSON
+    structured = mode == 'packed' or LLM_OUTPUT_FORMAT != 'text'
+    output_format = structured_format()
+    if mode == 'packed':
+        cache_key = lambda user: batch_cache_key(user, model)
+    elif structured:
+        cache_key = lambda user: structured_cache_key(user, model, output_format)
+    else:
+        cache_key = lambda user: credit_cache_key(user, model)
+    results: List[Optional[str]] = [None] * len(users)
+    pending = []
+    for i, user in enumerate(users):
+        key = cache_key(user)
+        cached = assessment_cache.get(key)
+        if cached is None:
+            pending.append((i, key))
+        else:
+            results[i] = format_llm_assessment(json.loads(cached)) if structured else cached
+    ASSESSMENTS.inc(len(users) - len(pending), source='cache')
+    limit = asyncio.Semaphore(concurrency)
+
+    def store(i, key, assessment: dict):
+        assessment_cache.put(key, json.dumps(assessment), users[i].get('user_id'))
+        results[i] = format_llm_assessment(assessment)
+
+    async def one(i, key):
+        async with limit:
+            if not structured:
+                content = await llm_call_with_retry(model, build_credit_prompt(users[i]))
+                assessment_cache.put(key, content, users[i].get('user_id'))
+                results[i] = content
+                return
+            content = await llm_call_with_retry(model, build_structured_credit_prompt(users[i]),
+                                                **structured_options(output_format))
+        assessment = parse_assessment(content)
+        if assessment is not None:
+            store(i, key, assessment)
+
+    async def packed(group):
+        ids = [users[i].get('user_id', i) for i, _ in group]
+        async with limit:
+            content = await llm_call_with_retry(model, build_batch_credit_prompt([users[i] for i, _ in group]),
+                                                **structured_options(output_format, len(group)))
+        assessments = parse_batch_response(content, ids)
+        for (i, key), user_id in zip(group, ids):
+            if int(user_id) in assessments:
+                store(i, key, assessments[int(user_id)])
+
+    jobs = [one(i, key) for i, key in pending] if mode == 'concurrent' \
+        else [packed(group) for group in chunked(pending, batch_size)]
+    errors = [e for e in await asyncio.gather(*jobs, return_exceptions=True) if isinstance(e, Exception)]
+    missing = sum(result is None for result in results)
+    ASSESSMENTS.inc(len(pending) - missing, source='llm')
+    ASSESSMENTS.inc(missing, source=fallback_source())
+    if errors or missing:
+        print(f"LLM batch scoring: {len(errors)} of {len(jobs)} calls failed, "
+              f"{missing} users scored by the {fallback_source()} fallback" + (f" ({errors[0]})" if errors else ""))
+    return [result if result is not None else fallback_credit_text(user) for result, user in zip(results, users)]
 
 def get_rule_based_credit_score(user_data: dict) -> str:
     """Rule-based credit scoring as fallback when LLM is unavailable"""
-    score = 50  # Base score
+    score = BASE_SCORE
     factors = []
-    
-    # Income factors
-    avg_salary = user_data.get('avg_salary', 0)
-    gig_income = user_data.get('gig_income_total', 0)
-    
-    if avg_salary > 20000:
-        score += 15
-        factors.append("High salary income (+15)")
-    elif avg_salary > 10000:
-        score += 8
-        factors.append("Moderate salary income (+8)")
-    
-    if gig_income > 5000:
-        score += 10
-        factors.append("Additional gig income (+10)")
-    
-    # Payment behavior
-    utility_spend = user_data.get('monthly_utility_spend', 0)
-    if 0 < utility_spend < 2000:
-        score += 12
-        factors.append("Regular utility payments (+12)")
-    elif utility_spend > 3000:
-        score -= 8
-        factors.append("High utility expenses (-8)")
-    
-    # Digital activity
-    upi_total = user_data.get('upi_total_spent', 0)
-    if upi_total > 5000:
-        score += 8
-        factors.append("Active digital transactions (+8)")
-    
-    # Location stability
-    location_stability = user_data.get('location_stability', '')
-    if location_stability == 'high':
-        score += 10
-        factors.append("High location stability (+10)")
-    elif location_stability == 'medium':
-        score += 5
-        factors.append("Medium location stability (+5)")
-    
-    # Loan history
-    outstanding_amount = user_data.get('outstanding_amount', 0)
-    on_time_repayments = user_data.get('on_time_repayments', 0)
-    
-    if outstanding_amount > 30000:
-        score -= 15
-        factors.append("High outstanding debt (-15)")
-    elif outstanding_amount > 10000:
-        score -= 8
-        factors.append("Moderate outstanding debt (-8)")
-    
-    if on_time_repayments > 0.8:
-        score += 12
-        factors.append("Good repayment history (+12)")
-    elif on_time_repayments > 0.5:
-        score += 6
-        factors.append("Fair repayment history (+6)")
-    
+
+    # Income, payment behavior, digital activity, location stability and loan history rules
+    for rule in matched_rules(user_data):
+        score += rule.points
+        factors.append(f"{rule.label} ({rule.points:+d})")
+
     # Cap the score between 0 and 100
-    score = max(0, min(100, score))
+    score = max(MIN_SCORE, min(MAX_SCORE, score))
     
     assessment = f"""
 **RULE-BASED CREDIT ASSESSMENT**
@@ -258,7 +965,7 @@ Credit Score: {score}/100
 Key Factors:
 {chr(10).join([f'• {factor}' for factor in factors])}
 
-Risk Level: {'Low' if score >= 70 else 'Medium' if score >= 50 else 'High'}
+Risk Level: {risk_level(score)}
 
 Note: This assessment is based on alternative data sources including utility payments, 
 digital transaction patterns, income sources, and location stability.
@@ -267,100 +974,378 @@ digital transaction patterns, income sources, and location stability.
     return assessment
 
 
+# ---------------------------
+# 2️⃣b TRAINED MODEL SCORING
+# ---------------------------
+# The trained model (app/services/ml_scoring.py, written by train_model.py) scores
+# without the LLM in microseconds; once loaded it is the primary scorer, replacing
+# both the LLM and the rules, and the LLM is only asked to explain a model score on
+# demand (explain_ml_score_async, /score/ml with "explain").
+
+# Newest artifact in ML_MODEL_DIR, loaded by warm_up(); None keeps the LLM, with the rule-based fallback
+credit_model: Optional[CreditModel] = None
+# Why the newest artifact was not served (ml_scoring.serving_problem), if it wasn't
+credit_model_problem: Optional[str] = None
+
+# Bump whenever build_ml_explanation_prompt changes
+ML_EXPLANATION_PROMPT_VERSION = 1
+
+def load_credit_model() -> Optional[CreditModel]:
+    """Newest artifact, if it passes the serving check; otherwise the LLM and the rule-based fallback keep scoring"""
+    global credit_model, credit_model_problem
+    credit_model, credit_model_problem = None, None
+    try:
+        model = load_latest(ML_MODEL_DIR)
+    except Exception as e:
+        print(f"Could not load the trained model from {ML_MODEL_DIR}: {e}")
+        return None
+    if model is not None:
+        credit_model_problem = serving_problem(model, ML_MIN_HOLDOUT_AUC)
+        if credit_model_problem:
+            print(f"Not serving trained model v{model.version}, keeping the LLM and rule-based scoring: {credit_model_problem}")
+            credit_model_problem = f"v{model.version}: {credit_model_problem}"
+        else:
+            credit_model = model
+    return credit_model
+
+def fallback_source() -> str:
+    return 'ml' if credit_model is not None else 'rules'
+
+def feature_label(feature: str) -> str:
+    return feature.replace('_', ' ').capitalize()
+
+def ml_factors(scores: MLScores, row: int = 0) -> List[str]:
+    return [f"{feature_label(feature)} ({'raises' if value > 0 else 'lowers'} the score, {value:+.2f} log-odds)"
+            for feature, value in scores.top_factors(row)]
+
+def predict_user(user_data: dict) -> MLScores:
+    with stage('ml_scoring', f"v{credit_model.version}"):
+        return credit_model.predict_user(user_data)
+
+def ml_credit_text(user_data: dict) -> str:
+    scores = predict_user(user_data)
+    score = int(scores.score[0])
+    return f"""
+**ML CREDIT ASSESSMENT**
+Credit Score: {score}/100
+
+Key Factors:
+{chr(10).join([f'• {factor}' for factor in ml_factors(scores)])}
+
+Risk Level: {risk_level(score)}
+
+Note: Scored by trained model v{scores.version} from alternative data; estimated probability of
+on-time repayment {scores.probability[0]:.0%}.
+"""
+
+def ml_credit_score(user_data: dict) -> str:
+    ASSESSMENTS.inc(source='ml')
+    return ml_credit_text(user_data)
+
+def ml_assessment(user_data: dict) -> dict:
+    ASSESSMENTS.inc(source='ml')
+    scores = predict_user(user_data)
+    return {'score': int(scores.score[0]), 'factors': ml_factors(scores),
+            'reasoning': f"Trained model v{scores.version} assessment from alternative data.", 'source': 'ml'}
+
+def fallback_credit_text(user_data: dict) -> str:
+    """Assessment text without the LLM: the trained model's when one is loaded, else the rules'"""
+    if credit_model is not None:
+        return ml_credit_text(user_data)
+    return get_rule_based_credit_score(user_data)
+
+def fallback_credit_score(user_data: dict) -> str:
+    ASSESSMENTS.inc(source=fallback_source())
+    return fallback_credit_text(user_data)
+
+def fallback_assessment(user_data: dict) -> dict:
+    """The structured assessment used when the LLM is unavailable or its answer doesn't validate"""
+    if credit_model is None:
+        return rule_based_assessment(user_data)
+    return ml_assessment(user_data)
+
+def build_ml_explanation_prompt(user_data: dict, scores: MLScores, row: int = 0) -> list:
+    score = int(scores.score[row])
+    factors = "\n".join(f"- {factor}" for factor in ml_factors(scores, row))
+    prompt = f"""
+A credit model scored this user {score}/100 ({risk_level(score)} risk).
+The features that moved the score most:
+{factors}
+
+Explain this score to a loan officer in two or three sentences, using the user data below.
+Do not change or re-estimate the score.
+
+User data:
+{build_credit_summary(user_data)}
+"""
+    return [
+        {'role': 'system', 'content': CREDIT_SYSTEM_PROMPT},
+        {'role': 'user', 'content': prompt}
+    ]
+
+async def explain_ml_score_async(user_data: dict, scores: MLScores, row: int = 0, model=OLLAMA_MODEL) -> dict:
+    """{"explanation", "explanation_source"}: the LLM's narrative of a model score, or the model's top factors"""
+    cache_key = assessment_key(build_credit_summary(user_data), model,
+                               f"ml-{scores.version}-{ML_EXPLANATION_PROMPT_VERSION}")
+    cached = assessment_cache.get(cache_key)
+    if cached is not None:
+        return {'explanation': cached, 'explanation_source': 'llm'}
+    if check_ollama_connection(model):
+        try:
+            response = await chat_async(model, build_ml_explanation_prompt(user_data, scores, row))
+            ollama_health.record_success()
+            content = response['message']['content']
+            assessment_cache.put(cache_key, content, user_data.get('user_id'))
+            return {'explanation': content, 'explanation_source': 'llm'}
+        except Exception as e:
+            ollama_health.record_failure()
+            print(f"LLM explanation failed, using the model's factors: {e}")
+    return {'explanation': "Main factors: " + "; ".join(ml_factors(scores, row)), 'explanation_source': 'model'}
+
+
 # ---------------------------
 # 3️⃣ SIMPLIFIED QUERY PROCESSOR
 # ---------------------------
 
-def process_user_query(query: str, model='gemma3:4b') -> str:
+NO_DATA_MESSAGE = "Error: Unable to load user data. Please check if CSV files are available."
+NO_LLM_MESSAGE = "I can help you with credit scoring queries. Try asking about specific users or type 'help' for available commands."
+
+def classify_query(query_lower: str) -> str:
+    """Map a lower-cased query to one of: list, assess, help, general"""
+    if 'list' in query_lower and 'user' in query_lower:
+        return 'list'
+    elif 'credit score' in query_lower or 'assess' in query_lower or 'creditworthiness' in query_lower:
+        return 'assess'
+    elif 'help' in query_lower:
+        return 'help'
+    return 'general'
+
+_user_index: Optional[UserIndex] = None
+
+def get_user_index() -> UserIndex:
+    """Name/user_id index over the current feature table, rebuilt when the table changes"""
+    global _user_index
+    master_data = feature_store.get()
+    index = _user_index
+    if index is None or index.version != feature_store.version:
+        index = _user_index = UserIndex(master_data, feature_store.version)
+    return index
+
+def find_user_in_query(query_lower: str) -> Optional[Tuple[int, str]]:
+    """(user_id, name) of the first known user mentioned in the query"""
+    with stage('name_lookup', 'query'):
+        mentions = get_user_index().find_mentions(query_lower)
+    return mentions[0] if mentions else None
+
+def build_general_prompt(query: str, user_count: int) -> list:
+    data_summary = f"System has {user_count} users with financial and alternative credit data."
+
+    prompt = f"""
+You are a credit scoring assistant. The user asked: {query}
+
+Available data: {data_summary}
+
+Please provide a helpful response about credit scoring, user assessment, or system capabilities.
+"""
+    return [
+        {'role': 'system', 'content': GENERAL_SYSTEM_PROMPT},
+        {'role': 'user', 'content': prompt}
+    ]
+
+def process_user_query(query: str, model=OLLAMA_MODEL) -> str:
     """
     Process user query and return appropriate response
     """
     query_lower = query.lower()
+    intent = classify_query(query_lower)
     
     try:
         # Handle different types of queries
-        if 'list' in query_lower and 'user' in query_lower:
+        if intent == 'list':
             return list_available_users()
         
-        elif 'credit score' in query_lower or 'assess' in query_lower or 'creditworthiness' in query_lower:
+        elif intent == 'assess':
             # Try to extract user name from query
-            master_data = master_agent()
+            master_data = feature_store.get()
             if master_data.empty:
-                return "Error: Unable to load user data. Please check if CSV files are available."
-            
-            # Look for user names in the query
-            user_found = None
-            for _, row in master_data.iterrows():
-                if pd.notna(row['name']) and row['name'].lower() in query_lower:
-                    user_found = row['name']
-                    break
+                return NO_DATA_MESSAGE
             
+            user_found = find_user_in_query(query_lower)
             if user_found:
-                return get_user_credit_assessment(user_found)
+                user_id, name = user_found
+                return get_user_credit_assessment(name, user_id)
             else:
                 return f"Please specify a user name. Available users: {list_available_users()}"
         
-        elif 'help' in query_lower:
+        elif intent == 'help':
             return get_help_message()
         
         else:
             # General query - try to use LLM if available
             if check_ollama_connection(model):
                 try:
-                    master_data = master_agent()
-                    data_summary = f"System has {len(master_data)} users with financial and alternative credit data."
-                    
-                    prompt = f"""
-You are a credit scoring assistant. The user asked: {query}
+                    master_data = feature_store.get()
+                    response = chat_sync(model, build_general_prompt(query, len(master_data)))
+                    ollama_health.record_success()
+                    return response['message']['content']
+                except Exception as e:
+                    ollama_health.record_failure()
+                    return f"Error processing query with LLM: {e}"
+            else:
+                return NO_LLM_MESSAGE
+    
+    except Exception as e:
+        return f"Error processing query: {e}"
 
-Available data: {data_summary}
+async def process_user_query_async(query: str, model=OLLAMA_MODEL) -> str:
+    """
+    Async variant of process_user_query for the API: pandas work runs on the
+    feature executor and LLM calls on the async client, so a slow model
+    response never blocks the event loop
+    """
+    query_lower = query.lower()
+    intent = classify_query(query_lower)
 
-Please provide a helpful response about credit scoring, user assessment, or system capabilities.
-"""
-                    response = ollama.chat(
-                        model=model,
-                        messages=[
-                            {'role': 'system', 'content': 'You are an expert in alternative credit scoring for underserved populations.'},
-                            {'role': 'user', 'content': prompt}
-                        ]
-                    )
+    try:
+        if intent == 'list':
+            return await run_blocking(list_available_users)
+
+        elif intent == 'assess':
+            master_data = await run_blocking(feature_store.get)
+            if master_data.empty:
+                return NO_DATA_MESSAGE
+
+            user_found = await run_blocking(find_user_in_query, query_lower)
+            if user_found:
+                user_id, name = user_found
+                return await get_user_credit_assessment_async(name, user_id)
+            else:
+                return f"Please specify a user name. Available users: {await run_blocking(list_available_users)}"
+
+        elif intent == 'help':
+            return get_help_message()
+
+        else:
+            if check_ollama_connection(model):
+                try:
+                    master_data = await run_blocking(feature_store.get)
+                    response = await chat_async(model, build_general_prompt(query, len(master_data)))
+                    ollama_health.record_success()
                     return response['message']['content']
                 except Exception as e:
+                    ollama_health.record_failure()
                     return f"Error processing query with LLM: {e}"
             else:
-                return "I can help you with credit scoring queries. Try asking about specific users or type 'help' for available commands."
-    
+                return NO_LLM_MESSAGE
+
     except Exception as e:
         return f"Error processing query: {e}"
 
-def get_user_credit_assessment(name: str) -> str:
-    """Get credit assessment for a specific user"""
+async def stream_user_query(query: str, model=OLLAMA_MODEL):
+    """
+    Streaming variant of process_user_query_async: assessments and general
+    LLM answers are yielded chunk by chunk, everything else as one chunk
+    """
+    query_lower = query.lower()
+    intent = classify_query(query_lower)
+
     try:
-        result_df = master_agent()
-        if result_df.empty:
-            return "Error: Unable to load user data."
-        
-        user_data = result_df[result_df['name'].str.contains(name, case=False, na=False)]
-        
-        if user_data.empty:
-            available_users = result_df['name'].dropna().tolist()[:10]
-            return f"No user found matching '{name}'. Available users: {', '.join(available_users)}"
-        
-        user_row = user_data.iloc[0].to_dict()
-        llm_result = get_credit_score_from_llm(user_row)
-        
-        return f"""
+        if intent == 'assess':
+            master_data = await run_blocking(feature_store.get)
+            user_found = None if master_data.empty else await run_blocking(find_user_in_query, query_lower)
+            if user_found:
+                user_id, name = user_found
+                user_row, error = await run_blocking(lookup_user, name, user_id)
+                if error:
+                    yield error
+                    return
+                yield assessment_header(user_row)
+                async for chunk in stream_credit_score_from_llm(user_row, model):
+                    yield chunk
+                yield "\n"
+                return
+
+        elif intent == 'general' and check_ollama_connection(model):
+            try:
+                master_data = await run_blocking(feature_store.get)
+                async for chunk in stream_chat_async(model, build_general_prompt(query, len(master_data))):
+                    yield chunk
+                ollama_health.record_success()
+            except Exception as e:
+                ollama_health.record_failure()
+                yield f"Error processing query with LLM: {e}"
+            return
+
+    except Exception as e:
+        yield f"Error processing query: {e}"
+        return
+
+    yield await process_user_query_async(query, model)
+
+def lookup_user(name: str, user_id=None):
+    """
+    Return (feature row, None) for the given user_id, else for the first user
+    named `name` (exact name via the index, then partial match), or (None, error message)
+    """
+    result_df = feature_store.get()
+    if result_df.empty:
+        return None, "Error: Unable to load user data."
+
+    if user_id is not None:
+        user_row = feature_store.get_user(user_id)
+        if user_row is not None:
+            return user_row, None
+
+    with stage('name_lookup', 'name'):
+        user_ids = get_user_index().ids_for_name(name)
+        if user_ids:
+            return feature_store.get_user(user_ids[0]), None
+
+        user_data = result_df[result_df['name'].str.contains(name, case=False, na=False, regex=False)]
+
+    if user_data.empty:
+        available_users = result_df['name'].dropna().tolist()[:10]
+        return None, f"No user found matching '{name}'. Available users: {', '.join(available_users)}"
+    
+    return feature_store.get_user(user_data.iloc[0]['user_id']), None
+
+def assessment_header(user_row: dict) -> str:
+    return f"""
 Credit Assessment for: {user_row['name']}
 {'='*50}
-{llm_result}
 """
+
+def format_assessment(user_row: dict, llm_result: str) -> str:
+    return f"{assessment_header(user_row)}{llm_result}\n"
+
+def get_user_credit_assessment(name: str, user_id=None) -> str:
+    """Get credit assessment for a specific user (by user_id when known, else by name)"""
+    try:
+        user_row, error = lookup_user(name, user_id)
+        if error:
+            return error
+        
+        llm_result = get_credit_score_from_llm(user_row)
+        return format_assessment(user_row, llm_result)
+    except Exception as e:
+        return f"Error generating assessment for {name}: {str(e)}"
+
+async def get_user_credit_assessment_async(name: str, user_id=None) -> str:
+    """Async variant of get_user_credit_assessment"""
+    try:
+        user_row, error = await run_blocking(lookup_user, name, user_id)
+        if error:
+            return error
+
+        llm_result = await get_credit_score_from_llm_async(user_row)
+        return format_assessment(user_row, llm_result)
     except Exception as e:
         return f"Error generating assessment for {name}: {str(e)}"
 
 def list_available_users() -> str:
     """List all available users"""
     try:
-        users_df = pd.read_csv(os.path.join(DATA_DIR, "users.csv"))
+        users_df = load_csv(os.path.join(DATA_DIR, "users.csv"))
         users = users_df['name'].dropna().tolist()
         return f"Available users ({len(users)}): {', '.join(users[:20])}" + \
                (f" ... and {len(users)-20} more" if len(users) > 20 else "")
@@ -389,17 +1374,64 @@ Note: If Ollama is not running, the system will use rule-based scoring as fallba
 # 4️⃣ MAIN INTERFACE
 # ---------------------------
 
+# Filled in by warm_up(): the server is live as soon as it accepts connections, ready once
+# the feature table is built, and the model is warm once Ollama has it loaded
+warmup_status = {'features_ready': False, 'model_warm': False, 'ml_model': None, 'error': None, 'seconds': {}}
+
+def warm_model(model=OLLAMA_MODEL) -> bool:
+    """Have Ollama load the model (a chat without messages only loads it), so the first assessment doesn't wait for that"""
+    if not check_ollama_connection(model):
+        return False
+    try:
+        with stage('warmup', 'model'):
+            ollama_client.chat(model=model, messages=[])
+        ollama_health.record_success()
+        return True
+    except Exception as e:
+        ollama_health.record_failure()
+        print(f"Model warm-up failed: {e}")
+        return False
+
+def start_background_warm_up():
+    """Startup of whatever app serves this pipeline (this one, or the chat app with AGENT_MODE=inprocess)"""
+    ollama_health.start()
+    # Accept connections right away; requests that need the feature table wait for this one build
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+def warm_up():
+    """Startup work, once and off the event loop: load the trained model, build the feature table, then load the LLM"""
+    model = load_credit_model()
+    warmup_status['ml_model'] = None if model is None else model.version
+    start = time.perf_counter()
+    try:
+        with stage('warmup', 'features'):
+            features = feature_store.warm()
+        if features.empty:
+            raise RuntimeError("the feature table is empty")
+    except Exception as e:
+        warmup_status['error'] = f"Data loading failed, please check the CSV files: {e}"
+        print(f"✗ {warmup_status['error']}")
+        return
+    warmup_status['features_ready'] = True
+    warmup_status['seconds']['features'] = round(time.perf_counter() - start, 3)
+    run_credit_agent()
+
+    start = time.perf_counter()
+    if warm_model():
+        warmup_status['model_warm'] = True
+        warmup_status['seconds']['model'] = round(time.perf_counter() - start, 3)
+
 def run_credit_agent():
     """Main interface for the credit scoring agent"""
     print("=== Credit Scoring Agent ===")
     print("Type 'help' for available commands or 'exit' to quit")
     
     # Check system status
-    ollama_status = "✓ Connected" if check_ollama_connection() else "✗ Not available (using rule-based fallback)"
+    ollama_status = "✓ Connected" if ollama_health.is_healthy(OLLAMA_MODEL) else "✗ Not available (using rule-based fallback)"
     print(f"Ollama LLM Status: {ollama_status}")
     
     try:
-        master_data = master_agent()
+        master_data = feature_store.get()
         print(f"Data Status: ✓ Loaded {len(master_data)} users")
     except Exception as e:
         print(f"Data Status: ✗ Error loading data: {e}")
@@ -441,14 +1473,14 @@ def test_system():
     
     # Test data loading
     try:
-        master_data = master_agent()
+        master_data = feature_store.get()
         print(f"✓ Data loaded successfully: {len(master_data)} users")
     except Exception as e:
         print(f"✗ Data loading failed: {e}")
         return False
     
     # Test LLM connection
-    if check_ollama_connection():
+    if ollama_health.is_healthy(OLLAMA_MODEL):
         print("✓ Ollama LLM connected")
     else:
         print("✗ Ollama LLM not available, will use rule-based fallback")
@@ -1 +1,911 @@
 # Pytest unit/integration tests for agent
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+import ollama
+import pandas as pd
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import batch_score
+import server
+import train_model
+from app.api.routes import chat
+from app.core import metrics
+from app.services.aggregation import MonthlySpec, monthly_stats, monthly_totals, user_monthly_stats
+from app.services.agent_service import HttpAgentClient, InProcessAgentClient
+from app.services.chat_store import ChatStore
+from app.services.feature_store import FeatureNode, FeatureStore
+from app.services.llm_batch import ASSESSMENT_SCHEMA, parse_assessment, parse_batch_response
+from app.services.llm_cache import AssessmentCache
+from app.services.llm_health import OPEN, CircuitBreaker, OllamaHealthMonitor
+from app.services.ml_scoring import CreditModel, load_latest, train_credit_model
+from app.services.rule_scoring import score_batch
+from app.services.sharding import make_shards
+from app.services.single_flight import SingleFlight
+from app.services.task_graph import Task, run_tasks
+from app.services.user_index import UserIndex
+from app.utils import columnar_cache
+from app.utils.columnar_cache import load_csv
+from app.utils.lazy import Lazy
+from benchmarks import suite
+from benchmarks.stub_ollama import STUB_SCORE, StubOllama, assessment_reply
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """A private copy of docs/ so tests can modify the source CSVs"""
+    for name in {node.source for node in server.FEATURE_NODES}:
+        shutil.copy(f"{server.DATA_DIR}/{name}", tmp_path / name)
+    monkeypatch.setattr(server, "DATA_DIR", str(tmp_path))
+    return tmp_path
+
+
+def make_store(data_dir):
+    return FeatureStore(server.FEATURE_NODES, server.assemble_feature_table, str(data_dir),
+                        loader=load_csv, prepare=server.prepare_source)
+
+
+def test_feature_store_builds_once_and_reloads_sources_with_a_new_mtime(tmp_path):
+    (tmp_path / "users.csv").write_text("user_id,name\n1,Asha\n2,Ravi\n")
+    (tmp_path / "spend.csv").write_text("user_id,amount\n1,10.0\n2,5.0\n1,2.5\n")
+    nodes = [FeatureNode('users', 'users.csv', ['name'], lambda df: df.set_index('user_id')[['name']]),
+             FeatureNode('spend', 'spend.csv', ['spend'],
+                         lambda df: df.groupby('user_id')['amount'].sum().rename('spend').to_frame())]
+    reads = []
+
+    def prepare(df):
+        reads.append(len(df))
+        return df
+
+    store = FeatureStore(nodes, lambda outputs: outputs['users'].join(outputs['spend']).reset_index(),
+                         str(tmp_path), prepare=prepare)
+    table = store.get()
+    assert len(reads) == 2 and store.version == 1
+
+    # Later reads are served from the built table without reading any CSV
+    assert store.get() is table and store.get_user(1)['spend'] == 12.5
+    assert len(reads) == 2 and store.version == 1
+
+    # A newer mtime alone (same bytes) marks just that source stale
+    path = tmp_path / "users.csv"
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert store.is_stale()
+    pd.testing.assert_frame_equal(store.get(), table)
+    assert len(reads) == 3 and store.last_refresh == {"users": "full"} and store.version == 2
+
+
+def test_feature_store_matches_master_agent(data_dir):
+    store = make_store(data_dir)
+    pd.testing.assert_frame_equal(store.warm(), server.master_agent(), check_exact=False)
+
+
+def test_feature_store_folds_appended_rows(data_dir):
+    store = make_store(data_dir)
+    store.warm()
+    with open(data_dir / "upi_transactions.csv", "a") as f:
+        f.write("1,2025-06-01 10:00:00.000000,1000.0,debit,PhonePe\n")
+
+    table = store.get()
+
+    assert store.last_refresh == {"upi": "append"}
+    assert store.dependents("upi_transactions.csv") == ["upi_total_spent"]
+    assert store.last_changed_users == [1]
+    pd.testing.assert_frame_equal(table, server.master_agent(), check_exact=False)
+
+
+def test_feature_store_recomputes_rewritten_source(data_dir):
+    store = make_store(data_dir)
+    store.warm()
+    salary = pd.read_csv(data_dir / "salary_income.csv")
+    salary["amount"] = salary["amount"] * 2
+    salary.to_csv(data_dir / "salary_income.csv", index=False)
+
+    table = store.get()
+
+    assert store.last_refresh == {"salary": "full"}
+    pd.testing.assert_frame_equal(table, server.master_agent(), check_exact=False)
+
+
+def test_feature_store_degrades_per_source(data_dir):
+    store = make_store(data_dir)
+    before = store.warm()
+    gig = store.dependents("gig_income.csv")
+    original = (data_dir / "gig_income.csv").read_bytes()
+    (data_dir / "gig_income.csv").write_text("not,the,columns\n1,2,3\n")
+    salary = pd.read_csv(data_dir / "salary_income.csv")
+    salary["amount"] = salary["amount"] * 2
+    salary.to_csv(data_dir / "salary_income.csv", index=False)
+
+    # The broken source keeps its last good columns; the other change still lands
+    table = store.get()
+    assert not store.last_results["gig_income.csv"].ok and store.last_results["salary_income.csv"].ok
+    assert store.last_results["salary_income.csv"].seconds > 0
+    pd.testing.assert_frame_equal(table[gig], before[gig])
+    assert not table['avg_salary'].equals(before['avg_salary'])
+    assert not store.is_stale()
+
+    # Built from scratch, only its own columns are missing
+    fresh = make_store(data_dir).warm()
+    assert len(fresh) == len(before) and not set(gig) & set(fresh.columns) and 'avg_salary' in fresh
+
+    # Fixed, it is read in full again
+    (data_dir / "gig_income.csv").write_bytes(original)
+    assert store.get()[gig].equals(before[gig]) and store.last_refresh == {"gig": "full"}
+
+
+def test_feature_store_streams_sources_in_chunks(data_dir):
+    whole = make_store(data_dir).warm()
+    # A 1-byte budget means MIN_CHUNK_ROWS rows per chunk, so every event file is split
+    store = FeatureStore(server.FEATURE_NODES, server.assemble_feature_table, str(data_dir),
+                         prepare=server.prepare_source, memory_budget=1)
+    text = ['name', 'home_location', 'work_location', 'location_stability']
+
+    streamed = store.warm()
+    pd.testing.assert_frame_equal(streamed.astype({c: str for c in text}), whole.astype({c: str for c in text}))
+
+    with open(data_dir / "wallet_balances.csv") as f:
+        f.readline()
+        user_id, wallet_type = f.readline().split(",")[:2]
+    with open(data_dir / "wallet_balances.csv", "a") as f:
+        f.write(f"{user_id},2025-06-01 10:00:00.000000,{wallet_type},123.0\n")
+    store.get()
+    assert store.last_refresh == {"wallet": "append"}
+    assert store.get_user(int(user_id))[wallet_type] == 123.0
+
+
+def test_score_batch_matches_per_user_scorer():
+    features = server.feature_store.get()
+    scores = score_batch(features)
+
+    for row, score, level in zip(features.to_dict('records'), scores.score, scores.risk_level):
+        assessment = server.get_rule_based_credit_score(row)
+        assert f"Credit Score: {score}/100" in assessment
+        assert f"Risk Level: {level}" in assessment
+
+
+def test_score_batch_keeps_request_order_and_reports_unknown_ids():
+    features = server.feature_store.get()
+    expected = score_batch(features).to_frame().set_index('user_id')
+
+    body = TestClient(server.app).post("/score/batch", json={"user_ids": [7, 99999, 2, 5]}).json()
+
+    assert [r["user_id"] for r in body["results"]] == [7, 2, 5] and body["count"] == 3
+    assert [r["score"] for r in body["results"]] == expected.loc[[7, 2, 5], 'score'].tolist()
+    assert body["missing_user_ids"] == [99999]
+
+
+def test_sharded_scoring_is_deterministic():
+    ids = np.arange(1, 10001)
+    for mode in ('hash', 'range'):
+        masks = [shard.mask(ids) for shard in make_shards(mode, 4, ids)]
+        assert (np.sum(masks, axis=0) == 1).all()
+
+    expected = score_batch(server.feature_store.get()).to_frame(True)
+    single = batch_score.run_sharded(server.DATA_DIR, workers=1, contributions=True)
+    sharded = batch_score.run_sharded(server.DATA_DIR, workers=2, shards=3, shard_by='range', contributions=True)
+
+    pd.testing.assert_frame_equal(single, sharded)
+    pd.testing.assert_frame_equal(single.drop(columns='name'), expected, check_dtype=False)
+    assert len(batch_score.last_shard_run) == 3
+
+
+def test_sharded_scoring_llm_column(stub_ollama):
+    frame = batch_score.run_sharded(server.DATA_DIR, workers=1, shards=2, user_ids=[1, 2, 3],
+                                    llm=True, llm_concurrency=2)
+    assert frame['user_id'].tolist() == [1, 2, 3]
+    assert (frame['llm_assessment'] == stub_ollama.reply).all()
+
+
+def test_user_index_finds_every_mention():
+    users = pd.DataFrame({
+        'user_id': [1, 2, 3, 4, 5],
+        'name': ["Ann Lee", "Ann Lee Smith", "Bob O'Neil", "Ann Lee", None],
+    })
+    index = UserIndex(users)
+
+    assert index.find_mentions("compare bob o'neil with ANN LEE smith") == [(3, "Bob O'Neil"), (2, "Ann Lee Smith")]
+    assert index.find_mentions("credit score for ann lee?") == [(1, "Ann Lee"), (4, "Ann Lee")]
+    assert index.find_mentions("assess user 5 and user_id 3") == [(3, "Bob O'Neil")]
+    assert index.find_mentions("joanna leesmith") == []
+    assert index.ids_for_name("  ann   LEE ") == [1, 4]
+
+
+def test_find_user_in_query_matches_name_scan():
+    master_data = server.feature_store.get()
+    for row in master_data.head(200).itertuples():
+        assert server.find_user_in_query(f"assess {row.name.lower()} please")[1] == row.name
+    assert server.find_user_in_query("assess user 42")[0] == 42
+
+
+def test_columnar_cache_is_keyed_per_source(tmp_path, monkeypatch):
+    cache = tmp_path / "cache"
+    monkeypatch.setattr(columnar_cache, "COLUMNAR_CACHE_DIR", str(cache))
+    parses = []
+    read_csv = pd.read_csv
+    monkeypatch.setattr(pd, "read_csv", lambda path: parses.append(path) or read_csv(path))
+    first, second = tmp_path / "a" / "users.csv", tmp_path / "b" / "users.csv"
+    for path, name in ((first, "Asha"), (second, "Ravi")):
+        path.parent.mkdir()
+        path.write_text(f"user_id,name,amount\n1,{name},10.5\n")
+
+    # A hit memory-maps the columns without parsing the CSV again
+    assert load_csv(str(first))['name'].tolist() == ["Asha"]
+    assert load_csv(str(first))['amount'].dtype == np.float32 and len(parses) == 1
+
+    # A file with the same name elsewhere gets its own entry and evicts nothing
+    assert load_csv(str(second))['name'].tolist() == ["Ravi"] and len(parses) == 2
+    assert len(os.listdir(cache)) == 2 and load_csv(str(first))['name'].tolist() == ["Asha"] and len(parses) == 2
+
+    # New contents replace only the older version of the same source
+    first.write_text("user_id,name,amount\n1,Meera,20.0\n")
+    assert load_csv(str(first))['name'].tolist() == ["Meera"] and len(parses) == 3
+    assert sorted(len(os.listdir(cache / source)) for source in os.listdir(cache)) == [1, 1]
+    assert load_csv(str(second))['name'].tolist() == ["Ravi"] and len(parses) == 3
+
+    # An unreadable entry is re-parsed and rewritten
+    target = columnar_cache._cache_dir(str(first), str(cache))
+    with open(os.path.join(target, "meta.json"), "w") as f:
+        f.write("{not json")
+    assert load_csv(str(first))['name'].tolist() == ["Meera"] and len(parses) == 4
+    assert load_csv(str(first))['name'].tolist() == ["Meera"] and len(parses) == 4
+
+
+def test_monthly_stats_match_pandas_reference():
+    spec = MonthlySpec('amount', {'mean': 'mean', 'std': 'std', 'trend': 'trend',
+                                  'regularity': 'regularity', 'months': 'months'})
+    bills = load_csv(str(server.DATA_DIR) + "/bill_payments.csv")
+    monthly = bills.assign(m=bills['timestamp'].dt.year * 12 + bills['timestamp'].dt.month,
+                           amount=bills['amount'].astype(float)) \
+                   .groupby(['user_id', 'm'])['amount'].sum().reset_index()
+    grouped = monthly.groupby('user_id')
+    expected = pd.DataFrame({
+        'mean': grouped['amount'].mean(),
+        'std': grouped['amount'].std(),
+        'trend': grouped.apply(lambda g: np.polyfit(g['m'], g['amount'], 1)[0] if len(g) > 1 else 0.0),
+        'regularity': grouped.size() / (grouped['m'].max() - grouped['m'].min() + 1),
+        'months': grouped.size().astype(float),
+    })
+
+    streamed = user_monthly_stats(bills, spec, block_rows=500)
+    pd.testing.assert_frame_equal(streamed, expected, check_exact=False, check_index_type=False, check_names=False)
+    shuffled = bills.sample(frac=1, random_state=0)
+    pd.testing.assert_frame_equal(monthly_stats(monthly_totals(shuffled, 'amount', block_rows=777), spec), streamed,
+                                  check_exact=False)
+
+
+def test_run_tasks_isolates_failures():
+    def boom(users):
+        raise ValueError("bad file")
+
+    results = run_tasks([
+        Task('users', lambda: [1, 2]),
+        Task('double', lambda users: [u * 2 for u in users], deps=['users']),
+        Task('broken', boom, deps=['users']),
+        Task('after_broken', lambda value: value, deps=['broken']),
+        Task('offset', lambda n, users: [u + n for u in users], deps=['users'], args=(10,)),
+    ])
+
+    assert results['double'].value == [2, 4] and results['offset'].value == [11, 12]
+    assert results['broken'].error == "ValueError: bad file"
+    assert results['after_broken'].error == "dependency failed: broken"
+
+
+def test_run_tasks_resolves_failed_dependencies_listed_before_their_source():
+    def boom():
+        raise ValueError("bad file")
+
+    results = run_tasks([
+        Task('b', lambda a: a, deps=['a']),
+        Task('a', lambda x: x, deps=['x']),
+        Task('x', boom),
+    ])
+
+    assert results['x'].error == "ValueError: bad file"
+    assert results['a'].error == "dependency failed: x"
+    assert results['b'].error == "dependency failed: a"
+
+    with pytest.raises(ValueError, match="Dependency cycle"):
+        run_tasks([Task('p', lambda q: q, deps=['q']), Task('q', lambda p: p, deps=['p'])])
+
+
+def test_master_agent_degrades_when_one_agent_fails(data_dir, monkeypatch):
+    full = server.master_agent()
+    monkeypatch.setitem(server.AGENTS, 'agent_3_ecommerce', lambda users_df, loc_df: pd.DataFrame())
+    partial = server.master_agent()
+
+    assert not server.last_agent_run['agent_3_ecommerce'].ok
+    assert all(server.last_agent_run[name].seconds > 0 for name in ('agent_1_utilities_rent_telecom', 'agent_2_financials'))
+    assert 'monthly_ecom_spend' not in partial.columns
+    pd.testing.assert_frame_equal(partial, full[partial.columns], check_exact=False)
+
+@pytest.fixture
+def stub_ollama(monkeypatch, tmp_path):
+    stub = StubOllama(models=[server.OLLAMA_MODEL])
+    # No trained model unless a test loads one, so the fallback is the rule-based scorer
+    monkeypatch.setattr(server, "ML_MODEL_DIR", str(tmp_path / "models"))
+    monkeypatch.setattr(server, "credit_model", None)
+    monkeypatch.setattr(server, "credit_model_problem", None)
+    monitor = OllamaHealthMonitor(ollama.Client(host=stub.host, timeout=1),
+                                  CircuitBreaker(failure_threshold=2, reset_timeout=60), ttl=60)
+    monkeypatch.setattr(server, "ollama_client", ollama.Client(host=stub.host, timeout=5))
+    monkeypatch.setattr(server, "ollama_health", monitor)
+    monkeypatch.setattr(server, "OLLAMA_HOST", stub.host)
+    monkeypatch.setattr(server, "_async_llm", None)
+    monkeypatch.setattr(server, "assessment_cache", AssessmentCache())
+    yield stub
+    stub.close()
+
+
+def test_parse_batch_response_keeps_only_valid_entries():
+    content = 'Sure! {"assessments": [' \
+              '{"user_id": 1, "score": 81.6, "factors": ["Steady salary"], "reasoning": " Fine. "},' \
+              '{"user_id": 2, "score": 140, "factors": [], "reasoning": ""},' \
+              '{"user_id": 3, "score": "high"}, {"user_id": 9, "score": 50}, {"score": 50}]}'
+
+    assert parse_batch_response(content, [1, 2, 3]) == {1: {'score': 82, 'factors': ["Steady salary"],
+                                                           'reasoning': "Fine."}}
+    assert parse_batch_response("not json", [1]) == {}
+
+
+def test_parse_assessment_validates_structured_output():
+    reply = '```json\n{"score": 64, "factors": ["a", "b", "c", "d", "e", "f"], "reasoning": "ok"}\n```'
+
+    assert parse_assessment(reply) == {'score': 64, 'factors': ["a", "b", "c", "d", "e"], 'reasoning': "ok"}
+    assert parse_assessment('{"score": 101, "factors": [], "reasoning": ""}') is None
+    assert parse_assessment('{"score": 50, "factors": [1], "reasoning": ""}') is None
+    assert parse_assessment('{"score": 50, "factors": [], "reasoning": "cut off') is None
+    assert parse_assessment("Credit Score: 77/100") is None
+
+
+def test_structured_llm_assessment_and_fallback(stub_ollama, monkeypatch):
+    user = server.feature_store.get_user(1)
+    monkeypatch.setattr(server, "LLM_OUTPUT_FORMAT", "schema")
+    stub_ollama.reply = assessment_reply
+
+    assessment = server.get_structured_credit_score(user)
+    text = server.get_credit_score_from_llm(user)
+
+    assert assessment == {'score': STUB_SCORE, 'factors': ["Stub factor"], 'reasoning': "Stub reasoning.",
+                          'source': 'llm'}
+    assert f"Credit Score: {STUB_SCORE}/100" in text
+    assert stub_ollama.chat_calls() == 1
+    assert stub_ollama.last_chat['format'] == ASSESSMENT_SCHEMA
+    assert stub_ollama.last_chat['options']['num_predict'] == server.LLM_STRUCTURED_MAX_TOKENS
+
+    # Free text where JSON was asked for is rejected in favour of the rule-based score
+    stub_ollama.reply = "Credit Score: 77/100 (stub)"
+    fallback = asyncio.run(server.get_structured_credit_score_async(user, output_format='json'))
+    assert fallback['source'] == 'rules'
+    assert fallback['score'] == score_batch(server.feature_store.get(), [1]).score[0]
+    assert server.get_credit_score_from_llm({**user, 'avg_salary': 1.0}) == \
+        server.get_rule_based_credit_score({**user, 'avg_salary': 1.0})
+
+
+def test_score_llm_endpoint_returns_numeric_scores(stub_ollama):
+    stub_ollama.reply = assessment_reply
+    client = TestClient(server.app)
+
+    body = client.post("/score/llm", json={"user_ids": [1, 2, 999999], "output_format": "json"}).json()
+
+    assert body["count"] == 2 and body["missing_user_ids"] == [999999]
+    assert [(r["user_id"], r["score"], r["source"]) for r in body["results"]] == [(1, STUB_SCORE, 'llm'),
+                                                                                    (2, STUB_SCORE, 'llm')]
+    assert "error" in client.post("/score/llm", json={"user_ids": [1], "output_format": "xml"}).json()
+
+
+def test_packed_llm_scoring_falls_back_per_user(stub_ollama):
+    users = server.feature_store.get().head(5).to_dict('records')
+    last = users[-1]['user_id']
+    # The model "forgets" the last user of its batch
+    stub_ollama.reply = lambda body: json.dumps({"assessments": [
+        entry for entry in json.loads(assessment_reply(body))["assessments"] if entry["user_id"] != last]})
+
+    results = asyncio.run(server.score_users_with_llm(users, mode='packed', batch_size=3))
+
+    assert stub_ollama.chat_calls() == 2
+    assert all(f"Credit Score: {STUB_SCORE}/100" in result for result in results[:-1])
+    assert results[-1] == server.get_rule_based_credit_score(users[-1])
+
+
+def test_concurrent_llm_scoring_retries_failed_calls(stub_ollama, monkeypatch):
+    monkeypatch.setattr(server, "LLM_RETRY_DELAY", 0)
+    users = server.feature_store.get().head(4).to_dict('records')
+    stub_ollama.fail_next = 1
+
+    results = asyncio.run(server.score_users_with_llm(users, mode='concurrent', concurrency=2))
+
+    assert results == [stub_ollama.reply] * 4
+    assert stub_ollama.chat_calls() == 5
+    stub_ollama.chat_status = 500
+    assert asyncio.run(server.score_users_with_llm(users[:1], mode='packed')) == \
+        [server.get_rule_based_credit_score(users[0])]
+
+
+def test_llm_assessment_skips_hello_probe(stub_ollama):
+    first = server.get_credit_score_from_llm(server.feature_store.get_user(1))
+    second = server.get_credit_score_from_llm(server.feature_store.get_user(2))
+
+    assert first == second == "Credit Score: 77/100 (stub)"
+    # one cached /api/tags probe, then only the real generation calls
+    assert stub_ollama.requests == ["/api/tags", "/api/chat", "/api/chat"]
+
+
+def test_llm_assessment_is_cached_per_feature_row(stub_ollama):
+    user = server.feature_store.get_user(1)
+
+    first = server.get_credit_score_from_llm(user)
+    stub_ollama.reply = "Credit Score: 12/100 (new model output)"
+    again = server.get_credit_score_from_llm(dict(user))
+    changed = server.get_credit_score_from_llm({**user, "avg_salary": user["avg_salary"] + 1})
+
+    assert first == again == "Credit Score: 77/100 (stub)"
+    assert changed == "Credit Score: 12/100 (new model output)"
+    assert stub_ollama.chat_calls() == 2
+    assert server.assessment_cache.stats()["hits"] == 1
+
+
+def test_assessment_cache_disk_tier_and_user_invalidation(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = AssessmentCache(max_entries=1, path=path)
+    cache.put("a", "assessment a", user_id=1)
+    cache.put("b", "assessment b", user_id=2)
+
+    assert cache.stats()["evictions"] == 1
+    restarted = AssessmentCache(path=path)
+    assert restarted.get("a") == "assessment a"
+    restarted.invalidate_users([1])
+    assert restarted.get("a") is None
+    assert restarted.get("b") == "assessment b"
+
+
+def test_assessment_cache_ttl():
+    now = [0.0]
+    cache = AssessmentCache(ttl=10, clock=lambda: now[0])
+    cache.put("a", "assessment a", user_id=1)
+    now[0] = 11.0
+
+    assert cache.get("a") is None
+
+
+def test_async_queries_overlap_llm_calls(stub_ollama):
+    stub_ollama.latency = 0.3
+    queries = [f"What is the credit score for {server.feature_store.get_user(user_id)['name']}?"
+               for user_id in range(1, 5)]
+
+    async def run():
+        return await asyncio.gather(*(server.process_user_query_async(query) for query in queries))
+
+    start = time.perf_counter()
+    results = asyncio.run(run())
+    elapsed = time.perf_counter() - start
+
+    assert all("Credit Score: 77/100 (stub)" in r for r in results)
+    assert stub_ollama.chat_calls() == 4
+    assert elapsed < 4 * 0.3
+
+
+def test_concurrent_assessments_of_one_user_share_one_llm_call(stub_ollama):
+    stub_ollama.latency = 0.3
+    first, second = (server.feature_store.get_user(user_id) for user_id in (1, 2))
+    coalesced = metrics.COALESCED.value(flight='assessment')
+
+    async def run():
+        return await asyncio.gather(*[server.get_user_credit_assessment_async(first['name'], 1) for _ in range(6)],
+                                    *[server.get_user_credit_assessment_async(second['name'], 2) for _ in range(2)])
+
+    results = asyncio.run(run())
+
+    assert stub_ollama.chat_calls() == 2
+    assert len(set(results[:6])) == 1 and len(set(results[6:])) == 1
+    assert "Credit Score: 77/100 (stub)" in results[0] and first['name'] in results[0]
+    assert metrics.COALESCED.value(flight='assessment') - coalesced == 6
+    assert server.cache_stats()["single_flight"]["assessment"]["in_flight"] == 0
+
+    # Threads of the sync path merge the same way; the finished assessment is then a cache hit
+    server.assessment_cache.clear()
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda _: server.get_user_credit_assessment(first['name'], 1), range(4)))
+    assert stub_ollama.chat_calls() == 3
+    assert len(set(results)) == 1
+
+
+def test_single_flight_shares_failures_and_outlives_cancelled_callers():
+    flights = SingleFlight("test")
+    calls = []
+
+    async def compute(fail):
+        calls.append(fail)
+        await asyncio.sleep(0.05)
+        if fail:
+            raise RuntimeError("model down")
+        return {"score": 70}
+
+    async def run():
+        failures = await asyncio.gather(*(flights.do_async("a", compute, True) for _ in range(3)),
+                                        return_exceptions=True)
+        first = asyncio.create_task(flights.do_async("b", compute, False))
+        second = asyncio.create_task(flights.do_async("b", compute, False))
+        await asyncio.sleep(0)
+        first.cancel()
+        return failures, await second, first
+
+    failures, result, cancelled = asyncio.run(run())
+
+    assert all(isinstance(e, RuntimeError) for e in failures)
+    assert calls == [True, False]
+    assert result == {"score": 70} and cancelled.cancelled()
+    assert flights.stats() == {'in_flight': 0, 'started': 2, 'coalesced': 3}
+
+    # A key is only shared while it runs; disabled, every call runs on its own
+    assert flights.do("c", calls.append, 1) is None and flights.do("c", calls.append, 2) is None
+    flights.enabled = False
+
+    async def run_disabled():
+        return await asyncio.gather(flights.do_async("d", compute, False), flights.do_async("d", compute, False))
+
+    asyncio.run(run_disabled())
+    assert calls[2:] == [1, 2, False, False]
+
+
+def test_process_stream_matches_process(stub_ollama):
+    query = f"Assess {server.feature_store.get_user(1)['name']}"
+    client = TestClient(server.app)
+
+    with client.stream("POST", "/process/stream", json={"query": query}) as response:
+        lines = [line for line in response.iter_lines() if line.startswith("data:")]
+    deltas = [json.loads(line[len("data:"):]) for line in lines]
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert len(deltas) > 3 and deltas[-1] == {}
+    assert "".join(d["delta"] for d in deltas[:-1]) == client.post("/process", json={"query": query}).json()["result"]
+
+
+def test_circuit_breaker_opens_after_llm_failures(stub_ollama):
+    stub_ollama.chat_status = 500
+    user = server.feature_store.get_user(1)
+
+    results = [server.get_credit_score_from_llm(user) for _ in range(4)]
+
+    assert all("RULE-BASED CREDIT ASSESSMENT" in r for r in results)
+    assert stub_ollama.chat_calls() == 2
+    assert server.ollama_health.breaker.state == OPEN
+
+
+def test_unreachable_ollama_falls_back_without_generation(stub_ollama):
+    stub_ollama.close()
+
+    result = server.get_credit_score_from_llm(server.feature_store.get_user(1))
+
+    assert "RULE-BASED CREDIT ASSESSMENT" in result
+    assert not server.check_ollama_connection()
+
+
+def test_missing_model_is_unavailable(stub_ollama):
+    stub_ollama.models = ["llama3:8b"]
+
+    assert not server.check_ollama_connection()
+    assert stub_ollama.chat_calls() == 0
+
+
+def test_circuit_breaker_half_open_trial():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    assert not breaker.allow_request()
+
+    now[0] = 10.0
+    assert breaker.allow_request()
+    assert not breaker.allow_request()  # only one trial while half-open
+    breaker.record_success()
+    assert breaker.allow_request()
+
+
+def test_metrics_render_prometheus_histograms():
+    for seconds in (0.002, 0.02, 20.0):
+        metrics.observe_stage('test_stage', 'a"b', seconds)
+    with pytest.raises(ValueError):
+        metrics.ASSESSMENTS.inc(model="x")
+
+    lines = metrics.render().splitlines()
+    series = [line for line in lines if 'stage="test_stage"' in line]
+
+    assert "# TYPE credit_stage_seconds histogram" in lines
+    assert 'credit_stage_seconds_bucket{stage="test_stage",target="a\\"b",le="0.0025"} 1' in series
+    assert 'credit_stage_seconds_bucket{stage="test_stage",target="a\\"b",le="10"} 2' in series
+    assert 'credit_stage_seconds_bucket{stage="test_stage",target="a\\"b",le="+Inf"} 3' in series
+    assert 'credit_stage_seconds_count{stage="test_stage",target="a\\"b"} 3' in series
+
+
+def test_debug_header_returns_stage_breakdown(stub_ollama):
+    client = TestClient(server.app)
+    query = {"query": f"Assess {server.feature_store.get_user(3)['name']}"}
+    llm_before = metrics.ASSESSMENTS.value(source='llm')
+    tokens_before = metrics.LLM_TOKENS.value(model=server.OLLAMA_MODEL)
+
+    debug = client.post("/process", json=query, headers={metrics.DEBUG_HEADER: "1"})
+    plain = client.post("/process", json=query)
+    exposition = client.get("/metrics")
+
+    stages = [entry.split(";")[0] for entry in debug.headers["Server-Timing"].split(", ")]
+    assert {"name_lookup", "health_check", "llm_generation", "total"} <= set(stages)
+    assert "Server-Timing" not in plain.headers
+    # The second request is answered from the assessment cache
+    assert metrics.ASSESSMENTS.value(source='llm') == llm_before + 1
+    assert metrics.LLM_TOKENS.value(model=server.OLLAMA_MODEL) == tokens_before + stub_ollama.generated_words
+    assert exposition.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'credit_http_request_seconds_count{method="POST",path="/process",status="200"}' in exposition.text
+
+
+def test_benchmark_compare_flags_slowdowns():
+    def report(**cases):
+        return {'results': {'1x': {name: {'best_ms': ms, 'median_ms': ms} for name, ms in cases.items()}}}
+    baseline = report(master_agent=40.0, help=0.002, parse_timestamp=10.0)
+    current = report(master_agent=46.0, help=0.004, parse_timestamp=8.0, new_case=1.0)
+
+    statuses = {row['case']: row['status'] for row in suite.compare(baseline, current, threshold=0.1)}
+
+    assert statuses == {'master_agent': 'REGRESSION', 'help': 'ok', 'parse_timestamp': 'faster', 'new_case': 'new'}
+    assert suite.compare(baseline, current, threshold=0.2)[0]['status'] == 'ok'
+
+
+def test_benchmark_suite_runs_and_restores_server():
+    store, client = server.feature_store, server.ollama_client
+
+    report = suite.run_suite([1], repeat=1, patterns=["process_user_query[[]assess]", "agent_3_*"], log=lambda line: None)
+
+    assert list(report['results']['1x']) == ['agent_3_ecommerce', 'process_user_query[assess]']
+    assert report['users'] == {'1x': len(store.get())}
+    assert server.feature_store is store and server.ollama_client is client
+
+
+def test_server_import_defers_ollama():
+    code = "import sys, server; print('ollama' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=server.BASE_DIR, capture_output=True, text=True, check=True)
+    assert out.stdout.strip().splitlines()[-1] == "False"
+
+
+def test_health_endpoints_split_ready_and_model_warm(stub_ollama, monkeypatch):
+    monkeypatch.setattr(server, "warmup_status", {'features_ready': False, 'model_warm': False, 'ml_model': None,
+                                                  'error': None, 'seconds': {}})
+    client = TestClient(server.app)
+    assert client.get("/health/live").status_code == 200
+    assert client.get("/health/ready").status_code == 503
+
+    server.warm_up()
+
+    ready, model = client.get("/health/ready"), client.get("/health/model")
+    assert ready.status_code == 200 and set(ready.json()["seconds"]) == {'features', 'model'}
+    assert model.status_code == 200 and model.json()["warm"]
+    # The model is loaded with a chat that has no messages, not with a generation
+    assert stub_ollama.chat_calls() == 1 and stub_ollama.last_chat["messages"] == []
+    assert stub_ollama.generated_words == 0
+
+    stub_ollama.models = ["other-model"]
+    server.ollama_health.probe()
+    assert client.get("/health/model").status_code == 503
+
+
+def test_failed_warm_up_keeps_server_unready(monkeypatch, tmp_path):
+    status = {'features_ready': False, 'model_warm': False, 'ml_model': None, 'error': None, 'seconds': {}}
+    monkeypatch.setattr(server, "warmup_status", status)
+    monkeypatch.setattr(server, "ML_MODEL_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "credit_model", None)
+    monkeypatch.setattr(server, "credit_model_problem", None)
+    monkeypatch.setattr(server.feature_store, "warm", lambda: pd.DataFrame())
+
+    server.warm_up()
+
+    response = TestClient(server.app).get("/health/ready")
+    assert response.status_code == 503 and "feature table is empty" in response.json()["error"]
+
+
+def test_chat_store_concurrent_writers_and_pages(tmp_path):
+    store = ChatStore(str(tmp_path / "chat.sqlite3"))
+
+    def writer(n):
+        for i in range(50):
+            store.append([{"role": "user", "content": f"{n}-{i}", "timestamp": time.time()},
+                          {"role": "assistant", "content": f"reply {n}-{i}", "timestamp": time.time()}],
+                         session_id=f"s{n % 2}")
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert store.count() == 800 and store.count("s0") == 400
+    seen, cursor = [], None
+    while True:
+        page, cursor = store.page("s1", cursor, limit=64)
+        seen.extend(page)
+        if cursor is None:
+            break
+    assert len(seen) == 400
+    assert [m["id"] for m in seen] == sorted(m["id"] for m in seen)
+    # Turns are written atomically, so every user message is directly followed by its reply
+    for user_msg, reply in zip(seen[::2], seen[1::2]):
+        assert reply["content"] == f"reply {user_msg['content']}"
+
+
+@pytest.fixture
+def chat_log(tmp_path, monkeypatch):
+    """The chat router's store, opened on first use from tmp_path instead of docs/"""
+    monkeypatch.setattr(chat, "CHAT_LOG_PATH", str(tmp_path / "chat.sqlite3"))
+    monkeypatch.setattr(chat, "LEGACY_CHAT_LOG_PATH", str(tmp_path / "chat_log.json"))
+    monkeypatch.setattr(chat, "chat_store", Lazy(chat.open_chat_store))
+    return chat.chat_store
+
+
+def test_chat_log_endpoints_page_by_session(chat_log, tmp_path):
+    legacy = tmp_path / "chat_log.json"
+    legacy.write_text(json.dumps([{"role": "user", "content": "hi", "timestamp": 1.0, "processed": True}]))
+    # The old JSON log is imported when the store is first used, once
+    assert not chat_log.created and chat_log.count() == 1
+    store = chat_log
+    store.clear()
+    assert store.import_json(str(legacy)) == 0
+    for i in range(5):
+        asyncio.run(chat.record_turn(chat.new_user_message(f"q{i}"), f"a{i}", "alice"))
+    asyncio.run(chat.record_turn(chat.new_user_message("other"), "reply", "bob"))
+
+    app = FastAPI()
+    app.include_router(chat.router, prefix="/chat")
+    client = TestClient(app)
+    first = client.get("/chat/get-agent-response", params={"session_id": "alice", "limit": 4}).json()
+    assert [m["content"] for m in first["chat_history"]] == ["q0", "a0", "q1", "a1"]
+    rest = client.get("/chat/get-agent-response",
+                      params={"session_id": "alice", "cursor": first["next_cursor"], "limit": 100}).json()
+    assert len(rest["chat_history"]) == 6 and rest["next_cursor"] is None
+
+    client.delete("/chat/clear-chat", params={"session_id": "alice"})
+    assert store.count("alice") == 0 and store.count("bob") == 2
+
+
+def test_inprocess_agent_warms_up_in_the_background_like_the_server(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    monkeypatch.setattr(server, "warm_up", lambda: (started.set(), release.wait(5)))
+    monkeypatch.setattr(server.ollama_health, "start", lambda: None)
+
+    # start() returns while the warm-up (trained model, features, LLM) is still running
+    asyncio.run(asyncio.wait_for(InProcessAgentClient().start(), 2))
+    assert started.wait(2) and not release.is_set()
+    release.set()
+
+
+def test_chat_agent_modes_give_the_same_reply(stub_ollama, chat_log, monkeypatch):
+    pooled = HttpAgentClient("http://agent")
+    # Route the pooled client straight into server.app instead of a real socket
+    pooled._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://agent")
+    app = FastAPI()
+    app.include_router(chat.router, prefix="/chat")
+    client = TestClient(app)
+    query = f"Assess {server.feature_store.get_user(3)['name']}"
+
+    replies = []
+    for agent in (pooled, InProcessAgentClient()):
+        monkeypatch.setattr(chat, "agent_client", agent)
+        replies.append(client.post("/chat/chat-with-agent", json={"query": query, "session_id": "s"}).json()["response"])
+        with client.stream("POST", "/chat/chat-with-agent/stream", json={"query": query, "session_id": "s"}) as response:
+            lines = [line for line in response.iter_lines() if line.startswith("data:")]
+        replies.append("".join(json.loads(line[len("data:"):]).get("delta", "") for line in lines))
+
+    assert "Credit Assessment for" in replies[0]
+    assert replies == [replies[0]] * 4
+    assert chat_log.count("s") == 8
+
+
+def synthetic_outcomes(features, seed=0):
+    """repayment_status driven by salary and location stability, so a model has something to learn"""
+    rng = np.random.default_rng(seed)
+    stability = features['location_stability'].astype(object).map({'low': -1, 'medium': 0, 'high': 1}).fillna(0)
+    salary = (features['avg_salary'] - features['avg_salary'].mean()) / features['avg_salary'].std()
+    logit = 1.5 * salary + 1.0 * stability.astype(float) + rng.normal(0, 0.5, len(features))
+    return pd.DataFrame({'user_id': features['user_id'],
+                         'repayment_status': np.where(logit > 0, 'On-Time', np.where(logit > -1, 'Late', 'Default'))})
+
+
+def test_trained_model_scores_with_exact_contributions(tmp_path):
+    features = server.feature_store.get()
+    outcomes = synthetic_outcomes(features)
+    model = train_credit_model(features, outcomes, 1, exclude=server.feature_store.dependents("loan_history.csv"))
+
+    assert model.metrics['holdout_auc'] > 0.9 and model.metrics['rows'] == len(features)
+    assert 'on_time_repayments' not in model.features and 'location_stability' in model.features
+    scores = model.predict(features)
+    logit = np.log(scores.probability / (1 - scores.probability))
+    assert np.allclose(model.intercept + scores.contributions.sum(axis=1), logit)
+    assert scores.score.min() >= 0 and scores.score.max() <= 100
+    assert scores.top_factors(0)[0][0] in ('avg_salary', 'location_stability')
+
+    # Scores are mapped onto the rule scale: same ranking as the probability, risk levels about as often as the rules
+    order = np.argsort(scores.probability)
+    assert np.all(np.diff(scores.score[order]) >= 0)
+    rules = score_batch(features)
+    for level in ('Low', 'Medium', 'High'):
+        assert abs(np.mean(scores.risk_level == level) - np.mean(rules.risk_level == level)) < 0.05
+
+    # One user dict gives the batch result; the JSON artifact round-trips, newest version wins
+    user = server.feature_store.get_user(int(features['user_id'].iloc[3]))
+    assert np.allclose(model.predict_user(user).contributions[0], scores.contributions[3])
+    model.save(str(tmp_path))
+    CreditModel(2, model.features, model.mean, model.scale, model.coef * 0, 0.0).save(str(tmp_path))
+    assert load_latest(str(tmp_path)).version == 2
+    reloaded = CreditModel.load(str(tmp_path / "credit_model_v1.json"))
+    assert np.allclose(reloaded.predict(features).probability, scores.probability)
+    assert load_latest(str(tmp_path / "missing")) is None
+
+
+def test_train_model_reads_features_and_labels_from_data_dir(data_dir, tmp_path, monkeypatch):
+    # A second dataset next to server.DATA_DIR, with fewer users
+    other = tmp_path / "other"
+    shutil.copytree(data_dir, other, ignore=shutil.ignore_patterns("other"))
+    users = pd.read_csv(other / "users.csv")
+    users.head(300).to_csv(other / "users.csv", index=False)
+    outcomes = pd.read_csv(other / "loan_history.csv")
+    labelled = outcomes[outcomes['user_id'].isin(users['user_id'].head(300))]['user_id'].nunique()
+    monkeypatch.setattr(sys, "argv", ["train_model.py", "--data-dir", str(other),
+                                      "--model-dir", str(tmp_path / "models")])
+
+    train_model.main()
+
+    model = load_latest(str(tmp_path / "models"))
+    assert model.metrics['rows'] == labelled < 1000 and 'on_time_repayments' not in model.features
+
+
+def test_trained_model_replaces_rules_as_fallback_and_explains_on_demand(stub_ollama, monkeypatch):
+    client = TestClient(server.app)
+    assert "error" in client.post("/score/ml", json={}).json()
+
+    features = server.feature_store.get()
+    model = train_credit_model(features, synthetic_outcomes(features), 3)
+    model.save(server.ML_MODEL_DIR)
+    assert server.load_credit_model().version == 3
+
+    body = client.post("/score/ml", json={"user_ids": [1, 2], "include_contributions": True}).json()
+    assert body["model_version"] == 3 and body["count"] == 2
+    assert set(body["features"]) <= set(body["results"][0]) and "explanation" not in body["results"][0]
+    expected = model.predict(features, [1, 2]).score
+    assert [r["score"] for r in body["results"]] == expected.tolist()
+
+    # The LLM only writes the narrative, on request; the score stays the model's
+    stub_ollama.reply = "Salary and a stable address drive this score."
+    body = client.post("/score/ml", json={"user_ids": [1], "explain": True}).json()
+    assert body["results"][0]["explanation"] == stub_ollama.reply
+    assert body["results"][0]["explanation_source"] == "llm" and body["results"][0]["score"] == expected[0]
+    assert "Do not change" in stub_ollama.last_chat['messages'][-1]['content']
+
+    # A served model is the primary scorer: /process, streamed and structured assessments never ask the LLM
+    calls = stub_ollama.chat_calls()
+    user = server.feature_store.get_user(1)
+    result = client.post("/process", json={"query": f"assess {user['name']}"}).json()["result"]
+    assert "ML CREDIT ASSESSMENT" in result and "trained model v3" in result
+    assert "ML CREDIT ASSESSMENT" in client.post("/process/stream", json={"query": f"assess {user['name']}"}).text
+    changed = {**user, 'avg_salary': 2.5}
+    assert asyncio.run(server.get_structured_credit_score_async(changed))['source'] == 'ml'
+    assert stub_ollama.chat_calls() == calls
+
+    # Without the LLM, explanations fall back to the model's own factors
+    stub_ollama.chat_status = 500
+    explained = asyncio.run(server.explain_ml_score_async(changed, server.predict_user(changed)))
+    assert explained['explanation_source'] == 'model' and explained['explanation'].startswith("Main factors")
+
+    # A newer model that fails the hold-out check is not served; the rules come back
+    weak = CreditModel(4, model.features, model.mean, model.scale, model.coef, model.intercept,
+                       {**model.metrics, 'holdout_auc': 0.55}, score_map=model.score_map)
+    weak.save(server.ML_MODEL_DIR)
+    assert server.load_credit_model() is None and server.fallback_source() == 'rules'
+    assert "AUC 0.55" in client.post("/score/ml", json={}).json()["error"]
+    assert "RULE-BASED CREDIT ASSESSMENT" in server.get_credit_score_from_llm({**user, "avg_salary": 3.5})
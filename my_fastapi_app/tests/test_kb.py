@@ -1 +1,248 @@
 # Pytest unit/integration tests for knowledgebase
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.routes import knowledgebase
+from app.services.embeddings import EmbeddingCache, LocalEmbedder
+from app.services.kb_chunks import ChunkTable
+from app.services.vector_index import IndexManager, current_version, new_version_dir, publish_version
+
+
+def write_text_version(kb_dir, text):
+    path = new_version_dir(kb_dir)
+    with open(os.path.join(path, "store.txt"), "w") as f:
+        f.write(text)
+    return path
+
+
+def counting_loader(loads, delay=0.0):
+    def load(path):
+        loads.append(path)
+        time.sleep(delay)
+        with open(os.path.join(path, "store.txt")) as f:
+            return f.read()
+    return load
+
+
+def test_index_manager_loads_each_version_once(tmp_path):
+    kb_dir = str(tmp_path / "kb")
+    publish_version(kb_dir, write_text_version(kb_dir, "one"))
+    loads = []
+    manager = IndexManager(str(tmp_path), counting_loader(loads, delay=0.05), check_interval=60)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(manager.get("kb"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["one"] * 8
+    assert len(loads) == 1
+    assert manager.get("missing") is None
+    assert manager.status()["kb"]["version"] == current_version(kb_dir)
+
+
+def test_index_manager_swaps_published_versions(tmp_path):
+    kb_dir = str(tmp_path / "kb")
+    publish_version(kb_dir, write_text_version(kb_dir, "one"))
+    loads = []
+    now = [0.0]
+    manager = IndexManager(str(tmp_path), counting_loader(loads), check_interval=1.0, clock=lambda: now[0])
+    assert manager.get("kb") == "one"
+
+    # Published by this process with the store in hand: swapped in without a reload
+    manager.publish("kb", write_text_version(kb_dir, "two"), "two")
+    assert manager.get("kb") == "two"
+    assert len(loads) == 1
+
+    # Published by another process: seen once the check interval has passed
+    publish_version(kb_dir, write_text_version(kb_dir, "three"))
+    assert manager.get("kb") == "two"
+    now[0] += 1.0
+    assert manager.get("kb") == "three"
+    assert len(loads) == 2
+
+    versions = [name for name in os.listdir(kb_dir) if name.startswith("v")]
+    assert len(versions) == 2 and current_version(kb_dir) in versions
+
+
+def test_index_manager_readers_never_block_or_miss_during_swaps(tmp_path):
+    kb_dir = str(tmp_path / "kb")
+    publish_version(kb_dir, write_text_version(kb_dir, "0"))
+    manager = IndexManager(str(tmp_path), counting_loader([], delay=0.01), check_interval=0)
+    manager.get("kb")
+
+    stop = threading.Event()
+    seen, misses = set(), []
+
+    def reader():
+        while not stop.is_set():
+            store = manager.get("kb")
+            if store is None:
+                misses.append(store)
+            else:
+                seen.add(store)
+
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    for i in range(1, 6):
+        publish_version(kb_dir, write_text_version(kb_dir, str(i)))
+        time.sleep(0.03)
+    time.sleep(0.05)
+    stop.set()
+    for thread in readers:
+        thread.join()
+
+    assert misses == []
+    assert "5" in seen and seen <= {str(i) for i in range(6)}
+
+
+class CountingEncoder:
+    """Stands in for a SentenceTransformer: a deterministic unit vector per text, counting the texts it sees"""
+
+    def __init__(self, dim=8):
+        self.dim = dim
+        self.batches = []
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, batch_size, normalize_embeddings, convert_to_numpy, show_progress_bar):
+        self.batches.append(list(texts))
+        vectors = np.stack([np.random.default_rng(sum(map(ord, text))).standard_normal(self.dim) for text in texts])
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_chunk_table_tracks_new_shared_and_removed_chunks():
+    table = ChunkTable()
+    delta = table.update({"a.txt": ["alpha", "beta", "alpha"], "b.txt": ["beta", "gamma"]})
+    assert sorted(delta.added.values()) == ["alpha", "beta", "gamma"] and delta.removed == []
+    ids = {text: i for i, text in delta.added.items()}
+
+    assert table.update({"a.txt": ["alpha", "beta"], "b.txt": ["beta", "gamma"]}).empty
+
+    # "beta" is still in b.txt; "alpha" was only in a.txt
+    before = table.copy()
+    delta = table.update({"a.txt": ["beta", "delta"]})
+    assert list(delta.added.values()) == ["delta"] and delta.removed == [ids["alpha"]]
+    assert table.texts([ids["beta"], ids["alpha"]]) == ["beta"]
+    assert before.texts([ids["alpha"]]) == ["alpha"] and before.chunks[table.by_id[ids["beta"]]].sources == {"a.txt", "b.txt"}
+
+    delta = table.remove_sources(["b.txt", "missing.txt"])
+    assert delta.added == {} and sorted(delta.removed) == [ids["gamma"]]
+    assert table.source_texts() == {"a.txt": ["beta", "delta"]}
+    assert len(table) == 2
+
+
+def test_embedder_only_encodes_cache_misses_in_batches(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    encoder = CountingEncoder()
+    embedder = LocalEmbedder("model-a", batch_size=2, cache=EmbeddingCache(path), model=encoder)
+
+    first = embedder.embed(["one", "two", "one"])
+    assert first.shape == (3, 8) and first.dtype == np.float32
+    assert np.allclose(first[0], first[2]) and np.allclose(np.linalg.norm(first, axis=1), 1)
+    assert encoder.batches == [["one", "two"]]
+
+    assert np.array_equal(embedder.embed(["two", "three"])[0], first[1])
+    assert encoder.batches[-1] == ["three"] and embedder.embedded == 3
+
+    # The cache outlives the process, and is kept per model
+    restarted = LocalEmbedder("model-a", cache=EmbeddingCache(path), model=CountingEncoder())
+    assert np.array_equal(restarted.embed(["one", "two", "three"])[:2], first[:2])
+    assert restarted.embedded == 0
+    other = LocalEmbedder("model-b", cache=EmbeddingCache(path), model=CountingEncoder())
+    other.embed(["one"])
+    assert other.embedded == 1
+    assert embedder.embed([]).shape == (0, 8)
+    assert embedder.embed_query("one").shape == (1, 8) and encoder.batches[-1] == ["one"]
+
+
+def test_reuploading_unchanged_files_embeds_nothing(tmp_path):
+    encoder = CountingEncoder()
+    embedder = LocalEmbedder("model-a", cache=EmbeddingCache(str(tmp_path / "embeddings.sqlite3")), model=encoder)
+    corpus = {f"doc{i}.txt": [f"chunk {i}.{j}" for j in range(20)] for i in range(5)}
+    table = ChunkTable()
+
+    delta = table.update(corpus)
+    embedder.embed(list(delta.added.values()))
+    assert embedder.embedded == 100
+
+    assert table.update(corpus).empty
+    corpus["doc0.txt"] = corpus["doc0.txt"][:10] + ["chunk 0.new"]
+    delta = table.update(corpus)
+    embedder.embed(list(delta.added.values()))
+    assert len(delta.removed) == 10 and embedder.embedded == 101
+
+
+@pytest.fixture
+def upload_client(tmp_path, monkeypatch):
+    handed_off = []
+    monkeypatch.setattr(knowledgebase, "KB_UPLOAD_DIR", str(tmp_path / "docs"))
+    monkeypatch.setattr(knowledgebase, "KB_UPLOAD_MAX_MB", 1)
+    monkeypatch.setattr(knowledgebase, "process_uploads", lambda files, kb_name: handed_off.append((files, kb_name)))
+    app = FastAPI()
+    app.include_router(knowledgebase.router, prefix="/kb")
+    with TestClient(app) as client:
+        yield client, tmp_path / "docs", handed_off
+
+
+def test_upload_streams_files_into_place_and_hands_them_off(upload_client):
+    client, docs, handed_off = upload_client
+    big = os.urandom(300_000)
+    response = client.post("/kb/add-files", data={"kb_name": "loans"},
+                           files=[("files", ("../notes.txt", b"hello")), ("files", ("export.csv", big))])
+    assert response.status_code == 200
+    body = response.json()
+    assert body["files"] == ["notes.txt", "export.csv"]
+    assert [u["status"] for u in body["uploads"]] == ["saved", "saved"]
+    assert (docs / "notes.txt").read_bytes() == b"hello" and (docs / "export.csv").read_bytes() == big
+    assert not [name for name in os.listdir(docs) if name.startswith(".upload-")]
+    [(files, kb_name)] = handed_off
+    assert kb_name == "loans" and [f.filename for f in files] == ["notes.txt", "export.csv"]
+
+    # Same bytes again are not rewritten; the same bytes under another name are placed under that name
+    mtime = os.stat(docs / "export.csv").st_mtime_ns
+    response = client.post("/kb/add-files", files=[("files", ("export.csv", big)), ("files", ("copy.csv", big))])
+    assert [(u["status"], u["duplicate_of"]) for u in response.json()["uploads"]] == \
+        [("unchanged", None), ("duplicate", "export.csv")]
+    assert os.stat(docs / "export.csv").st_mtime_ns == mtime and (docs / "copy.csv").read_bytes() == big
+    assert [f.filename for f in handed_off[-1][0]] == ["copy.csv"]
+
+    # A name holding other bytes gets the upload, even when those bytes exist under a third name
+    client.post("/kb/add-files", files=[("files", ("upi_transactions.csv", b"user_id\n2\n"))])
+    response = client.post("/kb/add-files", files=[("files", ("upi_transactions.csv", big))])
+    assert response.json()["uploads"][0]["status"] == "duplicate"
+    assert (docs / "upi_transactions.csv").read_bytes() == big
+    assert [f.filename for f in handed_off[-1][0]] == ["upi_transactions.csv"]
+
+    # A file already in docs/ that the manifest doesn't know is hashed before being replaced
+    (docs / "legacy.csv").write_bytes(b"a,b\n1,2\n")
+    response = client.post("/kb/add-files", files=[("files", ("legacy.csv", b"a,b\n1,2\n"))])
+    assert response.json()["uploads"][0]["status"] == "unchanged"
+
+
+def test_upload_over_the_cap_is_refused_and_cleaned_up(upload_client):
+    client, docs, handed_off = upload_client
+    # Refused from its Content-Length, before anything is read
+    response = client.post("/kb/add-files", files=[("files", ("huge.csv", b"x" * (1024 * 1024 + 1)))])
+    assert response.status_code == 413 and not docs.exists()
+
+    # Streamed without a length: aborted once it crosses the cap, and the partial file removed
+    head = b'--b\r\nContent-Disposition: form-data; name="files"; filename="huge.csv"\r\n\r\n'
+    body = (head, *[b"x" * 65536] * 17, b"\r\n--b--\r\n")
+    response = client.post("/kb/add-files", content=iter(body),
+                           headers={"Content-Type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413
+    assert os.listdir(docs) == [] and handed_off == []
+
+    response = client.post("/kb/add-files", data={"kb_name": "loans"})
+    assert response.status_code == 400
@@ -0,0 +1,61 @@
+"""
+Train the credit scoring model and save it as the next artifact version.
+
+    python train_model.py [--model-dir models] [--test-size 0.2] [--C 1.0] [--include-loan-features]
+
+Features are the table the server scores (the feature store's, the same as
+master_agent()'s) built over --data-dir, labels the repayment_status of
+loan_history.csv in the same directory (On-Time vs Late/Default). The columns computed from
+loan_history.csv are left out unless --include-loan-features is given,
+since they come from the same rows as the label. The server loads the newest
+artifact (app/services/ml_scoring.py) when it starts, and serves it only if
+its hold-out AUC reaches ML_MIN_HOLDOUT_AUC.
+"""
+import argparse
+import os
+import time
+
+import server
+from app.core.settings import AGENT_WORKERS, ML_MIN_HOLDOUT_AUC, ML_MODEL_DIR
+from app.services.feature_store import FeatureStore
+from app.services.ml_scoring import artifact_versions, serving_problem, train_credit_model
+from app.utils.columnar_cache import load_csv
+
+OUTCOME_SOURCE = "loan_history.csv"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the ML credit scorer on docs/")
+    parser.add_argument("--model-dir", default=ML_MODEL_DIR, help="Directory of the versioned model artifacts")
+    parser.add_argument("--data-dir", default=server.DATA_DIR, help="Directory with the source CSVs")
+    parser.add_argument("--test-size", type=float, default=0.2, help="Share of users held out for the metrics")
+    parser.add_argument("--C", type=float, default=1.0, help="Inverse L2 regularisation strength")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--include-loan-features", action="store_true",
+                        help=f"Also train on the columns computed from {OUTCOME_SOURCE}")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    # Features and labels from the same directory
+    store = FeatureStore(server.FEATURE_NODES, server.assemble_feature_table, args.data_dir,
+                         loader=load_csv, prepare=server.prepare_source, workers=AGENT_WORKERS)
+    features = store.warm()
+    if features.empty:
+        raise SystemExit("Error: Unable to load user data. Please check if CSV files are available.")
+    outcomes = load_csv(os.path.join(args.data_dir, OUTCOME_SOURCE))
+    exclude = [] if args.include_loan_features else store.dependents(OUTCOME_SOURCE)
+
+    version = max(artifact_versions(args.model_dir), default=0) + 1
+    model = train_credit_model(features, outcomes, version, exclude=exclude, test_size=args.test_size,
+                               C=args.C, seed=args.seed)
+    path = model.save(args.model_dir)
+    print(f"Trained model v{version} on {model.metrics['rows']} users, {len(model.features)} features "
+          f"in {time.perf_counter() - start:.2f} s -> {path}")
+    print(", ".join(f"{key} {value}" for key, value in model.metrics.items() if key.startswith('holdout')))
+    problem = serving_problem(model, ML_MIN_HOLDOUT_AUC)
+    print(f"Not served, the server keeps the rule-based fallback: {problem}" if problem else
+          "Passes the serving check; the server will use it")
+
+
+if __name__ == "__main__":
+    main()